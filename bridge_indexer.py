@@ -0,0 +1,76 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+
+from dotenv import load_dotenv
+
+from engine import bridge_events
+from rpc import http_session, provider_pool
+
+# event -> chain the contract emitting it is deployed on
+EVENT_CHAINS = {
+    "bridge_init": "gnosis",
+    "bridge_finalize": "arb1",
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="index BridgeInit / BridgeFinalize events and list pending bridges")
+    parser.add_argument("--skip-index", action="store_true", help="only report on what is already indexed")
+    parser.add_argument("--json", action="store_true", help="output json lines instead of a table")
+    args = parser.parse_args()
+
+    # load environment variables
+    load_dotenv()
+
+    # load config
+    with open(os.path.normpath("config.json"), 'r') as f:
+        config = json.load(f)
+
+    http_session.configure(config)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logger = logging.getLogger("bridge_indexer")
+
+    bridge_config = config["bridge"]
+
+    with sqlite3.connect(config["db_location"]) as db:
+        bridge_events.create_schema(db)
+
+        if not args.skip_index:
+            for event, chain in EVENT_CHAINS.items():
+                if not bridge_config[chain]["address"]:
+                    logger.error(f"no bridge contract configured for [{chain}], skipping [{event}]")
+                    continue
+
+                logger.info(f"indexing [{event}] on [{chain}]...")
+                indexed = bridge_events.index_events(provider_pool.get_web3(chain, config), db, event,
+                                                     bridge_config[chain]["address"],
+                                                     bridge_config[chain]["start_block"],
+                                                     chunk_size=bridge_config.get("chunk_size",
+                                                                                  bridge_events.DEFAULT_CHUNK_SIZE),
+                                                     confirmations=bridge_config.get(
+                                                         "confirmations", bridge_events.DEFAULT_CONFIRMATIONS),
+                                                     logger=logger)
+                logger.info(f"  {indexed} new events.")
+
+        pending = bridge_events.pending_bridges(db)
+        unmatched = bridge_events.unmatched_finalizations(db)
+
+    if args.json:
+        for row in pending:
+            print(json.dumps({"type": "pending", **row}))
+        for row in unmatched:
+            print(json.dumps({"type": "unmatched_finalize", **row}))
+        exit(0)
+
+    print(f"{len(pending)} pending bridges")
+    for row in pending:
+        print(f"  {row['transaction_id']:>8}  {row['from_address']}  {row['value_wei'] / 10 ** 18:>14.4f}  "
+              f"{row['tx_hash']}")
+
+    if unmatched:
+        print(f"{len(unmatched)} finalizations without a matching BridgeInit")
+        for row in unmatched:
+            print(f"  {row['transaction_id']:>8}  {row['sender']}  {row['tx_hash']}")
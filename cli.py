@@ -0,0 +1,83 @@
+import argparse
+import importlib
+import sys
+
+# single entry point for the shuttle and its one-shot tools:
+#
+#   python cli.py shuttle run [--source race]
+#   python cli.py shuttle backfill --hash 0x... [--dry-run]
+#   python cli.py shuttle quarantine [--release ID ...]
+#   python cli.py lottery draw
+#   python cli.py migrate contrib
+#   python cli.py migrate exposure [--block mainnet=N --block gnosis=N]
+#   python cli.py migrate snapshot import|export|lookup|diff
+#
+# each command lives in its own script and is only imported when it is the one being run, so web3, praw and the abis
+# are loaded by the commands that need them and not by the rest.  the scripts still run on their own as before
+
+# group -> command -> (module, help)
+COMMANDS = {
+    "shuttle": {
+        "run": ("shuttle", "run the shuttle engine"),
+        "backfill": ("shuttle_tx_helper", "backfill shuttle deposits the indexer missed"),
+        "quarantine": ("quarantine", "list quarantined shuttle entries or release them"),
+    },
+    "lottery": {
+        "draw": ("lottery", "draw the shuttle lottery now, the shuttle pays the winner out"),
+    },
+    "migrate": {
+        "contrib": ("migrate_contrib", "build the safe transactions for the arb1 contrib migration"),
+        "exposure": ("snapshot_exposure", "per user donut exposure (wallet, lp, staked lp) at a pinned block"),
+        "snapshot": ("migration_snapshot", "binary migration snapshots: import / export csv, lookups, diffs"),
+    },
+}
+
+
+def add_shuttle_run_arguments(parser):
+    parser.add_argument("--source", help="transfer source: gnosisscan, blockscout, rpc_logs or race (default: config)")
+    parser.add_argument("--log-name", default="shuttle", help="log file name (default: shuttle)")
+
+
+def run_shuttle(module, args):
+    module.main(args.source, log_name=args.log_name)
+
+
+def build_parser(argv):
+    parser = argparse.ArgumentParser(prog="cli.py", description="arb1 shuttle tools")
+    groups = parser.add_subparsers(dest="group", required=True)
+
+    for group, commands in COMMANDS.items():
+        group_parser = groups.add_parser(group)
+        subcommands = group_parser.add_subparsers(dest="command", required=True)
+
+        for command, (module_name, help_text) in commands.items():
+            command_parser = subcommands.add_parser(command, help=help_text, description=help_text)
+            command_parser.set_defaults(module=module_name)
+
+            # only the module of the requested command is imported for its arguments
+            if argv[:2] != [group, command]:
+                continue
+
+            if module_name == "shuttle":
+                add_shuttle_run_arguments(command_parser)
+            else:
+                add_arguments = getattr(importlib.import_module(module_name), "add_arguments", None)
+                if add_arguments:
+                    add_arguments(command_parser)
+
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser(argv).parse_args(argv)
+    module = importlib.import_module(args.module)
+
+    if args.module == "shuttle":
+        run_shuttle(module, args)
+    else:
+        module.main(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+import "@openzeppelin/contracts/access/Ownable.sol";
+import "@openzeppelin/contracts/utils/cryptography/MerkleProof.sol";
+import "@openzeppelin/contracts/utils/structs/BitMaps.sol";
+
+interface IMintable {
+    function mint(address to, uint256 amount) external;
+}
+
+// reference claim contract for a merkle based migration (see engine/merkle_claim.py).  the owner (the arb1 multisig)
+// sets the root once, every user then claims their own balance with the proof from the proof file.  leaves are
+// keccak256(bytes.concat(keccak256(abi.encode(index, account, amount)))), claims are tracked by index
+contract MerkleClaim is Ownable {
+    using BitMaps for BitMaps.BitMap;
+
+    IMintable public immutable _token;
+    bytes32 public _merkleRoot;
+    BitMaps.BitMap private _claimed;
+
+    event MerkleRootSet(bytes32 merkleRoot);
+    event Claimed(uint256 index, address account, uint256 amount);
+
+    constructor(address token) {
+        _token = IMintable(token);
+    }
+
+    function setMerkleRoot(bytes32 merkleRoot) public onlyOwner {
+        _merkleRoot = merkleRoot;
+        emit MerkleRootSet(merkleRoot);
+    }
+
+    function isClaimed(uint256 index) public view returns (bool) {
+        return _claimed.get(index);
+    }
+
+    function claim(uint256 index, address account, uint256 amount, bytes32[] calldata proof) public {
+        require(_merkleRoot != bytes32(0), "Merkle root not set");
+        require(!_claimed.get(index), "Already claimed");
+
+        bytes32 leaf = keccak256(bytes.concat(keccak256(abi.encode(index, account, amount))));
+        require(MerkleProof.verify(proof, _merkleRoot, leaf), "Invalid proof");
+
+        _claimed.set(index);
+        _token.mint(account, amount);
+
+        emit Claimed(index, account, amount);
+    }
+}
@@ -0,0 +1,116 @@
+from web3.exceptions import ContractLogicError
+
+from engine import lottery_draw, shuttle_db
+
+# the estimate is for the chain state right now, the transaction is mined a moment later
+GAS_MARGIN = 1.2
+
+
+def create_schema(db):
+    # entries dropped from a batch because distribute reverts on them, kept here with the reason until someone looks
+    # at them.  their shuttle rows (or lottery draw) are moved to QUARANTINED
+    sql_create = """
+        CREATE TABLE IF NOT EXISTS
+        quarantine (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            address NVARCHAR2 NOT NULL COLLATE NOCASE,
+            amount_wei BLOB NOT NULL,
+            gno_tx_hashes NVARCHAR2,
+            lottery_draw_id INTEGER,
+            reason NVARCHAR2,
+            quarantined_at DATETIME NOT NULL,
+            released_at DATETIME
+        );
+    """
+    db.executescript(sql_create)
+
+    # released_at was added after the table went live
+    columns = [c[0] for c in db.execute("select name from pragma_table_info('quarantine');").fetchall()]
+    if "released_at" not in columns:
+        db.execute("alter table quarantine add column released_at DATETIME;")
+
+
+def estimate(distribute_contract, entries, token_address, sender):
+    # runs the exact batch against the current state (eth_estimateGas).  returns (gas, None) or (None, revert reason).
+    # only a contract revert is a reason, rpc errors (ValueError) are raised: they say nothing about the entries
+    try:
+        gas = distribute_contract.functions.distribute(
+            [d['address'] for d in entries],
+            [d['amt'] for d in entries],
+            token_address
+        ).estimate_gas({'from': sender})
+    except ContractLogicError as e:
+        return None, str(e)
+
+    return int(gas * GAS_MARGIN), None
+
+
+def _bisect(check, entries, reason):
+    if len(entries) == 1:
+        return [(entries[0], reason)]
+
+    offenders = []
+    middle = len(entries) // 2
+    for half in (entries[:middle], entries[middle:]):
+        half_reason = check(half)
+        if half_reason:
+            offenders += _bisect(check, half, half_reason)
+
+    return offenders
+
+
+def find_offenders(check, entries, reason):
+    # bisects a batch that reverts (with reason) down to the entries that revert on their own.  check(entries) returns
+    # the revert reason or None.  returns [(entry, reason)], empty when the batch only fails as a whole: every half
+    # goes through by itself (not enough tokens, gas limit), every entry reverts by itself (ie. the allowance ran out)
+    # or the rest still reverts without the offenders.  nobody is quarantined for a failure that is not theirs
+    offenders = _bisect(check, entries, reason)
+    if not offenders or len(offenders) == len(entries):
+        return []
+
+    quarantined = [entry for entry, _ in offenders]
+    if check([d for d in entries if d not in quarantined]):
+        return []
+
+    return offenders
+
+
+def quarantine(db, offenders, now):
+    cur = db.cursor()
+    for entry, reason in offenders:
+        gno_tx_hashes = entry.get("gno_tx_hashes", [])
+        cur.execute("""
+            insert into quarantine (address, amount_wei, gno_tx_hashes, lottery_draw_id, reason, quarantined_at)
+            values (?, ?, ?, ?, ?, ?);
+        """, [entry["address"], shuttle_db.wei_to_blob(entry["amt"]), ",".join(gno_tx_hashes) or None,
+              entry.get("lottery_draw_id"), reason, now])
+
+        shuttle_db.set_status(db, gno_tx_hashes, shuttle_db.QUARANTINED)
+        if entry.get("lottery_draw_id"):
+            lottery_draw.set_status(db, entry["lottery_draw_id"], shuttle_db.QUARANTINED)
+
+
+def pending(db):
+    cur = db.cursor()
+    cur.row_factory = shuttle_db.dict_factory
+    cur.execute("select * from quarantine where released_at is null order by id;")
+    return cur.fetchall()
+
+
+def release(db, quarantine_id, now):
+    # puts a quarantined entry back in the dispatch queue once whatever made distribute revert on it has been dealt
+    # with.  returns the quarantine row, or None when there is no such entry waiting to be released
+    cur = db.cursor()
+    cur.row_factory = shuttle_db.dict_factory
+    cur.execute("select * from quarantine where id = ? and released_at is null;", [quarantine_id])
+    entry = cur.fetchone()
+    if not entry:
+        return None
+
+    if entry["gno_tx_hashes"]:
+        shuttle_db.set_status(db, entry["gno_tx_hashes"].split(","), shuttle_db.QUEUED)
+    if entry["lottery_draw_id"]:
+        lottery_draw.set_status(db, entry["lottery_draw_id"], shuttle_db.QUEUED)
+
+    cur.execute("update quarantine set released_at = ? where id = ?;", [now, quarantine_id])
+    return entry
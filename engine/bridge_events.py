@@ -0,0 +1,139 @@
+from web3 import Web3
+
+from engine import shuttle_db
+
+# neither event has indexed parameters, everything is in the log data as 32 byte words
+BRIDGE_INIT_TOPIC = Web3.keccak(text="BridgeInit(uint256,address,uint256)").hex()
+BRIDGE_FINALIZE_TOPIC = Web3.keccak(text="BridgeFinalize(uint256,address)").hex()
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_CONFIRMATIONS = 100
+
+
+def create_schema(db):
+    sql_create = """
+        CREATE TABLE IF NOT EXISTS
+        bridge_init (
+            transaction_id INTEGER NOT NULL,
+            from_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+            value_wei BLOB NOT NULL,
+            block_number INTEGER NOT NULL,
+            tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+            log_index INTEGER NOT NULL,
+            PRIMARY KEY (tx_hash, log_index)
+        );
+
+        CREATE TABLE IF NOT EXISTS
+        bridge_finalize (
+            transaction_id INTEGER NOT NULL,
+            sender NVARCHAR2 NOT NULL COLLATE NOCASE,
+            block_number INTEGER NOT NULL,
+            tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+            log_index INTEGER NOT NULL,
+            PRIMARY KEY (tx_hash, log_index)
+        );
+
+        CREATE TABLE IF NOT EXISTS
+        bridge_event_cursor (
+            event NVARCHAR2 NOT NULL PRIMARY KEY,
+            last_block INTEGER NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_bridge_init_transaction_id ON bridge_init (transaction_id);
+        CREATE INDEX IF NOT EXISTS idx_bridge_finalize_transaction_id ON bridge_finalize (transaction_id);
+    """
+    cur = db.cursor()
+    cur.executescript(sql_create)
+
+
+def _words(log):
+    data = bytes(log["data"])
+    return [int.from_bytes(data[i:i + 32], "big") for i in range(0, len(data), 32)]
+
+
+def _address(word):
+    return "0x" + word.to_bytes(32, "big")[-20:].hex()
+
+
+def _bridge_init_row(log):
+    transaction_id, from_address, value = _words(log)
+    return [transaction_id, _address(from_address), shuttle_db.wei_to_blob(value), log["blockNumber"],
+            log["transactionHash"].hex(), log["logIndex"]]
+
+
+def _bridge_finalize_row(log):
+    transaction_id, sender = _words(log)
+    return [transaction_id, _address(sender), log["blockNumber"], log["transactionHash"].hex(), log["logIndex"]]
+
+
+EVENTS = {
+    "bridge_init": (BRIDGE_INIT_TOPIC, _bridge_init_row,
+                    "insert or ignore into bridge_init (transaction_id, from_address, value_wei, block_number, "
+                    "tx_hash, log_index) values (?, ?, ?, ?, ?, ?);"),
+    "bridge_finalize": (BRIDGE_FINALIZE_TOPIC, _bridge_finalize_row,
+                        "insert or ignore into bridge_finalize (transaction_id, sender, block_number, tx_hash, "
+                        "log_index) values (?, ?, ?, ?, ?);"),
+}
+
+
+def index_events(w3, db, event, contract_address, start_block, chunk_size=DEFAULT_CHUNK_SIZE,
+                 confirmations=DEFAULT_CONFIRMATIONS, logger=None):
+    # pulls one event stream by topic in block range chunks, from the stored cursor up to head - confirmations (so
+    # only final blocks are indexed and nothing has to be undone after a reorg).  the cursor is committed with each
+    # chunk, an interrupted run carries on where it stopped
+    topic, to_row, sql_insert = EVENTS[event]
+
+    cur = db.cursor()
+    cur.execute("select last_block from bridge_event_cursor where event = ?;", [event])
+    row = cur.fetchone()
+    from_block = row[0] + 1 if row else start_block
+    to_block = w3.eth.block_number - confirmations
+
+    indexed = 0
+    for chunk_start in range(from_block, to_block + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size - 1, to_block)
+        logs = w3.eth.get_logs({
+            "fromBlock": chunk_start,
+            "toBlock": chunk_end,
+            "address": w3.to_checksum_address(contract_address),
+            "topics": [topic],
+        })
+
+        cur.executemany(sql_insert, [to_row(log) for log in logs])
+        cur.execute("insert or replace into bridge_event_cursor (event, last_block) values (?, ?);",
+                    [event, chunk_end])
+        db.commit()
+
+        indexed += len(logs)
+        if logger:
+            logger.info(f"  [{event}] blocks {chunk_start}-{chunk_end}: {len(logs)} events")
+
+    return indexed
+
+
+def pending_bridges(db):
+    # bridges started on gnosis that have not been finalized on arb1 (an indexed anti join on transaction_id)
+    cur = db.cursor()
+    cur.execute("""
+        select i.transaction_id, i.from_address, i.value_wei, i.block_number, i.tx_hash
+        from bridge_init i
+        where not exists (select 1 from bridge_finalize f where f.transaction_id = i.transaction_id)
+        order by i.transaction_id;
+    """)
+    return [{"transaction_id": r[0], "from_address": r[1], "value_wei": shuttle_db.blob_to_wei(r[2]),
+             "block_number": r[3], "tx_hash": r[4]} for r in cur.fetchall()]
+
+
+def unmatched_finalizations(db):
+    # fundBridgeTransaction does not check its input, so finalizations for unknown transaction ids or with a sender
+    # other than the one that started the bridge are reported separately
+    cur = db.cursor()
+    cur.execute("""
+        select f.transaction_id, f.sender, i.from_address, f.block_number, f.tx_hash
+        from bridge_finalize f
+        left join bridge_init i on i.transaction_id = f.transaction_id
+        where i.transaction_id is null or i.from_address <> f.sender
+        order by f.transaction_id;
+    """)
+    return [{"transaction_id": r[0], "sender": r[1], "init_from_address": r[2], "block_number": r[3],
+             "tx_hash": r[4]} for r in cur.fetchall()]
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+from engine import shuttle_db
+
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_IDLE_INTERVAL = 30
+
+
+class ConfirmationWatcher(threading.Thread):
+    # deposits seen with too few confirmations are saved as DETECTED.  this thread follows the gnosis head with
+    # eth_blockNumber and moves each one on to CONFIRMED as soon as head - block >= confirmations, instead of the
+    # shuttle re-fetching and re-checking it every cycle.  before promoting, the block hash is
+    # compared with the one recorded when the deposit was seen, so a deposit that was reorged into another block
+    # (or out of the chain) is re-tracked or dropped
+    def __init__(self, w3, db_location, confirmations, logger, on_promoted=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 idle_interval=DEFAULT_IDLE_INTERVAL):
+        super().__init__(daemon=True, name="confirmation-watcher")
+        self.w3 = w3
+        self.db_location = db_location
+        self.confirmations = confirmations
+        self.logger = logger
+        self.poll_interval = poll_interval
+        self.idle_interval = idle_interval
+        self.on_promoted = on_promoted
+        self.last_head = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            interval = self.poll_interval
+            try:
+                with sqlite3.connect(self.db_location, timeout=30) as db:
+                    lowest = db.execute("select min(block_number) from shuttle where status = ?;",
+                                        [shuttle_db.DETECTED]).fetchone()[0]
+
+                if lowest is None:
+                    # nothing to watch, do not spend rpc calls following the head
+                    interval = self.idle_interval
+                else:
+                    head = self.w3.eth.block_number
+                    if head != self.last_head:
+                        self.last_head = head
+                        if head - lowest >= self.confirmations and self.promote(head) and self.on_promoted:
+                            self.on_promoted()
+            except Exception as e:
+                self.logger.error(f"confirmation watcher: {e}")
+
+            self._stop_event.wait(interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def promote(self, head):
+        with sqlite3.connect(self.db_location, timeout=30) as db:
+            db.row_factory = shuttle_db.dict_factory
+            cur = db.cursor()
+            cur.execute("select * from shuttle where status = ? and block_number <= ? order by block_number;",
+                        [shuttle_db.DETECTED, head - self.confirmations])
+            confirmed = cur.fetchall()
+
+        promoted = 0
+        for deposit in confirmed:
+            canonical_hash = self.w3.eth.get_block(deposit["block_number"])["hash"].hex()
+
+            # deposits migrated from the old pending table can lack a block hash, it is re-read from the receipt
+            if not deposit["block_hash"] or canonical_hash.lower() != deposit["block_hash"].lower():
+                self._handle_reorg(deposit)
+                continue
+
+            receipt = self.w3.eth.get_transaction_receipt(deposit["gno_tx_hash"])
+            with sqlite3.connect(self.db_location, timeout=30) as db:
+                if receipt.status:
+                    shuttle_db.set_status(db, [deposit["gno_tx_hash"]], shuttle_db.CONFIRMED)
+                    promoted += 1
+                    self.logger.info(f"confirmation watcher: [tx_hash]: {deposit['gno_tx_hash']} confirmed at "
+                                     f"block {deposit['block_number']} (head {head})")
+                else:
+                    self.logger.warning(f"confirmation watcher: [tx_hash]: {deposit['gno_tx_hash']} "
+                                        f"indicates a failed status, dropping ...")
+                    self._drop(db, deposit["gno_tx_hash"])
+
+        return promoted
+
+    def _handle_reorg(self, deposit):
+        tx_hash = deposit["gno_tx_hash"]
+        try:
+            receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+        except Exception:
+            receipt = None
+
+        with sqlite3.connect(self.db_location, timeout=30) as db:
+            if receipt is None:
+                self.logger.warning(f"confirmation watcher: [tx_hash]: {tx_hash} was reorged out, dropping ...")
+                self._drop(db, tx_hash)
+                return
+
+            block = self.w3.eth.get_block(receipt.blockNumber)
+            if not deposit["block_hash"]:
+                self.logger.info(f"confirmation watcher: [tx_hash]: {tx_hash} had no block hash, recorded "
+                                 f"block {receipt.blockNumber} from its receipt")
+            else:
+                self.logger.warning(f"confirmation watcher: [tx_hash]: {tx_hash} moved from block "
+                                    f"{deposit['block_number']} to {receipt.blockNumber} after a reorg")
+            db.execute("""
+                update shuttle set block_number = ?, block_hash = ?, gno_timestamp = ?
+                where gno_tx_hash = ? and status = ?;
+            """, [receipt.blockNumber, block["hash"].hex(), datetime.fromtimestamp(block["timestamp"]), tx_hash,
+                  shuttle_db.DETECTED])
+
+    @staticmethod
+    def _drop(db, tx_hash):
+        db.execute("delete from shuttle where gno_tx_hash = ? and status = ?;", [tx_hash, shuttle_db.DETECTED])
@@ -0,0 +1,96 @@
+import csv
+
+from engine import shuttle_db
+
+# function selectors, the calls are sent as raw eth_call batches
+BALANCE_OF = "0x70a08231"
+TOTAL_SUPPLY = "0x18160ddd"
+GET_RESERVES = "0x0902f1ac"
+TOKEN0 = "0x0dfe1681"
+
+CSV_COLUMNS = ["user", "address", "wallet_wei", "lp_wei", "staked_lp_wei", "lp_donut_wei", "staked_lp_donut_wei",
+               "total_donut_wei", "total_donut"]
+
+
+def _call(to, data, block):
+    return "eth_call", [{"to": to, "data": data}, hex(block)]
+
+
+def _balance_of(token, address, block):
+    return _call(token, BALANCE_OF + address.lower()[2:].rjust(64, "0"), block)
+
+
+def _words(response, call):
+    # the 32 byte words of an eth_call result.  a call to an address without code at the block returns "0x", that
+    # is an error here rather than a balance of nothing
+    to, block = call[1][0]["to"], int(call[1][1], 16)
+    if "error" in response:
+        raise Exception(f"eth_call to {to} failed at block {block}: {response['error']}")
+    data = (response.get("result") or "0x")[2:]
+    if not data:
+        raise Exception(f"eth_call to {to} returned no data at block {block}, is the contract deployed there?")
+    return [int(data[i:i + 64], 16) for i in range(0, len(data), 64)]
+
+
+def pool_donut_per_lp(pool, contracts, block):
+    # the pair's donut reserve and lp total supply at the block.  donut is either token0 or token1 of the pair
+    lp = contracts["lp"]
+    calls = [_call(lp, TOKEN0, block), _call(lp, GET_RESERVES, block), _call(lp, TOTAL_SUPPLY, block)]
+    token0, reserves, total_supply = [_words(r, c) for r, c in zip(pool.batch_request(calls), calls)]
+
+    donut_is_token0 = ("0x" + hex(token0[0])[2:].rjust(40, "0")).lower() == contracts["donut"].lower()
+    reserve0, reserve1 = reserves[:2]
+    return reserve0 if donut_is_token0 else reserve1, total_supply[0]
+
+
+def snapshot(pool, contracts, users, block, batch_size):
+    # every user's donut exposure at one block: wallet balance, unstaked lp and lp staked in the staking contract,
+    # the lp positions valued pro rata from the pair's donut reserve.  users is [(username, address)].  the three
+    # balances of every user are fetched in json-rpc batches (and cached, they are pinned to a final block), then
+    # each column is worked out in one pass over the whole result, in exact integer wei
+    donut_reserve, lp_supply = pool_donut_per_lp(pool, contracts, block)
+
+    calls = []
+    for token in (contracts["donut"], contracts["lp"], contracts["staking"]):
+        calls += [_balance_of(token, address, block) for _, address in users]
+
+    balances = [_words(r, c)[0] for r, c in zip(pool.batch_request(calls, batch_size), calls)]
+    n = len(users)
+    wallet, lp, staked = balances[:n], balances[n:2 * n], balances[2 * n:]
+
+    lp_donut = [b * donut_reserve // lp_supply for b in lp] if lp_supply else [0] * n
+    staked_donut = [b * donut_reserve // lp_supply for b in staked] if lp_supply else [0] * n
+    total = [w + l + s for w, l, s in zip(wallet, lp_donut, staked_donut)]
+
+    return [dict(zip(CSV_COLUMNS, row)) for row in zip(
+        [u for u, _ in users], [a for _, a in users], wallet, lp, staked, lp_donut, staked_donut, total,
+        [f"{shuttle_db.from_wei(t):f}" for t in total])]
+
+
+def merge(snapshots):
+    # one row per user from the snapshots of several chains, {chain: rows} (each pinned to its own block).  the
+    # columns of every chain are kept with the chain as prefix and total_donut_wei is the exposure over all of them
+    chains = list(snapshots)
+    columns = CSV_COLUMNS[:2] + [f"{chain}_{c}" for chain in chains for c in CSV_COLUMNS[2:-1]] + CSV_COLUMNS[-2:]
+
+    merged = {}
+    for chain, rows in snapshots.items():
+        for r in rows:
+            row = merged.setdefault(r["address"].lower(), {**dict.fromkeys(columns, 0), "user": r["user"],
+                                                           "address": r["address"]})
+            row.update({f"{chain}_{c}": r[c] for c in CSV_COLUMNS[2:-1]})
+            row["total_donut_wei"] += r["total_donut_wei"]
+
+    for row in merged.values():
+        row["total_donut"] = f"{shuttle_db.from_wei(row['total_donut_wei']):f}"
+    return columns, list(merged.values())
+
+
+def write_csv(path, rows, include_empty=False, columns=CSV_COLUMNS):
+    # one row per user, users without any exposure are left out unless include_empty is set.  rows of a merged
+    # snapshot are written with the columns returned by merge
+    positions = [c for c in columns if c.endswith(("total_donut_wei", "lp_wei"))]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(r for r in rows if include_empty or any(r[c] for c in positions))
@@ -0,0 +1,149 @@
+import secrets
+from datetime import datetime, timedelta
+
+from engine import shuttle_db
+
+DEFAULT_INTERVAL_DAYS = 7
+DEFAULT_MIN_ENTRIES = 2
+
+# draw status -> status of the deposits in its pot
+POT_STATUS = {
+    shuttle_db.QUEUED: shuttle_db.LOTTERY_DRAWN,
+    shuttle_db.DISTRIBUTED: shuttle_db.LOTTERY_PAID,
+    shuttle_db.QUARANTINED: shuttle_db.QUARANTINED,
+}
+
+
+def create_schema(db):
+    # a draw moves through the same states as a shuttle: drawn (QUEUED) -> SUBMITTED -> DISTRIBUTED -> NOTIFIED.
+    # the deposits in its pot (lottery_entry) are moved from LOTTERY to LOTTERY_DRAWN when it is drawn, to
+    # LOTTERY_PAID once the payout succeeds and are quarantined (and released) together with it.  only one draw is
+    # drawn at a time
+    sql_create = """
+        CREATE TABLE IF NOT EXISTS
+        lottery_draw (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            winner_user NVARCHAR2 COLLATE NOCASE,
+            winner_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+            amount_wei BLOB NOT NULL,
+            entries INTEGER NOT NULL,
+            status NVARCHAR2 NOT NULL,
+            arb_tx_hash NVARCHAR2 COLLATE NOCASE,
+            drawn_at DATETIME NOT NULL,
+            submitted_at DATETIME,
+            processed_at DATETIME,
+            notified_at DATETIME
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_lottery_draw_status ON lottery_draw (status);
+        CREATE INDEX IF NOT EXISTS idx_lottery_draw_arb_tx_hash ON lottery_draw (arb_tx_hash);
+
+        CREATE TABLE IF NOT EXISTS
+        lottery_entry (
+            lottery_draw_id INTEGER NOT NULL,
+            gno_tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+            PRIMARY KEY (lottery_draw_id, gno_tx_hash)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_lottery_entry_gno_tx_hash ON lottery_entry (gno_tx_hash);
+    """
+    db.executescript(sql_create)
+
+    # pots drawn before lottery_entry existed belong to the latest draw that is still open, without one they go back
+    # into the lottery
+    db.execute(f"""
+        insert or ignore into lottery_entry (lottery_draw_id, gno_tx_hash)
+        select d.id, s.gno_tx_hash
+        from shuttle s, (select max(id) as id from lottery_draw where status in (?, ?, ?)) d
+        where s.status = ?
+          and d.id is not null
+          and not exists (select 1 from lottery_entry e where e.gno_tx_hash = s.gno_tx_hash);
+    """, [shuttle_db.QUEUED, shuttle_db.SUBMITTED, shuttle_db.DISTRIBUTED, shuttle_db.LOTTERY_DRAWN])
+    db.execute("""
+        update shuttle set status = ?
+        where status = ?
+          and not exists (select 1 from lottery_entry e where e.gno_tx_hash = shuttle.gno_tx_hash);
+    """, [shuttle_db.LOTTERY, shuttle_db.LOTTERY_DRAWN])
+
+
+def open_draw(db):
+    # the draw that has not been paid out yet, if any
+    cur = db.cursor()
+    cur.row_factory = shuttle_db.dict_factory
+    cur.execute("select * from lottery_draw where status in (?, ?) order by id limit 1;",
+                [shuttle_db.QUEUED, shuttle_db.SUBMITTED])
+    return cur.fetchone()
+
+
+def is_due(db, interval_days=DEFAULT_INTERVAL_DAYS, now=None):
+    # every interval_days since the last draw.  before the first draw, interval_days after the oldest entry
+    now = now or datetime.now()
+    if open_draw(db):
+        return False
+
+    cur = db.cursor()
+    cur.execute("select max(drawn_at) from lottery_draw;")
+    reference = cur.fetchone()[0]
+    if reference is None:
+        cur.execute("select min(created_at) from shuttle where status = ?;", [shuttle_db.LOTTERY])
+        reference = cur.fetchone()[0]
+
+    return reference is not None and now - datetime.fromisoformat(reference) >= timedelta(days=interval_days)
+
+
+def draw(db, min_entries=DEFAULT_MIN_ENTRIES, now=None):
+    # the pot is every lottery deposit so far, one entry per wallet.  the deposits read here are the ones claimed for
+    # this draw, anything arriving while it is drawn goes into the next one
+    now = now or datetime.now()
+    cur = db.cursor()
+    cur.row_factory = shuttle_db.dict_factory
+    cur.execute("select gno_tx_hash, from_address, from_user, amount_wei from shuttle where status = ?;",
+                [shuttle_db.LOTTERY])
+    pot_rows = cur.fetchall()
+
+    entries = {}
+    for r in pot_rows:
+        entry = entries.setdefault(r["from_address"].lower(), {"from_address": r["from_address"], "from_user": None})
+        entry["from_user"] = entry["from_user"] or r["from_user"]
+    entries = list(entries.values())
+
+    if len(entries) < min_entries:
+        return None
+
+    pot = sum(shuttle_db.blob_to_wei(r["amount_wei"]) for r in pot_rows)
+
+    # The secrets module is used for generating cryptographically strong random numbers suitable for managing data
+    # such as passwords, account authentication, security tokens, and related secrets.  The secrets module provides
+    # access to the most secure source of randomness that your operating system provides.
+
+    # https://docs.python.org/3/library/secrets.html#module-secrets
+    winner = secrets.choice(entries)
+
+    cur.execute("""
+        insert into lottery_draw (winner_user, winner_address, amount_wei, entries, status, drawn_at)
+        values (?, ?, ?, ?, ?, ?);
+    """, [winner["from_user"], winner["from_address"], shuttle_db.wei_to_blob(pot), len(entries), shuttle_db.QUEUED,
+          now])
+    draw_id = cur.lastrowid
+
+    cur.executemany("insert into lottery_entry (lottery_draw_id, gno_tx_hash) values (?, ?);",
+                    [[draw_id, r["gno_tx_hash"]] for r in pot_rows])
+    shuttle_db.set_status(db, [r["gno_tx_hash"] for r in pot_rows], shuttle_db.LOTTERY_DRAWN)
+    db.commit()
+
+    cur.execute("select * from lottery_draw where id = ?;", [draw_id])
+    return cur.fetchone()
+
+
+def set_status(db, draw_id, status, **columns):
+    assignments = ", ".join(["status = ?"] + [f"{c} = ?" for c in columns])
+    db.execute(f"update lottery_draw set {assignments} where id = ?;", [status, *columns.values(), draw_id])
+
+    # the deposits in the pot follow the payout: settled when it succeeds, quarantined with it and back in the pot
+    # when it is released (or re-queued)
+    pot_status = POT_STATUS.get(status)
+    if pot_status:
+        db.execute("""
+            update shuttle set status = ?
+            where gno_tx_hash in (select gno_tx_hash from lottery_entry where lottery_draw_id = ?);
+        """, [pot_status, draw_id])
@@ -0,0 +1,117 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from eth_abi import encode
+from web3 import Web3
+
+# merkle tree for a claim based migration (see contracts/MerkleClaim.sol), built like openzeppelin's StandardMerkleTree
+# (@openzeppelin/merkle-tree) with the leaf encoding ["uint256", "address", "uint256"], so its root and proofs are the
+# ones that library produces for the same values.  leaves are keccak256(bytes.concat(keccak256(abi.encode(index,
+# account, amount)))), the double hash keeps a leaf from ever being mistaken for an inner node.  the leaves are sorted
+# by hash and laid out as a complete binary tree in one array (children of node i at 2i + 1 and 2i + 2, leaves at the
+# end in reverse order).  pairs are hashed in sorted order, so a proof is just the list of siblings (MerkleProof.verify)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+SET_MERKLE_ROOT_SELECTOR = Web3.to_hex(Web3.keccak(text="setMerkleRoot(bytes32)")[:4])
+
+
+def leaf(index, account, amount):
+    return Web3.keccak(Web3.keccak(encode(["uint256", "address", "uint256"], [index, account, amount])))
+
+
+def _hash_chunk(chunk):
+    start, entries = chunk
+    return [leaf(start + i, account, amount) for i, (account, amount) in enumerate(entries)]
+
+
+def hash_leaves(entries, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # [(account, amount)] -> leaves, in the same order (the index of an entry is its position).  the entries are
+    # hashed in chunks spread over a process pool, small inputs are not worth starting one for
+    chunks = [(start, entries[start:start + chunk_size]) for start in range(0, len(entries), chunk_size)]
+    if len(chunks) <= 1 or workers == 1:
+        return [h for chunk in chunks for h in _hash_chunk(chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [h for hashes in executor.map(_hash_chunk, chunks) for h in hashes]
+
+
+def _hash_pair(a, b):
+    return Web3.keccak(a + b if a < b else b + a)
+
+
+def build_tree(leaves):
+    # the tree as one array, root first.  returns (tree, tree_index) where tree_index[i] is the position of leaves[i]
+    n = len(leaves)
+    tree = [None] * (2 * n - 1)
+    tree_index = [0] * n
+    for position, i in enumerate(sorted(range(n), key=leaves.__getitem__)):
+        tree_index[i] = len(tree) - 1 - position
+        tree[tree_index[i]] = leaves[i]
+
+    for i in range(len(tree) - 1 - n, -1, -1):
+        tree[i] = _hash_pair(tree[2 * i + 1], tree[2 * i + 2])
+    return tree, tree_index
+
+
+def proof(tree, tree_index):
+    siblings = []
+    while tree_index > 0:
+        siblings.append(tree[tree_index + 1 if tree_index % 2 else tree_index - 1])
+        tree_index = (tree_index - 1) // 2
+    return siblings
+
+
+def verify(root, leaf_hash, siblings):
+    node = leaf_hash
+    for sibling in siblings:
+        node = _hash_pair(node, sibling)
+    return node == root
+
+
+def build(entries, workers=None):
+    # returns (root, claims) with one claim per entry, in index order: {index, account, amount, proof}, the arguments
+    # of MerkleClaim.claim.  addresses must be unique, the contract marks claims by index
+    if not entries:
+        return b"\x00" * 32, []
+
+    tree, tree_index = build_tree(hash_leaves(entries, workers))
+    claims = [{"index": index, "account": account, "amount": str(amount),
+               "proof": [Web3.to_hex(p) for p in proof(tree, tree_index[index])]}
+              for index, (account, amount) in enumerate(entries)]
+    return tree[0], claims
+
+
+def write_proofs(path, root, claims, total):
+    # the proof file has one json line per claim, in index order, each one exactly what the claim page sends to
+    # MerkleClaim.claim.  path + ".index.json" holds the root and totals and maps every (lower case) address to the
+    # byte offset of its line, so finding a proof is one lookup and one seek rather than parsing every claim
+    offsets = {}
+    with open(path, 'wb') as f:
+        for c in claims:
+            offsets[c["account"].lower()] = f.tell()
+            f.write(json.dumps(c, separators=(",", ":")).encode() + b"\n")
+
+    with open(path + ".index.json", 'w') as f:
+        json.dump({"root": Web3.to_hex(root), "count": len(claims), "total": str(total), "offsets": offsets}, f,
+                  separators=(",", ":"))
+
+
+def read_proof(path, address, offsets=None):
+    # the claim of an address from a proof file (None when it has none).  offsets can be passed in when looking up
+    # many addresses, so the index is only loaded once
+    if offsets is None:
+        with open(path + ".index.json") as f:
+            offsets = json.load(f)["offsets"]
+
+    offset = offsets.get(address.lower())
+    if offset is None:
+        return None
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+
+def set_root_data(root):
+    return SET_MERKLE_ROOT_SELECTOR + Web3.to_hex(root)[2:]
@@ -0,0 +1,172 @@
+import json
+import re
+from datetime import datetime, timedelta
+
+from engine import lottery_draw, shuttle_db
+
+# the stages no longer message reddit themselves, they put events in an outbox (in the same transaction as the state
+# change they announce).  send_digests in shuttle.py then sends one message per user: the usual message when there is
+# a single event, a digest when several piled up within the window.  shuttles and draws waiting on their completed
+# message stay DISTRIBUTED until it has been sent, so notified_at is when the user was actually told
+DISCOVERED = "discovered"
+LOTTERY = "lottery"
+COMPLETED = "completed"
+LOTTERY_WINNER = "lottery_winner"
+
+# kind -> (config key of the single event message, subject)
+MESSAGES = {
+    DISCOVERED: ("gno_confirmation_message", "Arb1 Shuttle - Gnosis deposit found!"),
+    LOTTERY: ("lottery_message", "Arb1 Shuttle - Lottery Entry!"),
+    COMPLETED: ("shuttle_message", "Arb1 Shuttle Successful!"),
+    LOTTERY_WINNER: ("lottery_winner_message", "Gnosis -> ARB 1 Lottery Winner!"),
+}
+
+DEFAULT_WINDOW_SECONDS = 300
+
+# a user that cannot be messaged (deleted account, blocked messages) is given up on after this many cycles, their
+# shuttles are marked notified anyway so they do not sit in the live table forever
+DEFAULT_MAX_ATTEMPTS = 5
+
+_PLACEHOLDER = re.compile(r"#([A-Z0-9_]+)#")
+
+
+class Template:
+    # a message with #FIELD# placeholders, split once into its literal text and field names so rendering is a
+    # single join.  unknown fields are left as they are
+    def __init__(self, text):
+        parts = _PLACEHOLDER.split(text)
+        self._literals = parts[0::2]
+        self._fields = parts[1::2]
+
+    def render(self, fields):
+        out = [self._literals[0]]
+        for name, literal in zip(self._fields, self._literals[1:]):
+            out.append(str(fields[name]) if name in fields else f"#{name}#")
+            out.append(literal)
+        return "".join(out)
+
+
+class Templates:
+    # every message template from config.json, compiled once
+    def __init__(self, config):
+        digest_config = config.get("digest", {})
+        self.window_seconds = digest_config.get("window_seconds", DEFAULT_WINDOW_SECONDS)
+        self.max_attempts = digest_config.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+        self.messages = {kind: Template(config[key]) for kind, (key, _) in MESSAGES.items()}
+        self.subject = Template(digest_config.get("subject", "Arb1 Shuttle - #COUNT# updates"))
+        self.header = Template(digest_config.get("header", "Hi #NAME#, here is an update on your shuttles:"))
+        self.items = {kind: Template(text) for kind, text in digest_config.get("items", {}).items()}
+
+    def render(self, user, events):
+        # (subject, message) for the user's events, [(kind, fields)] oldest first
+        if len(events) == 1:
+            kind, fields = events[0]
+            return MESSAGES[kind][1], self.messages[kind].render({"NAME": user, **fields})
+
+        # a kind without a digest line falls back to its full message
+        lines = [self.items[kind].render(fields) if kind in self.items else
+                 self.messages[kind].render({"NAME": user, **fields}) for kind, fields in events]
+        return (self.subject.render({"NAME": user, "COUNT": len(events)}),
+                "\n\n".join([self.header.render({"NAME": user, "COUNT": len(events)})] + lines))
+
+
+def create_schema(db):
+    # sent_at is when the event left the outbox: delivered, or given up on (failed_at).  gno_tx_hash and
+    # lottery_draw_id link a completed event to the shuttle / draw that is marked notified when it is sent
+    sql_create = """
+        CREATE TABLE IF NOT EXISTS
+        notification_outbox (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            user NVARCHAR2 NOT NULL COLLATE NOCASE,
+            kind NVARCHAR2 NOT NULL,
+            fields NVARCHAR2 NOT NULL,
+            created_at DATETIME NOT NULL,
+            sent_at DATETIME
+        );
+    """
+    db.executescript(sql_create)
+
+    # the links and the retry columns were added after the outbox went live
+    columns = [c[0] for c in db.execute("select name from pragma_table_info('notification_outbox');").fetchall()]
+    if "gno_tx_hash" not in columns:
+        db.execute("alter table notification_outbox add column gno_tx_hash NVARCHAR2 COLLATE NOCASE;")
+    if "lottery_draw_id" not in columns:
+        db.execute("alter table notification_outbox add column lottery_draw_id INTEGER;")
+    if "attempts" not in columns:
+        db.execute("alter table notification_outbox add column attempts INTEGER NOT NULL DEFAULT 0;")
+    if "failed_at" not in columns:
+        db.execute("alter table notification_outbox add column failed_at DATETIME;")
+
+    db.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending ON notification_outbox (user, created_at)
+            WHERE sent_at IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_gno_tx_hash ON notification_outbox (gno_tx_hash);
+        CREATE INDEX IF NOT EXISTS idx_notification_outbox_lottery_draw_id ON notification_outbox (lottery_draw_id);
+    """)
+
+
+def enqueue(db, user, kind, fields, now=None, gno_tx_hash=None, lottery_draw_id=None):
+    db.execute("""
+        insert into notification_outbox (user, kind, fields, created_at, gno_tx_hash, lottery_draw_id)
+        values (?, ?, ?, ?, ?, ?);
+    """, [user, kind, json.dumps(fields, default=str), now or datetime.now(), gno_tx_hash, lottery_draw_id])
+
+
+def due(db, window_seconds=DEFAULT_WINDOW_SECONDS, now=None):
+    # {user: [(id, kind, fields)]} for every user whose oldest unsent event has waited out the window, so events
+    # arriving within the window of the first one go out in the same message
+    now = now or datetime.now()
+    cur = db.cursor()
+    cur.execute("""
+        select user, id, kind, fields
+        from notification_outbox
+        where sent_at is null
+          and user in (select user from notification_outbox
+                       where sent_at is null
+                       group by user
+                       having min(created_at) <= ?)
+        order by user, created_at, id;
+    """, [now - timedelta(seconds=window_seconds)])
+
+    # usernames are case insensitive, a user's events are grouped under the first spelling seen
+    pending, names = {}, {}
+    for user, event_id, kind, fields in cur.fetchall():
+        user = names.setdefault(user.lower(), user)
+        pending.setdefault(user, []).append((event_id, kind, json.loads(fields)))
+    return pending
+
+
+def mark_sent(db, event_ids, now=None):
+    # the message went out: the shuttles and draws it completed are notified as of now
+    now = now or datetime.now()
+    db.executemany("update notification_outbox set sent_at = ? where id = ?;", [[now, i] for i in event_ids])
+
+    marks = ",".join("?" * len(event_ids))
+    cur = db.cursor()
+    cur.execute(f"""
+        select gno_tx_hash, lottery_draw_id from notification_outbox
+        where id in ({marks}) and kind in (?, ?);
+    """, [*event_ids, COMPLETED, LOTTERY_WINNER])
+
+    for gno_tx_hash, lottery_draw_id in cur.fetchall():
+        if gno_tx_hash:
+            shuttle_db.set_status(db, [gno_tx_hash], shuttle_db.NOTIFIED, notified_at=now)
+        if lottery_draw_id:
+            lottery_draw.set_status(db, lottery_draw_id, shuttle_db.NOTIFIED, notified_at=now)
+
+
+def mark_failed(db, event_ids, max_attempts=DEFAULT_MAX_ATTEMPTS, now=None):
+    # the message could not be sent, it is tried again next cycle.  returns True when it was the last attempt, the
+    # events are then taken out of the outbox as if they had been sent
+    now = now or datetime.now()
+    db.executemany("update notification_outbox set attempts = attempts + 1 where id = ?;", [[i] for i in event_ids])
+
+    marks = ",".join("?" * len(event_ids))
+    cur = db.cursor()
+    cur.execute(f"select max(attempts) from notification_outbox where id in ({marks});", event_ids)
+    if cur.fetchone()[0] < max_attempts:
+        return False
+
+    db.executemany("update notification_outbox set failed_at = ? where id = ?;", [[now, i] for i in event_ids])
+    mark_sent(db, event_ids, now)
+    return True
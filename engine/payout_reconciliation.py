@@ -0,0 +1,219 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from engine import shuttle_db
+from engine.transfer_sources import TRANSFER_TOPIC
+
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_CONFIRMATIONS = 20
+DEFAULT_GRACE_MINUTES = 60
+
+# discrepancy kinds
+MISSING = "missing"          # a shuttle was recorded as paid but its distribute transaction did not pay it
+DUPLICATE = "duplicate"      # the address was paid more times than there are shuttles for it in the transaction
+MISMATCHED = "mismatched"    # paid, but not the recorded amount
+UNRECORDED = "unrecorded"    # a payout from the shuttle that no shuttle row or lottery draw points at
+
+
+def create_schema(db):
+    sql_create = """
+        CREATE TABLE IF NOT EXISTS
+        arb1_payout (
+            tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+            log_index INTEGER NOT NULL,
+            to_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+            amount_wei BLOB NOT NULL,
+            block_number INTEGER NOT NULL,
+            PRIMARY KEY (tx_hash, log_index)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS
+        payout_discrepancy (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            kind NVARCHAR2 NOT NULL,
+            arb_tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+            to_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+            expected_wei NVARCHAR2,
+            paid_wei NVARCHAR2,
+            gno_tx_hashes NVARCHAR2,
+            detected_at DATETIME NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS
+        reconciliation_cursor (
+            name NVARCHAR2 NOT NULL PRIMARY KEY,
+            value NVARCHAR2 NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_shuttle_arb_tx_hash ON shuttle (arb_tx_hash);
+        CREATE INDEX IF NOT EXISTS archive.idx_shuttle_arb_tx_hash ON shuttle (arb_tx_hash);
+    """
+    db.executescript(sql_create)
+
+
+def _get_cursor(db, name, default=None):
+    row = db.execute("select value from reconciliation_cursor where name = ?;", [name]).fetchone()
+    return row[0] if row else default
+
+
+def _set_cursor(db, name, value):
+    db.execute("insert or replace into reconciliation_cursor (name, value) values (?, ?);", [name, str(value)])
+
+
+def _topic(address):
+    return "0x" + address.lower()[2:].rjust(64, "0")
+
+
+def index_payouts(w3, db, config, start_block=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                  confirmations=DEFAULT_CONFIRMATIONS, logger=None):
+    # every DONUT transfer out of the shuttle wallet (or the distribute contract, depending on how it moves the
+    # tokens) on arb1, in large block ranges from the stored cursor.  returns the tx hashes that were indexed
+    shuttle_address = config["addresses"]["shuttle"]
+    distribute_address = config["contracts"]["arb1"]["distribute"]
+
+    from_block = _get_cursor(db, "arb1_payout_block")
+    if from_block is not None:
+        from_block = int(from_block) + 1
+    else:
+        from_block = start_block if start_block is not None else _first_distribute_block(w3, db)
+        if from_block is None:
+            return set()
+
+    to_block = w3.eth.block_number - confirmations
+    tx_hashes = set()
+
+    for chunk_start in range(from_block, to_block + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size - 1, to_block)
+        logs = w3.eth.get_logs({
+            "fromBlock": chunk_start,
+            "toBlock": chunk_end,
+            "address": w3.to_checksum_address(config["contracts"]["arb1"]["donut"]),
+            "topics": [TRANSFER_TOPIC, [_topic(shuttle_address), _topic(distribute_address)]],
+        })
+
+        rows = []
+        for log in logs:
+            to_address = "0x" + log["topics"][2].hex()[-40:]
+
+            # the distribute contract collecting the batch total is not a payout
+            if to_address.lower() == distribute_address.lower():
+                continue
+
+            rows.append([log["transactionHash"].hex(), log["logIndex"], to_address,
+                         shuttle_db.wei_to_blob(int(bytes(log["data"]).hex() or "0", 16)), log["blockNumber"]])
+            tx_hashes.add(log["transactionHash"].hex().lower())
+
+        db.executemany("insert or ignore into arb1_payout (tx_hash, log_index, to_address, amount_wei, "
+                       "block_number) values (?, ?, ?, ?, ?);", rows)
+        _set_cursor(db, "arb1_payout_block", chunk_end)
+        db.commit()
+
+        if logger:
+            logger.info(f"  [arb1_payout] blocks {chunk_start}-{chunk_end}: {len(rows)} payouts")
+
+    return tx_hashes
+
+
+def _first_distribute_block(w3, db):
+    # no start block configured: start from the block of the earliest recorded distribute transaction
+    row = db.execute("""
+        select arb_tx_hash from shuttle_all
+        where arb_tx_hash is not null
+        order by coalesce(submitted_at, processed_at)
+        limit 1;
+    """).fetchone()
+    if not row:
+        return None
+    return w3.eth.get_transaction_receipt(row[0]).blockNumber
+
+
+def reconcile(db, new_payout_tx_hashes=(), grace_minutes=DEFAULT_GRACE_MINUTES, now=None):
+    # compares the shuttles distributed since the last run with the payouts indexed for their transactions.  both
+    # sides are grouped into hash tables keyed on (arb_tx_hash, address) and joined in python.  shuttles processed
+    # in the last grace_minutes are left for the next run, their payout may not be indexed yet.  db must come from
+    # shuttle_db.connect() so archived shuttles are included
+    now = now or datetime.now()
+    last_processed_at = _get_cursor(db, "shuttle_processed_at", "")
+    last_id = int(_get_cursor(db, "shuttle_id", 0))
+
+    cur = db.cursor()
+    cur.execute(f"""
+        select id, from_address, amount_wei, gno_tx_hash, arb_tx_hash, processed_at
+        from shuttle_all
+        where status in ('{shuttle_db.DISTRIBUTED}', '{shuttle_db.NOTIFIED}')
+          and (processed_at > ? or (processed_at = ? and id > ?))
+          and processed_at <= ?
+        order by processed_at, id;
+    """, [last_processed_at, last_processed_at, last_id, now - timedelta(minutes=grace_minutes)])
+    shuttles = cur.fetchall()
+
+    expected = defaultdict(list)
+    for _, from_address, amount_wei, gno_tx_hash, arb_tx_hash, _ in shuttles:
+        expected[(arb_tx_hash.lower(), from_address.lower())].append(
+            (shuttle_db.blob_to_wei(amount_wei), gno_tx_hash))
+
+    paid = defaultdict(list)
+    arb_tx_hashes = list({k[0] for k in expected})
+    for i in range(0, len(arb_tx_hashes), 500):
+        chunk = arb_tx_hashes[i:i + 500]
+        cur.execute(f"select tx_hash, to_address, amount_wei from arb1_payout "
+                    f"where tx_hash in ({', '.join('?' * len(chunk))});", chunk)
+        for tx_hash, to_address, amount_wei in cur.fetchall():
+            paid[(tx_hash.lower(), to_address.lower())].append(shuttle_db.blob_to_wei(amount_wei))
+
+        # a lottery payout riding along in the same batch is not one of the shuttle payouts
+        cur.execute(f"select arb_tx_hash, winner_address, amount_wei from lottery_draw "
+                    f"where arb_tx_hash in ({', '.join('?' * len(chunk))});", chunk)
+        for tx_hash, winner_address, amount_wei in cur.fetchall():
+            amounts = paid.get((tx_hash.lower(), winner_address.lower()), [])
+            if shuttle_db.blob_to_wei(amount_wei) in amounts:
+                amounts.remove(shuttle_db.blob_to_wei(amount_wei))
+
+    discrepancies = []
+    for key, shuttle_amounts in expected.items():
+        amounts = sorted(a for a, _ in shuttle_amounts)
+        paid_amounts = sorted(paid.get(key, []))
+        gno_tx_hashes = ",".join(h for _, h in shuttle_amounts)
+
+        # a coalesced distribute entry pays every deposit of the address in the transaction at once
+        if amounts == paid_amounts or (len(paid_amounts) == 1 and sum(amounts) == paid_amounts[0]):
+            continue
+
+        if not paid_amounts or len(paid_amounts) < len(amounts):
+            kind = MISSING if sum(paid_amounts) < sum(amounts) else MISMATCHED
+        elif len(paid_amounts) > len(amounts):
+            kind = DUPLICATE
+        else:
+            kind = MISMATCHED
+
+        discrepancies.append([kind, key[0], key[1], str(sum(amounts)), str(sum(paid_amounts)), gno_tx_hashes, now])
+
+    # payouts in newly indexed transactions that no shuttle was recorded against
+    new_payout_tx_hashes = list(new_payout_tx_hashes)
+    for i in range(0, len(new_payout_tx_hashes), 500):
+        chunk = new_payout_tx_hashes[i:i + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        cur.execute(f"""
+            select p.tx_hash, p.to_address, p.amount_wei
+            from arb1_payout p
+            where p.tx_hash in ({placeholders})
+              and not exists (select 1 from shuttle_all s where s.arb_tx_hash = p.tx_hash)
+              and not exists (select 1 from lottery_draw d
+                              where d.arb_tx_hash = p.tx_hash and d.winner_address = p.to_address);
+        """, chunk)
+        for tx_hash, to_address, amount_wei in cur.fetchall():
+            discrepancies.append([UNRECORDED, tx_hash, to_address, None, str(shuttle_db.blob_to_wei(amount_wei)),
+                                  None, now])
+
+    cur.executemany("""
+        insert into payout_discrepancy (kind, arb_tx_hash, to_address, expected_wei, paid_wei, gno_tx_hashes,
+            detected_at)
+        values (?, ?, ?, ?, ?, ?, ?);
+    """, discrepancies)
+
+    if shuttles:
+        _set_cursor(db, "shuttle_processed_at", shuttles[-1][5])
+        _set_cursor(db, "shuttle_id", shuttles[-1][0])
+    db.commit()
+
+    return len(shuttles), discrepancies
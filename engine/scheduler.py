@@ -0,0 +1,95 @@
+import threading
+import time
+
+
+class AdaptiveInterval:
+    # polls at min_interval while there is activity and backs off towards max_interval (multiplying by factor) for
+    # every idle run in a row
+    def __init__(self, min_interval, max_interval, factor=2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.current = min_interval
+
+    def next(self, active):
+        if active:
+            self.current = self.min_interval
+        else:
+            self.current = min(self.current * self.factor, self.max_interval)
+        return self.current
+
+
+class _Task:
+    def __init__(self, name, fn, interval):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.next_run = 0.0
+
+
+class Scheduler:
+    # runs each stage of the shuttle on its own cadence instead of running everything every 240 seconds.  a task
+    # returns the number of seconds until it should run again (or None for its default interval), and any task can
+    # be pulled forward with trigger(), ie. when new deposits arrive.  tasks that are due at the same time run in
+    # the order they were added
+    def __init__(self, logger):
+        self.logger = logger
+        self.tasks = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def add(self, name, fn, interval):
+        self.tasks.append(_Task(name, fn, interval))
+
+    def trigger(self, *names):
+        # safe to call from other threads (ie. the confirmation watcher)
+        with self._lock:
+            for task in self.tasks:
+                if task.name in names:
+                    task.next_run = 0.0
+        self._wake.set()
+
+    def due_tasks(self):
+        now = time.monotonic()
+        with self._lock:
+            return [t for t in self.tasks if t.next_run <= now]
+
+    def seconds_until_next(self):
+        with self._lock:
+            return max(min(t.next_run for t in self.tasks) - time.monotonic(), 0)
+
+    def run_tasks(self, tasks):
+        ok = True
+        for task in tasks:
+            # a task triggered while an earlier task in this batch was running still needs to run
+            with self._lock:
+                task.next_run = time.monotonic() + task.interval
+
+            try:
+                delay = task.fn()
+            except Exception as e:
+                self.logger.error(f"[{task.name}] {e}")
+                ok = False
+                continue
+
+            if delay is not None:
+                with self._lock:
+                    # only push the task back if nothing triggered it while it ran
+                    if task.next_run > 0:
+                        task.next_run = time.monotonic() + delay
+
+        return ok
+
+    def run_forever(self, tick):
+        # tick receives the list of due tasks and is expected to call run_tasks, so the caller can wrap each batch
+        # (metrics, profiling)
+        while True:
+            wait = self.seconds_until_next()
+            if wait > 0:
+                self.logger.debug(f"sleep {wait:.0f} ....")
+                self._wake.wait(wait)
+            self._wake.clear()
+
+            tasks = self.due_tasks()
+            if tasks:
+                tick(tasks)
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from engine import shuttle_db
+
+DEFAULT_RETAIN_DAYS = 30
+
+
+def archive_completed(db, retain_days=DEFAULT_RETAIN_DAYS, now=None):
+    # moves shuttles that will never change again out of the live table and into the archive db, so the live table
+    # only holds work in progress (and stays small enough to sit in the page cache and back up quickly).  a shuttle
+    # is complete once the user has been notified, once it was distributed to an address that never matched a
+    # reddit user, or once the lottery draw it was entered into has been paid out.  rows are kept live for
+    # retain_days so recent shuttles are still easy to look at.  db must come from shuttle_db.connect() so the
+    # archive is attached
+    now = now or datetime.now()
+    cutoff = now - timedelta(days=retain_days)
+    columns = ", ".join(shuttle_db.SHUTTLE_COLUMNS)
+
+    cur = db.cursor()
+    cur.execute(f"""
+        select id from main.shuttle
+        where (status = ? and notified_at < ?)
+           or (status = ? and from_user is null and processed_at < ?)
+           or (status = ? and created_at < ?);
+    """, [shuttle_db.NOTIFIED, cutoff, shuttle_db.DISTRIBUTED, cutoff, shuttle_db.LOTTERY_PAID, cutoff])
+    ids = [r[0] for r in cur.fetchall()]
+
+    if not ids:
+        return 0
+
+    # both statements run in one transaction across the two files, a row is never in both or neither
+    cur.execute("create temp table if not exists archive_batch (id INTEGER NOT NULL PRIMARY KEY);")
+    cur.execute("delete from archive_batch;")
+    cur.executemany("insert into archive_batch (id) values (?);", [[i] for i in ids])
+
+    cur.execute(f"""
+        insert into archive.shuttle ({columns}, archived_at)
+        select {columns}, ? from main.shuttle where id in (select id from archive_batch);
+    """, [now])
+    cur.execute("delete from main.shuttle where id in (select id from archive_batch);")
+    db.commit()
+
+    return len(ids)
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from decimal import Decimal
+
+from instrumentation import shuttle_latency
+
+# every shuttle row moves through these states in order.  deposits below the minimum shuttle amount leave the
+# pipeline at LOTTERY instead of QUEUED
+DETECTED = "detected"        # seen on gnosis, waiting for confirmations (followed by the confirmation watcher)
+CONFIRMED = "confirmed"      # enough confirmations, the user has not been told about it yet
+QUEUED = "queued"            # waiting to be included in a distribute transaction on arb1
+SUBMITTED = "submitted"      # distribute transaction sent, waiting for its receipt
+DISTRIBUTED = "distributed"  # distribute transaction succeeded, the user has not been told yet
+NOTIFIED = "notified"        # done
+LOTTERY = "lottery"          # below the minimum shuttle amount, entered into the next lottery draw
+LOTTERY_DRAWN = "lottery_drawn"  # in the pot of the open draw (see engine/lottery_draw.py)
+LOTTERY_PAID = "lottery_paid"    # done, the draw it was in has been paid out
+QUARANTINED = "quarantined"      # distribute reverted on it in simulation, taken out of the queue (see quarantine)
+
+STATUSES = [DETECTED, CONFIRMED, QUEUED, SUBMITTED, DISTRIBUTED, NOTIFIED, LOTTERY, LOTTERY_DRAWN, LOTTERY_PAID,
+            QUARANTINED]
+
+# states that mean the user already had a shuttle sent to them
+SHUTTLED = (SUBMITTED, DISTRIBUTED, NOTIFIED)
+
+# amounts are compared and summed exactly as integer wei stored in amount_wei: a fixed width, big endian uint256
+# blob.  sqlite compares blobs with memcmp, so blob order is numeric order and an index on amount_wei can answer
+# range queries (amount_wei >= wei_to_blob(minimum)).  blockchain_amount / readable_amount are kept for display
+AMOUNT_BYTES = 32
+
+# columns shared by the live table, the archive and the shuttle_all view.  columns added with alter table sit at the
+# end of older databases, so rows are always copied by name
+SHUTTLE_COLUMNS = ["id", "from_user", "from_address", "blockchain_amount", "readable_amount", "block_number",
+                   "block_hash", "gno_tx_hash", "arb_tx_hash", "gno_timestamp", "status", "submitted_at",
+                   "processed_at", "notified_at", "created_at", "amount_wei"]
+
+
+def dict_factory(c, r):
+    return dict(zip([col[0] for col in c.description], r))
+
+
+def wei_to_blob(wei):
+    return int(wei).to_bytes(AMOUNT_BYTES, "big")
+
+
+def blob_to_wei(blob):
+    return int.from_bytes(blob, "big")
+
+
+def to_wei(amount):
+    # whole tokens (ie. MIN_SHUTTLE_AMOUNT) to wei, donut has 18 decimals
+    return int(Decimal(amount) * 10 ** 18)
+
+
+def from_wei(wei):
+    # for display, without needing web3
+    return Decimal(wei) / 10 ** 18
+
+
+def archive_location(config):
+    # completed shuttles are moved to a second sqlite file (see engine/shuttle_archive.py), by default next to the
+    # live db: arb1.db -> arb1_archive.db
+    return config.get("archive", {}).get("db_location") or \
+        f"{os.path.splitext(config['db_location'])[0]}_archive.db"
+
+
+# archive files whose schema was already created by this process
+_archive_ready = set()
+
+
+@contextmanager
+def connect(config):
+    # a connection to the live db with the archive attached as "archive" and a temp shuttle_all view over both.
+    # only needed by queries that must see every shuttle ever made (de-duplication, one shuttle per user, reports),
+    # the stages themselves only work on the live table.  used as a context manager: commits (or rolls back) like a
+    # plain sqlite connection and closes the connection when done
+    db = sqlite3.connect(config["db_location"])
+    try:
+        location = archive_location(config)
+        db.execute("attach database ? as archive;", [location])
+        if location not in _archive_ready:
+            create_archive_schema(db)
+            _archive_ready.add(location)
+
+        columns = ", ".join(SHUTTLE_COLUMNS)
+        db.execute(f"""
+            CREATE TEMP VIEW IF NOT EXISTS shuttle_all AS
+            select {columns} from main.shuttle
+            union all
+            select {columns} from archive.shuttle;
+        """)
+
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def create_archive_schema(db):
+    sql_create = """
+            CREATE TABLE IF NOT EXISTS
+            archive.shuttle (
+                id INTEGER NOT NULL PRIMARY KEY,
+                from_user NVARCHAR2 COLLATE NOCASE,
+                from_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+                blockchain_amount text NOT NULL,
+                readable_amount DECIMAL(8, 7) NOT NULL,
+                block_number INTEGER NOT NULL,
+                block_hash NVARCHAR2 COLLATE NOCASE,
+                gno_tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+                arb_tx_hash NVARCHAR2 COLLATE NOCASE,
+                gno_timestamp DATETIME NOT NULL,
+                status NVARCHAR2 NOT NULL,
+                submitted_at DATETIME,
+                processed_at DATETIME,
+                notified_at DATETIME,
+                created_at DATETIME NOT NULL,
+                archived_at DATETIME NOT NULL,
+                amount_wei BLOB
+            );
+        """
+    db.executescript(sql_create)
+
+    # amount_wei was added after the archive was introduced
+    columns = [c[0] for c in db.execute("select name from pragma_table_info('shuttle', 'archive');").fetchall()]
+    if "amount_wei" not in columns:
+        db.execute("alter table archive.shuttle add column amount_wei BLOB;")
+        _backfill_amount_wei(db, "archive")
+
+    db.executescript("""
+        CREATE INDEX IF NOT EXISTS archive.idx_shuttle_gno_tx_hash ON shuttle (gno_tx_hash);
+        CREATE INDEX IF NOT EXISTS archive.idx_shuttle_from_address ON shuttle (from_address);
+        CREATE INDEX IF NOT EXISTS archive.idx_shuttle_amount_wei ON shuttle (amount_wei);
+    """)
+
+
+def create_schema(db, min_shuttle_amount, lottery_cutoff=None):
+    sql_create = """
+            CREATE TABLE IF NOT EXISTS
+            shuttle (
+                id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+                from_user NVARCHAR2 COLLATE NOCASE,
+                from_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+                blockchain_amount text NOT NULL,
+                readable_amount DECIMAL(8, 7) NOT NULL,
+                block_number INTEGER NOT NULL,
+                block_hash NVARCHAR2 COLLATE NOCASE,
+                gno_tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+                arb_tx_hash NVARCHAR2 COLLATE NOCASE,
+                gno_timestamp DATETIME NOT NULL,
+                status NVARCHAR2 NOT NULL DEFAULT 'confirmed',
+                submitted_at DATETIME,
+                processed_at DATETIME,
+                notified_at DATETIME,
+                created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                amount_wei BLOB
+            );
+        """
+    cur = db.cursor()
+    cur.executescript(sql_create)
+
+    # submitted_at, block_hash, status and amount_wei were added after the shuttle went live
+    cur.execute("select name from pragma_table_info('shuttle');")
+    columns = [c[0] for c in cur.fetchall()]
+    if "submitted_at" not in columns:
+        cur.execute("alter table shuttle add column submitted_at DATETIME;")
+    if "block_hash" not in columns:
+        cur.execute("alter table shuttle add column block_hash NVARCHAR2 COLLATE NOCASE;")
+    if "status" not in columns:
+        cur.execute("alter table shuttle add column status NVARCHAR2 NOT NULL DEFAULT 'confirmed';")
+        _backfill_status(cur, min_shuttle_amount, lottery_cutoff)
+    if "amount_wei" not in columns:
+        cur.execute("alter table shuttle add column amount_wei BLOB;")
+        _backfill_amount_wei(db, "main")
+
+    _migrate_pending_deposits(cur)
+
+    # one partial index per active state, so each stage only ever touches its own (small) work queue and completed
+    # rows cost nothing.  the query has to repeat the index's where clause for sqlite to use it
+    cur.executescript(f"""
+        CREATE INDEX IF NOT EXISTS idx_shuttle_gno_tx_hash ON shuttle (gno_tx_hash);
+        CREATE INDEX IF NOT EXISTS idx_shuttle_detected ON shuttle (block_number) WHERE status = '{DETECTED}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_confirmed ON shuttle (created_at) WHERE status = '{CONFIRMED}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_queued ON shuttle (created_at) WHERE status = '{QUEUED}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_submitted ON shuttle (arb_tx_hash) WHERE status = '{SUBMITTED}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_distributed ON shuttle (processed_at) WHERE status = '{DISTRIBUTED}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_lottery ON shuttle (from_address) WHERE status = '{LOTTERY}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_lottery_drawn ON shuttle (from_address)
+            WHERE status = '{LOTTERY_DRAWN}';
+        CREATE INDEX IF NOT EXISTS idx_shuttle_shuttled ON shuttle (from_address)
+            WHERE status IN ('{SUBMITTED}', '{DISTRIBUTED}', '{NOTIFIED}');
+        CREATE INDEX IF NOT EXISTS idx_shuttle_unmatched ON shuttle (from_address) WHERE from_user IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_shuttle_amount_wei ON shuttle (amount_wei);
+    """)
+
+    shuttle_latency.create_schema(db)
+
+
+def _backfill_status(cur, min_shuttle_amount, lottery_cutoff=None):
+    # derive the state of existing rows from the timestamps they were tracked with before.  rows that were found
+    # but never processed were already announced by the old discovery notification.  the old lottery.py kept no
+    # record of which deposits it had paid out, so sub-minimum deposits are treated as paid unless they arrived after
+    # lottery_cutoff (the last manual draw, config lottery.backfill_cutoff), only those go into the next draw
+    cur.execute(f"""
+        update shuttle set status = case
+            when notified_at is not null then '{NOTIFIED}'
+            when processed_at is not null then '{DISTRIBUTED}'
+            when cast(readable_amount as real) < ? and ? is not null and created_at > ? then '{LOTTERY}'
+            when cast(readable_amount as real) < ? then '{LOTTERY_PAID}'
+            else '{QUEUED}'
+        end;
+    """, [min_shuttle_amount, lottery_cutoff, lottery_cutoff, min_shuttle_amount])
+
+
+def _backfill_amount_wei(db, schema):
+    # blockchain_amount has always held the exact wei amount as text
+    rows = db.execute(f"select id, blockchain_amount from {schema}.shuttle;").fetchall()
+    db.executemany(f"update {schema}.shuttle set amount_wei = ? where id = ?;",
+                   [[wei_to_blob(amount), row_id] for row_id, amount in rows])
+
+
+def _migrate_pending_deposits(cur):
+    # deposits waiting on confirmations used to be parked in their own table, they are now DETECTED shuttle rows
+    cur.execute("select 1 from sqlite_master where type = 'table' and name = 'pending_deposit';")
+    if not cur.fetchone():
+        return
+
+    cur.execute(f"""
+        insert into shuttle (from_address, blockchain_amount, readable_amount, block_number, block_hash,
+            gno_tx_hash, gno_timestamp, status, created_at)
+        select p.from_address, p.blockchain_amount, p.readable_amount, p.block_number, p.block_hash,
+            p.gno_tx_hash, p.gno_timestamp, '{DETECTED}', p.first_seen_at
+        from pending_deposit p
+        where not exists (select 1 from shuttle s where s.gno_tx_hash = p.gno_tx_hash);
+    """)
+    cur.execute("drop table pending_deposit;")
+
+    cur.execute("select id, blockchain_amount from shuttle where amount_wei is null;")
+    cur.executemany("update shuttle set amount_wei = ? where id = ?;",
+                    [[wei_to_blob(amount), row_id] for row_id, amount in cur.fetchall()])
+
+
+def insert_deposit(db, from_address, blockchain_amount, readable_amount, block_number, gno_tx_hash, gno_timestamp,
+                   created_at, status=CONFIRMED, block_hash=None):
+    # db must come from connect(), a deposit that was already shuttled and archived is not inserted again
+    sql_insert = """
+            INSERT INTO main.shuttle (from_address, blockchain_amount, amount_wei, readable_amount, block_number,
+                block_hash, gno_tx_hash, gno_timestamp, status, created_at)
+            SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+            WHERE NOT EXISTS (select 1 from shuttle_all where gno_tx_hash = ?);
+        """
+    cur = db.cursor()
+    cur.execute(sql_insert, [from_address, str(blockchain_amount), wei_to_blob(blockchain_amount), readable_amount,
+                             block_number, block_hash, gno_tx_hash, gno_timestamp, status, created_at, gno_tx_hash])
+    return cur.rowcount
+
+
+def set_status(db, gno_tx_hashes, status, **columns):
+    # moves rows to their next state, setting any timestamps / hashes that go with it
+    assignments = ", ".join(["status = ?"] + [f"{c} = ?" for c in columns])
+    cur = db.cursor()
+    cur.executemany(f"update shuttle set {assignments} where gno_tx_hash = ?;",
+                    [[status, *columns.values(), h] for h in gno_tx_hashes])
+    return cur.rowcount
@@ -0,0 +1,169 @@
+import csv
+import hashlib
+import mmap
+import struct
+from decimal import Decimal, localcontext
+
+# binary snapshot of a migration (address -> amount, plus the username it was taken for), read through mmap so
+# lookups, batching and comparisons slice the file instead of parsing text.  layout, all integers big endian:
+#
+#   header   magic (8 bytes) | count (uint64) | sha256 of the csv it was imported from (zeros when there was none)
+#   records  count x [address (20 bytes) | amount (uint256, 32 bytes)], in the order they were written
+#   index    count x uint32 record number, sorted by address (binary search, ordered merges)
+#   names    (count + 1) x uint32 offsets into the utf-8 blob that follows, name i is blob[offsets[i]:offsets[i + 1]]
+#
+# the csv columns are user, address, contrib, contrib_gwei (see migrate_contrib.py), contrib is derived from the
+# amount on export
+
+MAGIC = b"DNTSNAP2"
+HEADER = struct.Struct(">8sQ32s")
+ADDRESS_BYTES = 20
+AMOUNT_BYTES = 32
+RECORD_BYTES = ADDRESS_BYTES + AMOUNT_BYTES
+CSV_COLUMNS = ["user", "address", "contrib", "contrib_gwei"]
+
+
+def _address_bytes(address):
+    return bytes.fromhex(address.lower().removeprefix("0x").rjust(2 * ADDRESS_BYTES, "0"))
+
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, "sha256").digest()
+
+
+def write(path, rows, source_sha256=bytes(32)):
+    # rows: [(user, address, amount)]
+    rows = list(rows)
+    addresses = [_address_bytes(a) for _, a, _ in rows]
+    names = [(u or "").encode() for u, _, _ in rows]
+
+    offsets = [0]
+    for name in names:
+        offsets.append(offsets[-1] + len(name))
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(rows), source_sha256))
+        f.write(b"".join(a + int(amount).to_bytes(AMOUNT_BYTES, "big") for a, (_, _, amount) in zip(addresses, rows)))
+        f.write(b"".join(struct.pack(">I", i) for i in sorted(range(len(rows)), key=addresses.__getitem__)))
+        f.write(struct.pack(f">{len(offsets)}I", *offsets))
+        f.write(b"".join(names))
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, self.source_sha256 = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a migration snapshot (or an older version of one, import it again)")
+
+        self._records = HEADER.size
+        self._index = self._records + self.count * RECORD_BYTES
+        self._offsets = self._index + self.count * 4
+        self._names = self._offsets + (self.count + 1) * 4
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def address(self, i):
+        # a copy, never a view of the file: the mmap can only be closed once no view of it is left
+        start = self._records + i * RECORD_BYTES
+        return self._mmap[start:start + ADDRESS_BYTES]
+
+    def amount(self, i):
+        start = self._records + i * RECORD_BYTES + ADDRESS_BYTES
+        return int.from_bytes(self._mmap[start:start + AMOUNT_BYTES], "big")
+
+    def user(self, i):
+        start, end = struct.unpack_from(">II", self._mmap, self._offsets + i * 4)
+        return self._mmap[self._names + start:self._names + end].decode()
+
+    def _sorted(self, n):
+        return struct.unpack_from(">I", self._mmap, self._index + n * 4)[0]
+
+    def find(self, address):
+        # record number of the address, or None.  a binary search over the sorted index
+        key = _address_bytes(address)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.address(self._sorted(mid)) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self.address(self._sorted(lo)) == key:
+            return self._sorted(lo)
+        return None
+
+    def batches(self, size, min_amount=1):
+        # [(address bytes, amount)] for size records at a time, in record order.  records below min_amount are left
+        # out of their batch (so batches line up with the rows of the csv the snapshot came from)
+        for start in range(0, self.count, size):
+            yield [(self.address(i), amount) for i in range(start, min(start + size, self.count))
+                   if (amount := self.amount(i)) >= min_amount]
+
+    def in_address_order(self):
+        for n in range(self.count):
+            i = self._sorted(n)
+            yield self.address(i), i
+
+
+def diff(old, new):
+    # merges the two sorted indexes.  yields (address bytes, old amount, new amount) for every address whose amount
+    # differs, None for an address missing from one side
+    old_iter, new_iter = old.in_address_order(), new.in_address_order()
+    a, b = next(old_iter, None), next(new_iter, None)
+    while a or b:
+        if b is None or (a and a[0] < b[0]):
+            yield a[0], old.amount(a[1]), None
+            a = next(old_iter, None)
+        elif a is None or b[0] < a[0]:
+            yield b[0], None, new.amount(b[1])
+            b = next(new_iter, None)
+        else:
+            if old.amount(a[1]) != new.amount(b[1]):
+                yield a[0], old.amount(a[1]), new.amount(b[1])
+            a, b = next(old_iter, None), next(new_iter, None)
+
+
+def from_csv(csv_path, path):
+    # the csv's checksum goes into the header, so a snapshot can be checked against the csv it stands in for
+    with open(csv_path, newline='') as f:
+        write(path, [(u['user'], u['address'], int(u['contrib_gwei'])) for u in csv.DictReader(f)],
+              file_sha256(csv_path))
+
+
+def matches(path, csv_path):
+    # whether the snapshot was imported from the csv as it is now
+    with Snapshot(path) as snapshot:
+        return snapshot.source_sha256 == file_sha256(csv_path)
+
+
+def _from_wei(amount):
+    # same as web3's from_wei, which produced the contrib column
+    with localcontext() as ctx:
+        ctx.prec = 999
+        return Decimal(amount) / Decimal(10 ** 18)
+
+
+def to_csv(path, csv_path, checksum):
+    # checksum(address) formats the address like the original csv (ie. Web3.to_checksum_address)
+    with Snapshot(path) as snapshot, open(csv_path, 'w', newline='') as f:
+        # the migration csv has unix line endings, csv.writer would default to \r\n
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(CSV_COLUMNS)
+        for i in range(len(snapshot)):
+            amount = snapshot.amount(i)
+            writer.writerow([snapshot.user(i), checksum("0x" + snapshot.address(i).hex()), _from_wei(amount),
+                             amount])
@@ -0,0 +1,243 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from instrumentation import cycle_metrics
+from rpc import http_session, json_stream, provider_pool
+
+# keccak("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+END_BLOCK = 99999999
+
+# the fields of a transfer the shuttle uses, everything else in a tokentx row is dropped while parsing
+TRANSFER_FIELDS = ("hash", "from", "to", "value", "contractAddress", "blockNumber", "timeStamp", "confirmations")
+
+
+class TransferSource:
+    # a source of erc-20 transfers into the gnosis multisig.  every source returns transfers in the shape of the
+    # etherscan "tokentx" api (hash, from, to, value, contractAddress, blockNumber, timeStamp, confirmations) so the
+    # shuttle does not need to know where they came from
+    name = None
+
+    def get_transfers(self, address, start_block):
+        raise NotImplementedError
+
+    def get_receipt_status(self, tx_hash):
+        raise NotImplementedError
+
+
+class GnosisscanSource(TransferSource):
+    name = "gnosisscan"
+    api_url = "https://api.gnosisscan.io/api"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def _get(self, params):
+        result = http_session.get_json(self.api_url, self.name, params={**params, "apikey": self.api_key})
+
+        # the api reports errors (rate limits, bad keys) with status 0 and the error text in "result"
+        if result.get("status") == "0" and result.get("message") != "No transactions found":
+            raise Exception(f"gnosisscan error: {result.get('message')} - {result.get('result')}")
+
+        return result["result"]
+
+    def get_transfers(self, address, start_block):
+        # up to 10000 rows, streamed and reduced to TRANSFER_FIELDS as they are parsed
+        params = {"module": "account", "action": "tokentx", "address": address, "startblock": start_block,
+                  "endblock": END_BLOCK, "page": 1, "offset": 10000, "sort": "asc", "apikey": self.api_key}
+        _, chunks = http_session.get_stream(self.api_url, self.name, params=params)
+
+        fields = {}
+        transfers = [dict(zip(TRANSFER_FIELDS, t))
+                     for t in json_stream.pick(json_stream.iter_array(chunks, "result", fields), TRANSFER_FIELDS)]
+
+        if fields.get("status") == "0" and fields.get("message") != "No transactions found":
+            raise Exception(f"gnosisscan error: {fields.get('message')} - {fields.get('result')}")
+
+        return transfers
+
+    def get_receipt_status(self, tx_hash):
+        # status is "1" for success and "0" for a failed transaction, both strings are truthy
+        result = self._get({"module": "transaction", "action": "gettxreceiptstatus", "txhash": tx_hash})
+        return result["status"] == "1"
+
+
+class BlockscoutSource(TransferSource):
+    name = "blockscout"
+
+    def __init__(self, api_key):
+        from blockscan import Blockscan
+
+        self.client = Blockscan(100, api_key, is_async=False)
+
+    def get_transfers(self, address, start_block):
+        cycle_metrics.count_request(self.name)
+        try:
+            return self.client.accounts.get_tokentx_token_transfer_events_by_address(address, start_block,
+                                                                                     END_BLOCK, "asc") or []
+        except Exception:
+            cycle_metrics.count_error(self.name)
+            raise
+
+    def get_receipt_status(self, tx_hash):
+        cycle_metrics.count_request(self.name)
+        try:
+            return bool(self.client.transactions.get_tx_receipt_status(tx_hash))
+        except Exception:
+            cycle_metrics.count_error(self.name)
+            raise
+
+
+class RpcLogsSource(TransferSource):
+    # reads Transfer logs for the token straight from the gnosis rpc providers, no indexer involved.  the first call
+    # scans from the starting block in chunks, after that only the blocks since the last scan are read.  a race can
+    # leave a slow scan running into the next cycle, scans hold a lock so they never touch the state at the same time
+    name = "rpc_logs"
+
+    def __init__(self, w3, token_address, chunk_size=10000, reorg_margin=200):
+        self.w3 = w3
+        self.token_address = w3.to_checksum_address(token_address)
+        self.chunk_size = chunk_size
+        self.reorg_margin = reorg_margin
+        self._transfers = {}
+        self._block_timestamps = {}
+        self._scanned_to = None
+        self._lock = threading.Lock()
+
+    def get_transfers(self, address, start_block):
+        with self._lock:
+            return self._scan(address, start_block)
+
+    def _scan(self, address, start_block):
+        head = self.w3.eth.block_number
+        from_block = start_block if self._scanned_to is None else max(start_block,
+                                                                      self._scanned_to - self.reorg_margin)
+
+        # anything inside the re-scanned window is replaced, which drops logs that were reorged out
+        self._transfers = {k: t for k, t in self._transfers.items() if int(t["blockNumber"]) < from_block}
+
+        to_topic = "0x" + address.lower()[2:].rjust(64, "0")
+        for chunk_start in range(from_block, head + 1, self.chunk_size):
+            logs = self.w3.eth.get_logs({
+                "fromBlock": chunk_start,
+                "toBlock": min(chunk_start + self.chunk_size - 1, head),
+                "address": self.token_address,
+                "topics": [TRANSFER_TOPIC, None, to_topic],
+            })
+
+            for log in logs:
+                block = log["blockNumber"]
+                self._transfers[(log["transactionHash"].hex(), log["logIndex"])] = {
+                    "hash": log["transactionHash"].hex(),
+                    "from": "0x" + log["topics"][1].hex()[-40:],
+                    "to": "0x" + log["topics"][2].hex()[-40:],
+                    "value": str(int(log["data"].hex(), 16)),
+                    "contractAddress": self.token_address.lower(),
+                    "blockNumber": str(block),
+                    "timeStamp": str(self._block_timestamp(block)),
+                }
+
+        self._scanned_to = head
+
+        # copies, the caller (or a cross check) may still read them while the next scan runs
+        transfers = sorted(self._transfers.values(), key=lambda t: int(t["blockNumber"]))
+        return [{**t, "confirmations": str(head - int(t["blockNumber"]))} for t in transfers]
+
+    def _block_timestamp(self, block):
+        if block not in self._block_timestamps:
+            self._block_timestamps[block] = self.w3.eth.get_block(block)["timestamp"]
+        return self._block_timestamps[block]
+
+    def get_receipt_status(self, tx_hash):
+        # the receipt itself, never assumed: a racing source answering True without asking would win every race and
+        # hide the failed transactions the other source reports
+        receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+        return receipt["status"] == 1
+
+
+class RacingSource(TransferSource):
+    # queries two sources at the same time and uses whichever answers first.  when the slower source finishes, its
+    # answer is compared with the winner's in the background and any disagreement is logged
+    def __init__(self, primary, secondary, logger=None, confirmations=100):
+        self.sources = [primary, secondary]
+        self.name = f"race({primary.name},{secondary.name})"
+        self.logger = logger
+        self.confirmations = confirmations
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="transfer-source")
+        self._lock = threading.Lock()
+
+    def _race(self, fn_name, *args):
+        futures = {self._executor.submit(getattr(s, fn_name), *args): s for s in self.sources}
+        pending = set(futures)
+        last_error = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    self._log("warning", f"  [{futures[future].name}] failed: {e}")
+                    continue
+
+                return futures[future], result, {f: futures[f] for f in pending}
+
+        raise last_error
+
+    def get_transfers(self, address, start_block):
+        winner, transfers, pending = self._race("get_transfers", address, start_block)
+        self._log("info", f"  [{winner.name}] answered first")
+
+        for future, source in pending.items():
+            future.add_done_callback(lambda f, s=source: self._cross_check(winner, transfers, s, f))
+
+        return transfers
+
+    def get_receipt_status(self, tx_hash):
+        return self._race("get_receipt_status", tx_hash)[1]
+
+    def _cross_check(self, winner, winner_transfers, other, future):
+        try:
+            other_transfers = future.result()
+        except Exception:
+            return
+
+        # only compare confirmed transfers below the lower of the two heads, the sources can be a few blocks apart
+        def confirmed(transfers):
+            return {t["hash"].lower(): int(t["blockNumber"]) for t in transfers
+                    if int(t["confirmations"]) >= self.confirmations}
+
+        a, b = confirmed(winner_transfers), confirmed(other_transfers)
+        ceiling = min(max(a.values(), default=0), max(b.values(), default=0))
+        missing_from_other = sorted(h for h, block in a.items() if block <= ceiling and h not in b)
+        missing_from_winner = sorted(h for h, block in b.items() if block <= ceiling and h not in a)
+
+        if missing_from_other or missing_from_winner:
+            cycle_metrics.count_error(f"cross_check_{other.name}")
+            self._log("warning", f"transfer sources disagree: missing from [{other.name}]: {missing_from_other} "
+                                 f"missing from [{winner.name}]: {missing_from_winner}")
+
+    def _log(self, level, message):
+        if self.logger:
+            with self._lock:
+                getattr(self.logger, level)(message)
+
+
+def build_source(name, config, logger=None):
+    if name == "gnosisscan":
+        return GnosisscanSource(os.getenv('GNOSIS_SCAN_IO_API_KEY'))
+
+    if name == "blockscout":
+        return BlockscoutSource(os.getenv('BLOCKSCOUT_API_KEY'))
+
+    if name == "rpc_logs":
+        return RpcLogsSource(provider_pool.get_web3("gnosis", config), config["contracts"]["gnosis"]["donut"])
+
+    if name == "race":
+        primary, secondary = config["transfer_source"]["race"]
+        return RacingSource(build_source(primary, config, logger), build_source(secondary, config, logger), logger)
+
+    raise ValueError(f"unknown transfer source [{name}]")
@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+# stages of a shuttle cycle, in the order they run.  these are always exported (even when 0) so that
+# dashboards do not have gaps when a cycle returns early
+STAGES = ["fetch_users", "fetch_transfers", "tx_lookups", "receipt_checks", "user_matching", "notifications",
+          "dispatch", "db_update"]
+
+
+class CycleMetrics:
+    def __init__(self):
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.duration = 0.0
+        self.outcome = None
+        self.stages = defaultdict(float)
+        self.requests = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+        self.cache_misses = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        # stages can be entered many times per cycle (ie. once per tx), the time is accumulated
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def finish(self, outcome):
+        self.duration = time.perf_counter() - self._start
+        self.outcome = outcome
+
+    def to_dict(self):
+        return {
+            "started_at": self.started_at.isoformat(),
+            "duration": round(self.duration, 6),
+            "outcome": self.outcome,
+            "stages": {s: round(self.stages.get(s, 0.0), 6) for s in _stage_names(self.stages)},
+            "requests": dict(self.requests),
+            "retries": dict(self.retries),
+            "errors": dict(self.errors),
+            "cache_hits": dict(self.cache_hits),
+            "cache_misses": dict(self.cache_misses),
+        }
+
+
+# process wide totals, these are exported as prometheus counters
+_totals = {
+    "cycles": defaultdict(int),
+    "requests": defaultdict(int),
+    "retries": defaultdict(int),
+    "errors": defaultdict(int),
+    "cache_hits": defaultdict(int),
+    "cache_misses": defaultdict(int),
+}
+
+# gauges published by other modules (ie. shuttle latency), keyed by metric name then by label tuple
+_gauges = {}
+_gauge_help = {}
+
+_current = CycleMetrics()
+
+
+def start_cycle():
+    global _current
+    _current = CycleMetrics()
+    return _current
+
+
+def current():
+    return _current
+
+
+def stage(name):
+    return _current.stage(name)
+
+
+def count_request(provider, n=1):
+    _current.requests[provider] += n
+    _totals["requests"][provider] += n
+
+
+def count_retry(provider, n=1):
+    _current.retries[provider] += n
+    _totals["retries"][provider] += n
+
+
+def count_error(provider, n=1):
+    _current.errors[provider] += n
+    _totals["errors"][provider] += n
+
+
+def count_cache_hit(cache, n=1):
+    # answered locally, kept apart from the requests so those only show provider load
+    _current.cache_hits[cache] += n
+    _totals["cache_hits"][cache] += n
+
+
+def count_cache_miss(cache, n=1):
+    _current.cache_misses[cache] += n
+    _totals["cache_misses"][cache] += n
+
+
+def set_gauge(name, value, help_text="", **labels):
+    _gauge_help.setdefault(name, help_text)
+    _gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+
+def clear_gauge(name):
+    _gauges.pop(name, None)
+
+
+def finish_cycle(outcome, prometheus_path=None, json_path=None):
+    metrics = _current
+    metrics.finish(outcome)
+    _totals["cycles"][outcome] += 1
+
+    if json_path:
+        _append_json_line(json_path, metrics)
+
+    if prometheus_path:
+        _write_prometheus_textfile(prometheus_path, metrics)
+
+    return metrics
+
+
+def _stage_names(stages):
+    return STAGES + sorted(s for s in stages if s not in STAGES)
+
+
+def _append_json_line(json_path, metrics):
+    os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+    with open(json_path, 'a') as f:
+        f.write(json.dumps(metrics.to_dict()) + "\n")
+
+
+def _write_prometheus_textfile(prometheus_path, metrics):
+    lines = [
+        "# HELP shuttle_cycle_duration_seconds Wall time of the last shuttle cycle.",
+        "# TYPE shuttle_cycle_duration_seconds gauge",
+        f"shuttle_cycle_duration_seconds {metrics.duration:.6f}",
+        "# HELP shuttle_cycle_last_run_timestamp_seconds Unix time the last shuttle cycle started.",
+        "# TYPE shuttle_cycle_last_run_timestamp_seconds gauge",
+        f"shuttle_cycle_last_run_timestamp_seconds {metrics.started_at.timestamp():.0f}",
+        "# HELP shuttle_stage_duration_seconds Wall time spent per stage in the last shuttle cycle.",
+        "# TYPE shuttle_stage_duration_seconds gauge",
+    ]
+    lines += [f'shuttle_stage_duration_seconds{{stage="{s}"}} {metrics.stages.get(s, 0.0):.6f}'
+              for s in _stage_names(metrics.stages)]
+
+    lines += _per_cycle_lines("shuttle_cycle_requests", "Requests per provider in the last shuttle cycle.",
+                              metrics.requests)
+    lines += _per_cycle_lines("shuttle_cycle_retries", "Retries per provider in the last shuttle cycle.",
+                              metrics.retries)
+
+    lines += [
+        "# HELP shuttle_cycles_total Shuttle cycles run since the process started, by outcome.",
+        "# TYPE shuttle_cycles_total counter",
+    ]
+    lines += [f'shuttle_cycles_total{{outcome="{k}"}} {v}' for k, v in sorted(_totals["cycles"].items())]
+
+    lines += _total_lines("shuttle_requests_total", "Requests per provider since the process started.",
+                          _totals["requests"])
+    lines += _total_lines("shuttle_retries_total", "Retries per provider since the process started.",
+                          _totals["retries"])
+    lines += _total_lines("shuttle_errors_total", "Failed requests per provider since the process started.",
+                          _totals["errors"])
+    lines += _total_lines("shuttle_cache_hits_total", "Calls answered from a local cache since the process started.",
+                          _totals["cache_hits"], label="cache")
+    lines += _total_lines("shuttle_cache_misses_total", "Calls a local cache could not answer since the process "
+                          "started.", _totals["cache_misses"], label="cache")
+
+    for name in sorted(_gauges):
+        lines += [f"# HELP {name} {_gauge_help[name]}", f"# TYPE {name} gauge"]
+        for labels, value in sorted(_gauges[name].items()):
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+
+    # write to a temp file and rename so node_exporter never reads a partially written file
+    os.makedirs(os.path.dirname(os.path.abspath(prometheus_path)), exist_ok=True)
+    tmp_path = f"{prometheus_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, prometheus_path)
+
+
+def _per_cycle_lines(name, description, values):
+    return [f"# HELP {name} {description}", f"# TYPE {name} gauge"] + \
+        [f'{name}{{provider="{k}"}} {v}' for k, v in sorted(values.items())]
+
+
+def _total_lines(name, description, values, label="provider"):
+    return [f"# HELP {name} {description}", f"# TYPE {name} counter"] + \
+        [f'{name}{{{label}="{k}"}} {v}' for k, v in sorted(values.items())]
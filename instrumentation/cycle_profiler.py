@@ -0,0 +1,117 @@
+import cProfile
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+DEFAULT_CYCLES = 3
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+
+class CycleProfiler:
+    # profiles the next N shuttle cycles on demand, without restarting the daemon.  profiling is requested by
+    # sending SIGUSR1 to the process or by creating the trigger file (optionally containing the number of cycles).
+    # each profiled cycle writes a cProfile dump (for snakeviz / pstats) and a collapsed stack file that can be fed
+    # straight into flamegraph.pl or speedscope
+    def __init__(self, name, output_dir, trigger_file=None, cycles=DEFAULT_CYCLES,
+                 sample_interval=DEFAULT_SAMPLE_INTERVAL, logger=None):
+        self.name = name
+        self.output_dir = output_dir
+        self.trigger_file = trigger_file
+        self.cycles = cycles
+        self.sample_interval = sample_interval
+        self.logger = logger
+        self.remaining = 0
+
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self.request(self.cycles)
+
+    def request(self, cycles):
+        self.remaining = max(self.remaining, cycles)
+        self._log(f"profiling requested for the next {cycles} cycle(s)")
+
+    def _check_trigger_file(self):
+        if not self.trigger_file or not os.path.exists(self.trigger_file):
+            return
+
+        try:
+            with open(self.trigger_file, 'r') as f:
+                contents = f.read().strip()
+            cycles = int(contents) if contents else self.cycles
+        except ValueError:
+            cycles = self.cycles
+
+        os.remove(self.trigger_file)
+        self.request(cycles)
+
+    def run(self, fn, *args, **kwargs):
+        self._check_trigger_file()
+
+        if self.remaining <= 0:
+            return fn(*args, **kwargs)
+
+        self.remaining -= 1
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(self.output_dir, f"{self.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+        sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+        profiler = cProfile.Profile()
+
+        sampler.start()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            sampler.stop()
+
+            try:
+                profiler.dump_stats(f"{base_path}.prof")
+                sampler.write_collapsed(f"{base_path}.collapsed")
+                self._log(f"profile written to [{base_path}.prof] ({self.remaining} cycle(s) remaining)")
+            except Exception as e:
+                self._log(f"unable to write profile: {e}")
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+
+class _StackSampler(threading.Thread):
+    # samples the profiled thread's stack on a fixed interval, building the collapsed stack format used by
+    # flamegraphs: "outer;inner;innermost <count>"
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,207 @@
+import math
+from datetime import datetime, timedelta
+
+from instrumentation import cycle_metrics
+
+# each latency is measured between two timestamps on the shuttle table.  shuttles processed before submitted_at
+# existed do not have a submitted_at, their batching wait runs up to processed_at and they have no confirmation time
+LATENCIES = {
+    "detection_lag": ("gno_timestamp", "created_at"),
+    "batching_wait": ("created_at", "coalesce(submitted_at, processed_at)"),
+    "arb1_confirmation": ("submitted_at", "processed_at"),
+    "notification_lag": ("processed_at", "notified_at"),
+}
+
+PERCENTILES = [50, 95, 99]
+
+# latencies are stored in log spaced histogram buckets so that percentiles can be maintained incrementally.  each
+# bucket is 5% wider than the last, so any reported percentile is within 5% of the true value
+BUCKET_GROWTH = 1.05
+
+
+def create_schema(db):
+    sql_create = """
+        CREATE TABLE IF NOT EXISTS
+        shuttle_latency_daily (
+            day DATE NOT NULL,
+            metric NVARCHAR2 NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, metric, bucket)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS
+        shuttle_latency_sample (
+            metric NVARCHAR2 NOT NULL,
+            shuttle_id INTEGER NOT NULL,
+            day DATE NOT NULL,
+            bucket INTEGER NOT NULL,
+            PRIMARY KEY (metric, shuttle_id)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS
+        shuttle_latency_cursor (
+            metric NVARCHAR2 NOT NULL PRIMARY KEY,
+            last_end_at DATETIME NOT NULL,
+            last_shuttle_id INTEGER NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_shuttle_created_at ON shuttle (created_at);
+        CREATE INDEX IF NOT EXISTS idx_shuttle_processed_at ON shuttle (processed_at);
+        CREATE INDEX IF NOT EXISTS idx_shuttle_notified_at ON shuttle (notified_at);
+    """
+    cur = db.cursor()
+    cur.executescript(sql_create)
+
+
+def bucket_for(seconds):
+    if seconds <= 1:
+        return 0
+    return math.ceil(math.log(seconds) / math.log(BUCKET_GROWTH))
+
+
+def bucket_upper_bound(bucket):
+    return BUCKET_GROWTH ** bucket
+
+
+def update_aggregates(db):
+    # fold every shuttle whose end timestamp was set since the last run into the daily histograms.  the cursor is
+    # (end timestamp, id), a shuttle only comes up again when its end timestamp moved (ie. a batch that failed and
+    # was submitted again).  each shuttle's sample is kept per latency, so the new sample replaces the old one in the
+    # histograms instead of being counted twice
+    cur = db.cursor()
+    added = 0
+
+    for metric, (start_col, end_col) in LATENCIES.items():
+        cur.execute("select last_end_at, last_shuttle_id from shuttle_latency_cursor where metric = ?;", [metric])
+        cursor = cur.fetchone() or ("", 0)
+
+        cur.execute(f"""
+            select id, {end_col} as end_at, date({end_col}) as day,
+                (julianday({end_col}) - julianday({start_col})) * 86400.0 as seconds
+            from shuttle
+            where {start_col} is not null
+              and {end_col} is not null
+              and ({end_col} > ? or ({end_col} = ? and id > ?))
+            order by {end_col}, id;
+        """, [cursor[0], cursor[0], cursor[1]])
+        rows = cur.fetchall()
+
+        if not rows:
+            continue
+
+        counts = {}
+        samples = []
+        for row in rows:
+            cur.execute("select day, bucket from shuttle_latency_sample where metric = ? and shuttle_id = ?;",
+                        [metric, row[0]])
+            previous = cur.fetchone()
+            if previous:
+                counts[previous] = counts.get(previous, 0) - 1
+
+            key = (row[2], bucket_for(max(row[3], 0)))
+            counts[key] = counts.get(key, 0) + 1
+            samples.append([metric, row[0], *key])
+
+        cur.executemany("""
+            insert into shuttle_latency_sample (metric, shuttle_id, day, bucket)
+            values (?, ?, ?, ?)
+            on conflict (metric, shuttle_id) do update set day = excluded.day, bucket = excluded.bucket;
+        """, samples)
+
+        cur.executemany("""
+            insert into shuttle_latency_daily (day, metric, bucket, count)
+            values (?, ?, ?, ?)
+            on conflict (day, metric, bucket) do update set count = count + excluded.count;
+        """, [[day, metric, bucket, count] for (day, bucket), count in counts.items() if count])
+
+        cur.execute("""
+            insert into shuttle_latency_cursor (metric, last_end_at, last_shuttle_id)
+            values (?, ?, ?)
+            on conflict (metric) do update set last_end_at = excluded.last_end_at,
+                last_shuttle_id = excluded.last_shuttle_id;
+        """, [metric, rows[-1][1], rows[-1][0]])
+
+        added += len(rows)
+
+    db.commit()
+    return added
+
+
+def percentiles_from_histogram(histogram, percentiles=PERCENTILES):
+    # histogram is a list of (bucket, count) tuples.  uses the nearest rank method and reports the upper bound of
+    # the bucket the rank falls into
+    histogram = sorted(histogram)
+    total = sum(c for _, c in histogram)
+    if not total:
+        return {p: None for p in percentiles}
+
+    result = {}
+    for p in percentiles:
+        rank = max(math.ceil(p / 100 * total), 1)
+        cumulative = 0
+        for bucket, count in histogram:
+            cumulative += count
+            if cumulative >= rank:
+                result[p] = 0.0 if bucket == 0 else bucket_upper_bound(bucket)
+                break
+
+    return result
+
+
+def daily_report(db, since_day=None, metric=None):
+    sql = "select day, metric, bucket, count from shuttle_latency_daily where day >= ?"
+    params = [since_day or "0000-00-00"]
+    if metric:
+        sql += " and metric = ?"
+        params.append(metric)
+
+    cur = db.cursor()
+    cur.execute(sql + " order by day, metric;", params)
+
+    grouped = {}
+    for day, m, bucket, count in cur.fetchall():
+        grouped.setdefault((day, m), []).append((bucket, count))
+
+    report = []
+    for (day, m), histogram in grouped.items():
+        row = {"day": day, "metric": m, "count": sum(c for _, c in histogram)}
+        row.update({f"p{p}": v for p, v in percentiles_from_histogram(histogram).items()})
+        report.append(row)
+
+    return report
+
+
+def publish_gauges(db, now=None):
+    # live view for the prometheus textfile: today's percentiles plus the age of the oldest shuttle still waiting at
+    # each step, which is what moves first when the bridge falls behind
+    now = now or datetime.now()
+    today = now.strftime("%Y-%m-%d")
+
+    cycle_metrics.clear_gauge("shuttle_latency_seconds")
+    cycle_metrics.clear_gauge("shuttle_latency_samples")
+    for row in daily_report(db, since_day=today):
+        cycle_metrics.set_gauge("shuttle_latency_samples", row["count"],
+                                "Shuttles measured today per latency.", metric=row["metric"])
+        for p in PERCENTILES:
+            cycle_metrics.set_gauge("shuttle_latency_seconds", round(row[f"p{p}"], 3),
+                                    "Shuttle latency percentiles for today.", metric=row["metric"],
+                                    quantile=f"0.{p}")
+
+    waiting_sql = {
+        "distribution": "select min(created_at) from shuttle where status = 'queued';",
+        "notification": "select min(processed_at) from shuttle where status = 'distributed' "
+                        "and from_user is not null;",
+    }
+
+    cur = db.cursor()
+    for step, sql in waiting_sql.items():
+        cur.execute(sql)
+        oldest = cur.fetchone()[0]
+        age = (now - datetime.fromisoformat(oldest)).total_seconds() if oldest else 0
+        cycle_metrics.set_gauge("shuttle_oldest_waiting_seconds", round(max(age, 0), 3),
+                                "Age of the oldest shuttle waiting at each step.", step=step)
+
+
+def default_since_day(days):
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
@@ -0,0 +1,60 @@
+import atexit
+import json
+import logging
+import queue
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# attributes every LogRecord has, anything else on a record was passed with extra={...} and is written as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    # one json object per line: time, level, logger, message and the extra fields of the call (ie. stage, tx_hash,
+    # duration) so the log can be queried with jq or loaded into sqlite
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        event.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES})
+
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            event["exception"] = record.exc_text
+
+        return json.dumps(event, default=str)
+
+
+class _LazyQueueHandler(QueueHandler):
+    # the stock QueueHandler formats the message in the calling thread.  here msg and args are handed over as they
+    # are and only formatted by the listener thread, so callers must log with %-style args of immutable values
+    # (strings, numbers), never with objects that are changed afterwards
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup(log_name, log_path, max_bytes=2500000, backup_count=100, level=logging.INFO):
+    # the caller only puts records on a queue, a background thread writes them to a json lines file (rotated like
+    # before) and to the console.  the queue is drained when the process exits
+    log_queue = queue.SimpleQueue()
+
+    file_handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(log_name)
+    logger.setLevel(level)
+    logger.addHandler(_LazyQueueHandler(log_queue))
+    return logger
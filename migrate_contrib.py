@@ -1,3 +1,4 @@
+import argparse
 import csv
 import json
 import logging
@@ -7,14 +8,82 @@ import time
 
 from logging.handlers import RotatingFileHandler
 from os import path
-from urllib import request
-from dotenv import load_dotenv
-from web3 import Web3
 
-from safe.safe_tx import SafeTx
-from safe.safe_tx_builder import build_tx_builder_json
+MIGRATION_CSV = os.path.join("out", "final_gnosis_migration.csv")
+MIGRATION_SNAPSHOT = os.path.join("out", "final_gnosis_migration.snap")
+
+
+def migration_batches(size, logger):
+    # [(address, amount)] for size rows of the migration at a time, rows without a balance left out.  read from the
+    # binary snapshot when there is one (see migration_snapshot.py) and it was imported from the csv as it is now,
+    # otherwise from the csv
+    from engine import snapshot_file
+
+    if os.path.exists(MIGRATION_SNAPSHOT) and not snapshot_file.matches(MIGRATION_SNAPSHOT, MIGRATION_CSV):
+        logger.warning(f"{MIGRATION_SNAPSHOT} is out of date with {MIGRATION_CSV}, reading the csv instead "
+                       f"(run: python cli.py migrate snapshot import)")
+    elif os.path.exists(MIGRATION_SNAPSHOT):
+        with snapshot_file.Snapshot(MIGRATION_SNAPSHOT) as snapshot:
+            for batch in snapshot.batches(size):
+                yield [("0x" + address.hex(), amount) for address, amount in batch]
+        return
+
+    with open(MIGRATION_CSV, newline='') as csvfile:
+        records = list(csv.DictReader(csvfile, delimiter=','))
+
+    for start in range(0, len(records), size):
+        yield [(u['address'], int(u['contrib_gwei'])) for u in records[start:start + size]
+               if int(u['contrib_gwei']) > 0]
+
+
+def add_arguments(parser):
+    parser.add_argument("--merkle", action="store_true",
+                        help="build a merkle root and proof file for a claim contract instead of mintMany batches")
+    parser.add_argument("--workers", type=int, help="processes hashing the merkle leaves (default: one per cpu)")
+
+
+def merkle_migration(config, logger, workers=None):
+    # one leaf per address with a balance.  the only transaction needed is setMerkleRoot on the claim contract
+    # (contracts/MerkleClaim.sol), users then claim their own balance with the proof from the proof file
+    from engine import merkle_claim
+    from safe.safe_tx import SafeTx
+    from safe.safe_tx_builder import build_tx_builder_json
+
+    balances = {}
+    for batch in migration_batches(1000, logger):
+        for address, amount in batch:
+            balances[address.lower()] = balances.get(address.lower(), 0) + amount
+
+    entries = sorted(balances.items())
+    logger.info(f"building merkle tree for {len(entries)} addresses...")
+    root, claims = merkle_claim.build(entries, workers)
+    total = sum(balances.values())
+
+    proof_path = os.path.join("out", "arb1_contrib_merkle_proofs.jsonl")
+    merkle_claim.write_proofs(proof_path, root, claims, total)
+    logger.info(f"  root: 0x{bytes(root).hex()} -> {proof_path}")
+
+    claim_contract = config["contracts"]["arb1"].get("contrib_claim")
+    if not claim_contract:
+        logger.info("  no contrib_claim contract in config.json, set the root on it once it is deployed")
+        return
+
+    tx = build_tx_builder_json("Arb One Contrib Migration (merkle root)", [
+        SafeTx(to=claim_contract, value=0, data=merkle_claim.set_root_data(root)),
+    ])
+
+    with open(os.path.join("out", "arb1_contrib_merkle_root.json"), 'w') as f:
+        json.dump(tx, f, indent=4)
+
+
+def main(args=None):
+    # web3 and the safe helpers are only imported once the migration actually runs
+    from dotenv import load_dotenv
+
+    from rpc import http_session, provider_pool
+    from safe.safe_tx import SafeTx
+    from safe.safe_tx_builder import build_tx_builder_json
 
-if __name__ == '__main__':
     # load environment variables
     load_dotenv()
 
@@ -22,6 +91,8 @@ if __name__ == '__main__':
     with open(path.normpath("config.json"), 'r') as f:
         config = json.load(f)
 
+    http_session.configure(config)
+
     # set up logging
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     logger = logging.getLogger("migrate_contrib")
@@ -33,10 +104,14 @@ if __name__ == '__main__':
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
-    logger.info("connecting to provider - ankr.com...")
-    web3 = Web3(Web3.HTTPProvider(os.getenv('ANKR_API_PROVIDER')))
+    if args and args.merkle:
+        merkle_migration(config, logger, args.workers)
+        return
+
+    logger.info("connecting to gnosis rpc providers...")
+    web3 = provider_pool.get_web3("gnosis", config)
     if not web3.is_connected():
-        logger.error("  failed to connect to ankr node [gnosis]")
+        logger.error("  failed to connect to any gnosis rpc provider")
         exit(4)
     else:
         logger.info("  success.")
@@ -58,7 +133,7 @@ if __name__ == '__main__':
     # ---- build the final file and produce a csv file ----------
 
     # logger.info("grabbing users.json file...")
-    # users = json.load(request.urlopen(f"https://ethtrader.github.io/donut.distribution/users.json"))
+    # users = http_session.get_json("https://ethtrader.github.io/donut.distribution/users.json")
     #
     #
     # user_contrib = []
@@ -99,21 +174,13 @@ if __name__ == '__main__':
 
     # ---- read the final file and produce the resulting safe tx(s) ----------
 
-    with open(os.path.join("out", f"final_gnosis_migration.csv"), newline='') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=',')
-        records = list(reader)
-
-    start = 0
     size = 850
     batch = 1
 
-    for i in range(start, len(records), size):
-        x = i
-        current_batch = records[x:x + size]
-
+    for current_batch in migration_batches(size, logger):
         contrib_contract_data = contrib_contract_arb1.encodeABI("mintMany", [
-            [web3.to_checksum_address(u['address']) for u in current_batch if int(u['contrib_gwei']) > 0],
-            [int(u['contrib_gwei']) for u in current_batch if int(u['contrib_gwei']) > 0]
+            [web3.to_checksum_address(address) for address, _ in current_batch],
+            [amount for _, amount in current_batch]
         ])
 
         transactions = [
@@ -133,4 +200,7 @@ if __name__ == '__main__':
             json.dump(tx, f, indent=4)
 
 
-
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="build the safe transactions for the arb1 contrib migration")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+import argparse
+import os
+
+from engine import snapshot_file
+
+DEFAULT_CSV = os.path.join("out", "final_gnosis_migration.csv")
+DEFAULT_SNAPSHOT = os.path.join("out", "final_gnosis_migration.snap")
+
+
+def add_arguments(parser):
+    actions = parser.add_subparsers(dest="action", required=True)
+
+    action = actions.add_parser("import", help="csv -> snapshot")
+    action.add_argument("--csv", default=DEFAULT_CSV, help=f"(default: {DEFAULT_CSV})")
+    action.add_argument("--snapshot", default=DEFAULT_SNAPSHOT, help=f"(default: {DEFAULT_SNAPSHOT})")
+
+    action = actions.add_parser("export", help="snapshot -> csv")
+    action.add_argument("--snapshot", default=DEFAULT_SNAPSHOT, help=f"(default: {DEFAULT_SNAPSHOT})")
+    action.add_argument("--csv", required=True)
+
+    action = actions.add_parser("lookup", help="amount for an address")
+    action.add_argument("address")
+    action.add_argument("--snapshot", default=DEFAULT_SNAPSHOT, help=f"(default: {DEFAULT_SNAPSHOT})")
+
+    action = actions.add_parser("diff", help="addresses whose amount differs between two snapshots")
+    action.add_argument("old")
+    action.add_argument("new")
+
+
+def main(args):
+    if args.action == "import":
+        snapshot_file.from_csv(args.csv, args.snapshot)
+        with snapshot_file.Snapshot(args.snapshot) as snapshot:
+            print(f"{len(snapshot)} rows -> {args.snapshot}")
+
+    elif args.action == "export":
+        # addresses are written checksummed, like the csv the snapshot was imported from
+        from web3 import Web3
+
+        snapshot_file.to_csv(args.snapshot, args.csv, Web3.to_checksum_address)
+        print(f"{args.snapshot} -> {args.csv}")
+
+    elif args.action == "lookup":
+        with snapshot_file.Snapshot(args.snapshot) as snapshot:
+            i = snapshot.find(args.address)
+            if i is None:
+                print(f"{args.address} is not in the snapshot")
+                exit(1)
+            print(f"{snapshot.user(i)} {args.address} {snapshot.amount(i)}")
+
+    elif args.action == "diff":
+        with snapshot_file.Snapshot(args.old) as old, snapshot_file.Snapshot(args.new) as new:
+            changes = 0
+            for address, old_amount, new_amount in snapshot_file.diff(old, new):
+                print(f"0x{address.hex()} {old_amount} -> {new_amount}")
+                changes += 1
+            print(f"{changes} addresses differ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="binary migration snapshots: import / export csv, lookups, diffs")
+    add_arguments(parser)
+    main(parser.parse_args())
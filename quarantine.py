@@ -0,0 +1,64 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from engine import batch_simulation, lottery_draw, shuttle_db
+
+
+# entries the shuttle took out of a batch because distribute reverted on them (see engine/batch_simulation.py) stay
+# quarantined until an operator releases them.  without --release this lists what is waiting
+def add_arguments(parser):
+    parser.add_argument("--release", type=int, nargs="+", metavar="ID",
+                        help="quarantine ids to put back in the dispatch queue")
+
+
+def main(args):
+    # load config
+    with open(os.path.normpath("config.json"), 'r') as f:
+        config = json.load(f)
+
+    # set up logging
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log_name = "quarantine"
+    logger = logging.getLogger(log_name)
+    logger.setLevel(logging.INFO)
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    log_path = os.path.join(base_dir, f"logs/{log_name}.log")
+    file_handler = RotatingFileHandler(os.path.normpath(log_path), maxBytes=2500000, backupCount=4)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+    with sqlite3.connect(config["db_location"]) as db:
+        lottery_draw.create_schema(db)
+        batch_simulation.create_schema(db)
+
+        if not args.release:
+            entries = batch_simulation.pending(db)
+            if not entries:
+                logger.info("nothing in quarantine")
+
+            for e in entries:
+                what = f"lottery draw {e['lottery_draw_id']}" if e['lottery_draw_id'] else e['gno_tx_hashes']
+                logger.info(f"[{e['id']}] {e['address']} {shuttle_db.from_wei(shuttle_db.blob_to_wei(e['amount_wei']))}"
+                            f" ({what}) since {e['quarantined_at']}: {e['reason']}")
+            return
+
+        for quarantine_id in args.release:
+            entry = batch_simulation.release(db, quarantine_id, datetime.now())
+            if entry:
+                logger.info(f"released [{quarantine_id}] {entry['address']}, it goes out with the next batch")
+            else:
+                logger.error(f"[{quarantine_id}] is not in quarantine")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="list quarantined shuttle entries or release them")
+    add_arguments(parser)
+    main(parser.parse_args())
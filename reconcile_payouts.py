@@ -0,0 +1,67 @@
+import argparse
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from engine import lottery_draw, payout_reconciliation, shuttle_db
+from rpc import http_session, provider_pool
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="check every distributed shuttle against the DONUT transfers on arb1")
+    parser.add_argument("--start-block", type=int, help="arb1 block to start indexing from on the first run "
+                                                         "(default: block of the first distribute transaction)")
+    parser.add_argument("--all", action="store_true", help="list every discrepancy found so far, not just new ones")
+    parser.add_argument("--json", action="store_true", help="output json lines instead of a table")
+    args = parser.parse_args()
+
+    # load environment variables
+    load_dotenv()
+
+    # load config
+    with open(os.path.normpath("config.json"), 'r') as f:
+        config = json.load(f)
+
+    http_session.configure(config)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logger = logging.getLogger("reconcile_payouts")
+
+    reconciliation_config = config.get("reconciliation", {})
+
+    with shuttle_db.connect(config) as db:
+        payout_reconciliation.create_schema(db)
+        lottery_draw.create_schema(db)
+
+        logger.info("indexing arb1 payouts...")
+        new_tx_hashes = payout_reconciliation.index_payouts(
+            provider_pool.get_web3("arb1", config), db, config,
+            start_block=args.start_block if args.start_block is not None else reconciliation_config.get("start_block"),
+            chunk_size=reconciliation_config.get("chunk_size", payout_reconciliation.DEFAULT_CHUNK_SIZE),
+            confirmations=reconciliation_config.get("confirmations", payout_reconciliation.DEFAULT_CONFIRMATIONS),
+            logger=logger)
+
+        logger.info("reconciling shuttles...")
+        checked, discrepancies = payout_reconciliation.reconcile(
+            db, new_tx_hashes,
+            grace_minutes=reconciliation_config.get("grace_minutes", payout_reconciliation.DEFAULT_GRACE_MINUTES))
+        logger.info(f"  {checked} shuttles checked, {len(discrepancies)} discrepancies.")
+
+        if args.all:
+            discrepancies = db.execute("""
+                select kind, arb_tx_hash, to_address, expected_wei, paid_wei, gno_tx_hashes, detected_at
+                from payout_discrepancy order by id;
+            """).fetchall()
+
+    columns = ["kind", "arb_tx_hash", "to_address", "expected_wei", "paid_wei", "gno_tx_hashes", "detected_at"]
+    for d in discrepancies:
+        row = dict(zip(columns, d))
+        if args.json:
+            print(json.dumps(row, default=str))
+        else:
+            print(f"{row['kind']:<11}{row['arb_tx_hash']}  {row['to_address']}  "
+                  f"expected [{row['expected_wei']}] paid [{row['paid_wei']}]")
+
+    # non zero exit so cron / monitoring notices
+    exit(1 if discrepancies else 0)
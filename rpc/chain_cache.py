@@ -0,0 +1,167 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_LOCATION = "chain_cache.db"
+DEFAULT_MAX_MB = 256
+DEFAULT_CONFIRMATIONS = 100
+
+# methods whose answer is fixed once the block they read is final.  the value is the position of the block
+# parameter in params
+BLOCK_PINNED_METHODS = {
+    "eth_call": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getStorageAt": 2,
+    "eth_getTransactionCount": 1,
+}
+
+
+def _block_number(value):
+    # a block parameter or field as an int.  None for tags (latest, pending, ...), those answers move and are never
+    # cached
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.startswith("0x"):
+        return int(value, 16)
+    return None
+
+
+def pinned_block(method, params, result):
+    # the block an answer depends on, it can be cached once that block is final.  returns -1 when the answer can
+    # never change (content addressed by a block hash) and None when it must not be cached at all
+    if result is None:
+        # not found (yet), ie. a transaction that has not been mined
+        return None
+
+    if method == "eth_getBlockByHash":
+        return -1
+
+    if method in ("eth_getTransactionByHash", "eth_getTransactionReceipt"):
+        return _block_number(result.get("blockNumber"))
+
+    if method == "eth_getBlockByNumber":
+        return _block_number(params[0])
+
+    if method == "eth_getLogs":
+        log_filter = params[0]
+        if log_filter.get("blockHash"):
+            return -1
+        from_block = _block_number(log_filter.get("fromBlock"))
+        to_block = _block_number(log_filter.get("toBlock"))
+        return to_block if from_block is not None else None
+
+    if method in BLOCK_PINNED_METHODS:
+        position = BLOCK_PINNED_METHODS[method]
+        return _block_number(params[position]) if len(params) > position else None
+
+    return None
+
+
+def head_block(method, params, result):
+    # the chain head, when the answer tells us what it is
+    if method == "eth_blockNumber":
+        return _block_number(result)
+    if method == "eth_getBlockByNumber" and params and params[0] == "latest" and result:
+        return _block_number(result.get("number"))
+    return None
+
+
+class ChainCache:
+    # read-through cache for chain data that can no longer change, shared by every script through the provider
+    # pools.  entries are keyed by a hash of (chain, method, params) and only written once the block they depend on
+    # has `confirmations` blocks on top of it.  the file is bounded to max_mb, least recently used entries go first
+    def __init__(self, db_location=DEFAULT_DB_LOCATION, max_mb=DEFAULT_MAX_MB, confirmations=DEFAULT_CONFIRMATIONS):
+        self.confirmations = confirmations
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_location, check_same_thread=False, isolation_level=None)
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+
+            CREATE TABLE IF NOT EXISTS
+            chain_cache (
+                key BLOB NOT NULL PRIMARY KEY,
+                chain NVARCHAR2 NOT NULL,
+                method NVARCHAR2 NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_chain_cache_last_used ON chain_cache (last_used);
+        """)
+        self._size = self._db.execute("select coalesce(sum(size), 0) from chain_cache;").fetchone()[0]
+
+    @staticmethod
+    def key(chain, method, params):
+        canonical = json.dumps([chain, method, params], sort_keys=True, separators=(",", ":"),
+                               default=lambda v: "0x" + bytes(v).hex())
+        return hashlib.sha256(canonical.encode()).digest()
+
+    def get(self, chain, method, params):
+        # the cached result, or None.  None is never cached so it always means a miss
+        key = self.key(chain, method, params)
+        with self._lock:
+            row = self._db.execute("select result from chain_cache where key = ?;", [key]).fetchone()
+            if row is None:
+                return None
+            self._db.execute("update chain_cache set last_used = ? where key = ?;", [time.time(), key])
+        return json.loads(row[0])
+
+    def put(self, chain, method, params, result, head):
+        # stores the result if it is final at the given head.  returns whether it was stored
+        block = pinned_block(method, params, result)
+        if block is None or (block >= 0 and (head is None or block > head - self.confirmations)):
+            return False
+
+        value = json.dumps(result, separators=(",", ":"))
+        with self._lock:
+            # final data does not change, an entry that is already there is left alone
+            cur = self._db.execute("""
+                insert or ignore into chain_cache (key, chain, method, result, size, last_used)
+                values (?, ?, ?, ?, ?, ?);
+            """, [self.key(chain, method, params), chain, method, value, len(value), time.time()])
+            self._size += len(value) * cur.rowcount
+
+            if self._size > self.max_bytes:
+                self._evict()
+
+        return True
+
+    def _evict(self):
+        # drops the least recently used entries until the cache is back to 90% of its size
+        target = self.max_bytes * 0.9
+        cur = self._db.cursor()
+        cur.execute("select key, size from chain_cache order by last_used;")
+        keys = []
+        for key, size in cur:
+            if self._size <= target:
+                break
+            keys.append([key])
+            self._size -= size
+
+        self._db.executemany("delete from chain_cache where key = ?;", keys)
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("select count(*) from chain_cache;").fetchone()[0]
+        return {"entries": entries, "size": self._size, "max_size": self.max_bytes}
+
+
+_cache = None
+
+
+def get_cache(config):
+    # one cache per process, shared by every chain.  optional "chain_cache" section in config.json, caching is off
+    # when it is missing or disabled
+    global _cache
+    cache_config = config.get("chain_cache", {})
+    if _cache is None and cache_config.get("enabled"):
+        _cache = ChainCache(cache_config.get("db_location", DEFAULT_DB_LOCATION),
+                            cache_config.get("max_mb", DEFAULT_MAX_MB),
+                            cache_config.get("confirmations", DEFAULT_CONFIRMATIONS))
+    return _cache
@@ -0,0 +1,71 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import cycle_metrics
+
+DEFAULT_TIMEOUT = 15
+DEFAULT_POOL_SIZE = 10
+USER_AGENT = "arb1 shuttle by u/mattg1981"
+
+_session = None
+_settings = {
+    "timeout": DEFAULT_TIMEOUT,
+    "pool_size": DEFAULT_POOL_SIZE,
+}
+
+
+def configure(config):
+    # optional "http" section in config.json: {"timeout": 15, "pool_size": 10}
+    global _session
+    _settings.update(config.get("http", {}))
+    _session = None
+
+
+def timeout():
+    return _settings["timeout"]
+
+
+def session():
+    # one requests session per process.  every outbound call (scan apis, users.json and the web3 providers) shares
+    # its connection pool, so connections are kept alive between calls and cycles instead of paying for a new
+    # tcp + tls handshake on every request.  gzip is negotiated by requests by default
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=_settings["pool_size"], pool_maxsize=_settings["pool_size"])
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+
+    return _session
+
+
+def get(url, provider=None, **kwargs):
+    if provider:
+        cycle_metrics.count_request(provider)
+
+    kwargs.setdefault("timeout", _settings["timeout"])
+    try:
+        response = session().get(url, **kwargs)
+        response.raise_for_status()
+    except Exception:
+        if provider:
+            cycle_metrics.count_error(provider)
+        raise
+
+    return response
+
+
+def get_json(url, provider=None, **kwargs):
+    return get(url, provider, **kwargs).json()
+
+
+def get_stream(url, provider=None, chunk_size=65536, **kwargs):
+    # the response body in chunks, without reading it into memory first (see json_stream).  returns the response
+    # too, for its status code and headers
+    response = get(url, provider, stream=True, **kwargs)
+    return response, response.iter_content(chunk_size=chunk_size)
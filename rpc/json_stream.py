@@ -0,0 +1,97 @@
+import codecs
+import json
+import re
+
+# incremental parsing for large json documents (users.json, scan api responses).  the document is read in chunks
+# and only one array item is decoded at a time (json.JSONDecoder.raw_decode on a rolling buffer), so the whole
+# object graph is never built and callers keep just the fields they need
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self._utf8.decode(b"", final=True)
+        else:
+            self.buf = self.buf[self.pos:] + (self._utf8.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at {self.buf[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _items(reader):
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+
+    while True:
+        yield reader.value()
+        separator = reader.peek()
+        reader.expect(separator if separator in ",]" else ",")
+        if separator == "]":
+            return
+
+
+def iter_array(chunks, key=None, fields=None):
+    # yields the items of the top level array, or of the array under `key` in the top level object.  every other
+    # member of that object (ie. status / message) is stored in `fields`, as is `key` itself when it is not an array
+    reader = _Reader(chunks)
+    if key is None:
+        yield from _items(reader)
+        return
+
+    reader.expect("{")
+    while reader.peek() != "}":
+        name = reader.value()
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            yield from _items(reader)
+        else:
+            value = reader.value()
+            if fields is not None:
+                fields[name] = value
+
+        if reader.peek() == ",":
+            reader.pos += 1
+
+
+def pick(items, names):
+    # only the named fields of each item, as a tuple
+    for item in items:
+        yield tuple(item.get(n) for n in names)
@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+
+from instrumentation import cycle_metrics
+from rpc import chain_cache, http_session
+
+# read only calls that are safe to send to a second provider when the first one is slow.  eth_getTransactionCount
+# is deliberately not here, a lagging provider could hand back a stale nonce
+HEDGEABLE_METHODS = {
+    "eth_blockNumber",
+    "eth_call",
+    "eth_chainId",
+    "eth_estimateGas",
+    "eth_feeHistory",
+    "eth_gasPrice",
+    "eth_getBalance",
+    "eth_getBlockByHash",
+    "eth_getBlockByNumber",
+    "eth_getCode",
+    "eth_getLogs",
+    "eth_getTransactionByHash",
+    "eth_getTransactionReceipt",
+    "eth_maxPriorityFeePerGas",
+    "net_version",
+    "web3_clientVersion",
+}
+
+# calls that change chain state.  a timeout does not mean the endpoint did not broadcast the transaction, so these are
+# sent to the best endpoint only and never retried or hedged on another one
+WRITE_METHODS = {
+    "eth_sendRawTransaction",
+    "eth_sendTransaction",
+}
+
+LATENCY_ALPHA = 0.3
+ERROR_ALPHA = 0.2
+
+DEFAULT_HEDGE_AFTER = 1.5
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 60
+DEFAULT_BATCH_SIZE = 100
+
+
+class _Endpoint:
+    def __init__(self, uri, timeout):
+        self.uri = uri
+        self.name = urlparse(uri).hostname or uri
+        self.timeout = timeout
+        self.provider = Web3.HTTPProvider(uri, request_kwargs={"timeout": timeout}, session=http_session.session())
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def score(self):
+        # untried endpoints score 0 so that every endpoint gets measured.  errors make an endpoint look slower
+        # than it is, so a flaky but fast endpoint loses to a steady one
+        return (self.latency or 0.0) * (1 + 4 * self.error_rate)
+
+    def is_available(self, now):
+        return self.open_until <= now
+
+
+class ProviderPool(JSONBaseProvider):
+    # web3 provider that spreads json-rpc calls over several endpoints for the same chain.  calls go to the healthy
+    # endpoint with the lowest latency (ewma), endpoints that fail repeatedly are taken out of rotation for a
+    # cooldown period (circuit breaker) and read calls that take longer than hedge_after are also sent to the next
+    # best endpoint, the first answer wins.  with a cache, final chain data is answered locally (see chain_cache)
+    def __init__(self, chain, endpoint_uris, timeout=None, hedge_after=DEFAULT_HEDGE_AFTER,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN, cache=None):
+        super().__init__()
+        if not endpoint_uris:
+            raise ValueError(f"no rpc endpoints configured for [{chain}]")
+
+        self.chain = chain
+        self.endpoints = [_Endpoint(uri, timeout or http_session.timeout()) for uri in endpoint_uris]
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.cache = cache
+        self.head = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(2 * len(self.endpoints), 4),
+                                            thread_name_prefix=f"rpc-{chain}")
+
+    def make_request(self, method, params):
+        if self.cache:
+            cached = self.cache.get(self.chain, method, params)
+            if cached is not None:
+                cycle_metrics.count_cache_hit("chain_cache")
+                return {"jsonrpc": "2.0", "id": 0, "result": cached}
+            cycle_metrics.count_cache_miss("chain_cache")
+
+        response = self._make_request(method, params)
+        self._observe(method, params, response)
+        return response
+
+    def _make_request(self, method, params):
+        candidates = self._ranked_endpoints()
+
+        if method in WRITE_METHODS:
+            return self._call(candidates[0], method, params)
+
+        if method in HEDGEABLE_METHODS and self.hedge_after is not None and len(candidates) > 1:
+            return self._hedged_request(candidates, method, params)
+
+        last_error = None
+        for i, endpoint in enumerate(candidates):
+            if i:
+                cycle_metrics.count_retry(endpoint.name)
+            try:
+                return self._call(endpoint, method, params)
+            except Exception as e:
+                last_error = e
+
+        raise last_error
+
+    def batch_request(self, calls, batch_size=DEFAULT_BATCH_SIZE):
+        # sends [(method, params), ...] as json-rpc batches (one http request per batch_size calls) and returns the
+        # raw responses in the same order.  each batch goes to the best endpoint and fails over like make_request,
+        # errors for individual calls are left in their response for the caller to handle.  cached calls are not sent
+        responses = [None] * len(calls)
+        if self.cache:
+            for i, (method, params) in enumerate(calls):
+                cached = self.cache.get(self.chain, method, params)
+                if cached is not None:
+                    responses[i] = {"jsonrpc": "2.0", "id": i, "result": cached}
+            hits = sum(r is not None for r in responses)
+            cycle_metrics.count_cache_hit("chain_cache", hits)
+            cycle_metrics.count_cache_miss("chain_cache", len(calls) - hits)
+
+        misses = [i for i, r in enumerate(responses) if r is None]
+        for start in range(0, len(misses), batch_size):
+            payload = [{"jsonrpc": "2.0", "id": i, "method": calls[i][0], "params": calls[i][1]}
+                       for i in misses[start:start + batch_size]]
+
+            last_error = None
+            for i, endpoint in enumerate(self._ranked_endpoints()):
+                if i:
+                    cycle_metrics.count_retry(endpoint.name)
+                try:
+                    batch = self._call_batch(endpoint, payload)
+                    break
+                except Exception as e:
+                    last_error = e
+            else:
+                raise last_error
+
+            # providers are free to answer a batch in any order
+            by_id = {r.get("id"): r for r in batch}
+            for p in payload:
+                responses[p["id"]] = by_id.get(p["id"], {"error": {"message": "missing from batch response"}})
+                self._observe(p["method"], p["params"], responses[p["id"]])
+
+        return responses
+
+    def _observe(self, method, params, response):
+        # keeps track of the chain head and stores answers that are final
+        result = response.get("result") if isinstance(response, dict) else None
+        head = chain_cache.head_block(method, params, result)
+        if head is not None and (self.head is None or head > self.head):
+            self.head = head
+
+        if self.cache and result is not None and "error" not in response:
+            self.cache.put(self.chain, method, params, result, self.head)
+
+    def _call_batch(self, endpoint, payload):
+        cycle_metrics.count_request(endpoint.name)
+        try:
+            batch = http_session.session().post(endpoint.uri, json=payload, timeout=endpoint.timeout)
+            batch.raise_for_status()
+            batch = batch.json()
+            if not isinstance(batch, list):
+                # some providers answer a batch they do not support with a single error object
+                raise Exception(f"batch not supported: {batch}")
+        except Exception:
+            cycle_metrics.count_error(endpoint.name)
+            self._record_failure(endpoint)
+            raise
+
+        # a batch takes longer than a single call, it says nothing about the endpoint's latency
+        self._record_success(endpoint, None)
+        return batch
+
+    def _ranked_endpoints(self):
+        now = time.monotonic()
+        with self._lock:
+            healthy = sorted([e for e in self.endpoints if e.is_available(now)], key=lambda e: e.score())
+
+            # every circuit is open, rather than failing outright try the endpoints closest to recovering
+            tripped = sorted([e for e in self.endpoints if not e.is_available(now)], key=lambda e: e.open_until)
+
+        return healthy + tripped
+
+    def _hedged_request(self, candidates, method, params):
+        pending = {self._executor.submit(self._call, candidates[0], method, params): candidates[0]}
+        remaining = candidates[1:]
+
+        done, _ = wait(pending, timeout=self.hedge_after)
+        if not done and remaining:
+            hedge = remaining.pop(0)
+            cycle_metrics.count_retry(hedge.name)
+            pending[self._executor.submit(self._call, hedge, method, params)] = hedge
+
+        last_error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                try:
+                    # any slower call still in flight finishes in the background and only updates the stats
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+
+            # a failed call is replaced straight away so there are always two requests racing
+            if remaining and len(pending) < 2:
+                failover = remaining.pop(0)
+                cycle_metrics.count_retry(failover.name)
+                pending[self._executor.submit(self._call, failover, method, params)] = failover
+
+        raise last_error
+
+    def _call(self, endpoint, method, params):
+        cycle_metrics.count_request(endpoint.name)
+        start = time.monotonic()
+        try:
+            response = endpoint.provider.make_request(method, params)
+        except Exception:
+            cycle_metrics.count_error(endpoint.name)
+            self._record_failure(endpoint)
+            raise
+
+        self._record_success(endpoint, time.monotonic() - start)
+        return response
+
+    def _record_success(self, endpoint, elapsed):
+        with self._lock:
+            if elapsed is not None:
+                endpoint.latency = elapsed if endpoint.latency is None else \
+                    LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * endpoint.latency
+            endpoint.error_rate *= (1 - ERROR_ALPHA)
+            endpoint.consecutive_failures = 0
+            endpoint.open_until = 0.0
+
+    def _record_failure(self, endpoint):
+        with self._lock:
+            endpoint.error_rate = ERROR_ALPHA + (1 - ERROR_ALPHA) * endpoint.error_rate
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                # half open after the cooldown, the next call decides whether it stays in rotation
+                endpoint.open_until = time.monotonic() + self.cooldown
+
+    def stats(self):
+        with self._lock:
+            return [{
+                "endpoint": e.name,
+                "latency": e.latency,
+                "error_rate": round(e.error_rate, 4),
+                "circuit_open": not e.is_available(time.monotonic()),
+            } for e in self.endpoints]
+
+
+def resolve_endpoints(providers):
+    # entries are either urls or the name of an environment variable (so api keys stay in .env).  an environment
+    # variable can hold a comma separated list of urls
+    uris = []
+    for provider in providers:
+        value = provider if "://" in provider else os.getenv(provider, "")
+        uris += [u.strip() for u in value.split(",") if u.strip()]
+
+    # keep the configured order but drop duplicates
+    return list(dict.fromkeys(uris))
+
+
+_pools = {}
+
+
+def get_web3(chain, config):
+    # pools are built once per process so that the latency and health stats carry over between shuttle cycles
+    if chain not in _pools:
+        rpc_config = config["rpc"][chain]
+        pool = ProviderPool(chain,
+                            resolve_endpoints(rpc_config["providers"]),
+                            timeout=rpc_config.get("timeout"),
+                            hedge_after=rpc_config.get("hedge_after", DEFAULT_HEDGE_AFTER),
+                            failure_threshold=rpc_config.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD),
+                            cooldown=rpc_config.get("cooldown", DEFAULT_COOLDOWN),
+                            cache=chain_cache.get_cache(config))
+        _pools[chain] = Web3(pool)
+
+    return _pools[chain]
@@ -1,40 +1,78 @@
 import json
-import logging
 import os
 import sqlite3
 import time
 from datetime import datetime, timedelta
 from decimal import Decimal
 
-from logging.handlers import RotatingFileHandler
-from urllib import request
 
 import praw
 from dotenv import load_dotenv
 from web3 import Web3
 
+from engine import batch_simulation, lottery_draw, notification_digest, shuttle_archive, shuttle_db, \
+    transfer_sources
+from engine.confirmation_watcher import ConfirmationWatcher
+from engine.scheduler import AdaptiveInterval, Scheduler
+from instrumentation import cycle_metrics, shuttle_latency, structured_log
+from instrumentation.cycle_profiler import CycleProfiler
+from rpc import http_session, json_stream, provider_pool
+
 MAX_SHUTTLES_ALLOWED_PER_USER = 1
 MAX_HOURS_FOR_OLDEST_TX = 12
 MIN_SHUTTLE_AMOUNT = 10
 SHUTTLES_NEEDED_FOR_TX = 10
 SHUTTLE_STARTING_BLOCK = 33043953
+REQUIRED_CONFIRMATIONS = 100
+DISPATCH_MAX_IDLE_SECONDS = 1800
 # SHUTTLE_STARTING_BLOCK = 33072948
 
+USERS_URL = "https://ethtrader.github.io/donut.distribution/users.json"
 
-def do_shuttle():
-    with sqlite3.connect(config["db_location"]) as db:
+# user <-> address lookups, refreshed on their own schedule (see refresh_users)
+users_by_address = {}
+users_etag = None
+
+# state carried between stage runs
+dispatch_queue_signature = None
+dispatch_evaluated_at = None
+templates = None
+
+
+def refresh_users():
+    global users_by_address, users_etag
+
+    # get users file that will be used for any user <-> address lookups
+    # this file performs all ENS lookups and is updated 3 times per day, so a conditional request is used and the
+    # file is only downloaded and parsed when it has actually changed.  it is streamed and only address / username
+    # are kept from each entry
+    logger.info("grabbing users.json file...", extra={"stage": "users"})
+    with cycle_metrics.stage("fetch_users"):
+        response, chunks = http_session.get_stream(USERS_URL, "github",
+                                                   headers={"If-None-Match": users_etag} if users_etag else {})
+
+        if response.status_code == 304:
+            response.close()
+            logger.info("  unchanged.", extra={"stage": "users"})
+            return False
+
+        users_by_address = {address.lower(): username for address, username in
+                            json_stream.pick(json_stream.iter_array(chunks), ("address", "username"))}
+        users_etag = response.headers.get("ETag")
+
+    logger.info("  %d users loaded.", len(users_by_address), extra={"stage": "users"})
+    return True
+
+
+def ingest(source):
+    with shuttle_db.connect(config) as db:
         db.row_factory = lambda c, r: dict(zip([col[0] for col in c.description], r))
         cur = db.cursor()
-        cur.execute("select gno_tx_hash from shuttle;")
+        cur.execute("select gno_tx_hash from shuttle_all;")
         saved_db_transactions = cur.fetchall()
 
     saved_db_transactions = [x['gno_tx_hash'] for x in saved_db_transactions]
 
-    # get users file that will be used for any user <-> address lookups
-    # this file performs all ENS lookups and is updated 3 times per day
-    logger.info("grabbing users.json file...")
-    users = json.load(request.urlopen(f"https://ethtrader.github.io/donut.distribution/users.json"))
-
     # donut on gnosis
     valid_tokens = [config["contracts"]["gnosis"]["donut"].lower()]
 
@@ -42,111 +80,115 @@ def do_shuttle():
     ignored_addresses = ["0xf7927bf0230c7b0e82376ac944aeedc3ea8dfa25"]
 
     # get gnosis transactions
-    logger.info(f"querying gnosisscan with starting block: {SHUTTLE_STARTING_BLOCK}...")
-    gnosis_url = f"https://api.gnosisscan.io/api?module=account&action=tokentx&address={config['multisig']['gnosis']}&startblock={SHUTTLE_STARTING_BLOCK}&endblock=99999999&page=1&offset=10000&sort=asc&apikey={os.getenv('GNOSIS_SCAN_IO_API_KEY')}"
-    json_result = json.load(request.urlopen(gnosis_url))
-
-
-
-    if not json_result["result"]:
-        logger.info("no results ... complete")
-        # return
-
-    # connect to ankr api
-    logger.info("connecting to ANKR api...")
-    w3_gno = Web3(Web3.HTTPProvider(os.getenv('ANKR_API_PROVIDER')))
+    logger.info("querying %s with starting block: %d...", source.name, SHUTTLE_STARTING_BLOCK,
+                extra={"stage": "ingest"})
+    try:
+        with cycle_metrics.stage("fetch_transfers"):
+            transfers = source.get_transfers(config['multisig']['gnosis'], SHUTTLE_STARTING_BLOCK)
+    except Exception as e:
+        # carry on so that shuttles already in the db are still dispatched and notified
+        logger.error("  unable to get transfers from %s: %s", source.name, e, extra={"stage": "ingest"})
+        transfers = []
+
+    if not transfers:
+        logger.info("no results ...", extra={"stage": "ingest"})
+
+    # connect to the gnosis rpc pool
+    logger.info("connecting to gnosis rpc providers...", extra={"stage": "ingest"})
+    w3_gno = provider_pool.get_web3("gnosis", config)
     if w3_gno.is_connected():
-        logger.info("  success.")
+        logger.info("  success.", extra={"stage": "ingest"})
     else:
-        logger.error(f"  failed to connect to ANKR: aborting....")
-        return
-
-    # with open('abi/erc20.json') as abi_file:
-    #     donut_abi = json.load(abi_file)
-    #
-    # donut_address = w3_gno.to_checksum_address(config["contracts"]["gnosis"]["donut"])
-    # donut_contract = w3_gno.eth.contract(address=donut_address, abi=donut_abi)
-
-    # tranfers = donut_contract.events.transfer().get_logs(fromBlock=SHUTTLE_STARTING_BLOCK)
-    # for transfer in tranfers:
-    #     receipt = w3_gno.eth.get_transaction_receipt(transfer.transactionHash)
-    #
-    #     if not receipt['status']:
-    #         continue
-
+        logger.error("  failed to connect to any gnosis rpc provider: aborting....", extra={"stage": "ingest"})
+        return 0
 
     dt_process_runtime = datetime.now()
-
-    # iterate the gnosis transactions
-    if json_result["result"]:
-        for tx in json_result["result"]:
-            tx_hash = tx["hash"]
-            logger.debug(f"[tx_hash]: {tx_hash}")
-
-            if tx_hash in saved_db_transactions:
-                continue
-
-            if tx["contractAddress"].lower() not in valid_tokens:
-                continue
-
-            if tx["from"].lower() in ignored_addresses:
-                continue
-
-            if tx["to"].lower() != config['multisig']['gnosis'].lower():
-                continue
-
-            w3_transaction = w3_gno.eth.get_transaction(tx_hash)
-            inpt = w3_transaction.input.hex()
-
-            # not a transfer event
-            if not inpt[:10] == "0xa9059cbb":
-                logger.debug(f"  not a transfer transaction [tx_hash]: {tx_hash}")
-                continue
-
-            logger.info(f"processing [tx_hash]: {tx_hash}")
-
-            # ensure at least 100 confirmations
-            if not int(tx['confirmations']) >= 100:
-                logger.info(f"  transaction does not have 100 confirmations yet ...")
-                continue
-
-            # confirm the status of the tx hash = 1 (success)
-            logger.info(f"  confirming status...")
-            tx_receipt_url = f"https://api.gnosisscan.io/api?module=transaction&action=gettxreceiptstatus&txhash={tx_hash}&apikey={os.getenv('GNOSIS_SCAN_IO_API_KEY')}"
-            tx_receipt = json.load(request.urlopen(tx_receipt_url))
-            if not (tx_receipt["result"]["status"]):
-                logger.warning(f"    [tx_hash]: {tx_hash} indicates a failed status, skipping ...")
-                continue
-            else:
-                logger.info("    success.")
-
-            from_address = tx["from"]
-            to_address = tx["to"]
-            blockchain_amount = tx["value"]
-            amount = w3_gno.from_wei(int(tx["value"]), "ether")
-            block = tx["blockNumber"]
-            timestamp = datetime.fromtimestamp(int(tx["timeStamp"]))
-
-            logger.info("  save tx to db if not already present...")
-
-            sql_insert = """
-                    INSERT INTO shuttle (from_address, blockchain_amount, readable_amount, block_number,
-                        gno_tx_hash, gno_timestamp, created_at)
-                    SELECT ?, ?, ?, ?, ?, ?, ?
-                    WHERE NOT EXISTS (select 1 from shuttle where gno_tx_hash = ?);
-                """
-
-            with sqlite3.connect(config["db_location"]) as db:
-                cur = db.cursor()
-                cur.execute(sql_insert, [from_address, blockchain_amount, amount, block,
-                                         tx_hash, timestamp, dt_process_runtime, tx_hash])
-
+    found = 0
+
+    # iterate the gnosis transactions.  one connection for the whole pass, each deposit is committed as it is saved
+    # so the confirmation watcher is never locked out while the rpc lookups run
+    if transfers:
+        with shuttle_db.connect(config) as db:
+            for tx in transfers:
+                tx_hash = tx["hash"]
+                # per transfer lines are logged with %-style args, they are only formatted (on the logging thread) when
+                # the level is enabled
+                log_fields = {"stage": "ingest", "tx_hash": tx_hash}
+                logger.debug("[tx_hash]: %s", tx_hash, extra=log_fields)
+
+                # includes deposits waiting on confirmations, those are followed by the confirmation watcher
+                if tx_hash in saved_db_transactions:
+                    continue
+
+                if tx["contractAddress"].lower() not in valid_tokens:
+                    continue
+
+                if tx["from"].lower() in ignored_addresses:
+                    continue
+
+                if tx["to"].lower() != config['multisig']['gnosis'].lower():
+                    continue
+
+                with cycle_metrics.stage("tx_lookups"):
+                    w3_transaction = w3_gno.eth.get_transaction(tx_hash)
+                inpt = w3_transaction.input.hex()
+
+                # not a transfer event
+                if not inpt[:10] == "0xa9059cbb":
+                    logger.debug("  not a transfer transaction [tx_hash]: %s", tx_hash, extra=log_fields)
+                    continue
+
+                logger.info("processing [tx_hash]: %s", tx_hash, extra=log_fields)
+
+                # ensure at least 100 confirmations
+                if not int(tx['confirmations']) >= REQUIRED_CONFIRMATIONS:
+                    logger.info("  transaction does not have %d confirmations yet, handing over to the confirmation "
+                                "watcher ...", REQUIRED_CONFIRMATIONS, extra=log_fields)
+                    with cycle_metrics.stage("db_update"):
+                        found += shuttle_db.insert_deposit(db, tx["from"], tx["value"],
+                                                           w3_gno.from_wei(int(tx["value"]), "ether"),
+                                                           int(tx["blockNumber"]), tx_hash,
+                                                           datetime.fromtimestamp(int(tx["timeStamp"])),
+                                                           dt_process_runtime, status=shuttle_db.DETECTED,
+                                                           block_hash=w3_transaction.blockHash.hex())
+                        db.commit()
+                    continue
+
+                # confirm the status of the tx hash = 1 (success)
+                logger.info("  confirming status...", extra=log_fields)
+                with cycle_metrics.stage("receipt_checks"):
+                    tx_receipt_status = source.get_receipt_status(tx_hash)
+                if not tx_receipt_status:
+                    logger.warning("    [tx_hash]: %s indicates a failed status, skipping ...", tx_hash,
+                                   extra=log_fields)
+                    continue
+                else:
+                    logger.info("    success.", extra=log_fields)
+
+                from_address = tx["from"]
+                to_address = tx["to"]
+                blockchain_amount = tx["value"]
+                amount = w3_gno.from_wei(int(tx["value"]), "ether")
+                block = tx["blockNumber"]
+                timestamp = datetime.fromtimestamp(int(tx["timeStamp"]))
+
+                logger.info("  save tx to db if not already present...", extra=log_fields)
+
+                with cycle_metrics.stage("db_update"):
+                    found += shuttle_db.insert_deposit(db, from_address, blockchain_amount, amount, block, tx_hash,
+                                                       timestamp, dt_process_runtime)
+                    db.commit()
+
+    return found
+
+
+def match_users():
     # attempt to name match any shuttles where we do not have user information
     # (including new records just inserted)
-    logger.info("attempt to match any addresses without usernames...")
+    logger.info("attempt to match any addresses without usernames...", extra={"stage": "match_users"})
 
     unmatched_sql = '''
-            select * from shuttle where processed_at is null and from_user is null;
+            select distinct from_address from shuttle where from_user is null;
             '''
     with sqlite3.connect(config["db_location"]) as db:
         db.row_factory = lambda c, r: dict(zip([col[0] for col in c.description], r))
@@ -154,83 +196,198 @@ def do_shuttle():
         cur.execute(unmatched_sql)
         unmatched = cur.fetchall()
 
-    for record in unmatched:
-        username = [u['username'] for u in users if u['address'].lower() == record['from_address'].lower()]
+    with cycle_metrics.stage("user_matching"):
+        matches = [[users_by_address[r['from_address'].lower()], r['from_address']] for r in unmatched
+                   if r['from_address'].lower() in users_by_address]
 
-        # if we have a match, update the database.  This would be more efficient as a bulk call
-        # however, this should not be an issue as I expect low volume
-        if username:
+        if matches:
             match_sql = '''
-                        update shuttle set from_user = ? where from_address = ?;
+                        update shuttle set from_user = ? where from_address = ? and from_user is null;
                     '''
             with sqlite3.connect(config["db_location"]) as db:
                 cur = db.cursor()
-                cur.execute(match_sql, [username[0], record['from_address']])
+                cur.executemany(match_sql, matches)
+
+    return len(matches)
 
-    logger.info("notify users about gnosis transaction being discovered...")
+
+def notify_discovered():
+    # every confirmed deposit, whether it was saved by ingest or promoted by the confirmation watcher.  the deposit
+    # moves on to the dispatch queue or the lottery, with a notification for its user (if matched) queued in the same
+    # transaction (see send_digests)
+    logger.info("notify users about gnosis transaction being discovered...", extra={"stage": "notifications"})
     gno_notify_sql = '''
-                select * from shuttle where created_at = ?;
+                select * from shuttle where status = ? order by created_at;
                 '''
 
-    with sqlite3.connect(config["db_location"]) as db:
+    with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
         db.row_factory = lambda c, r: dict(zip([col[0] for col in c.description], r))
         cur = db.cursor()
-        cur.execute(gno_notify_sql, [dt_process_runtime])
+        cur.execute(gno_notify_sql, [shuttle_db.CONFIRMED])
         gno_notifications = cur.fetchall()
 
-    for gno_notification in gno_notifications:
-        if Decimal(gno_notification['readable_amount']) < Decimal(MIN_SHUTTLE_AMOUNT):
-            message = config["lottery_message"]
-            subject = 'Arb1 Shuttle - Lottery Entry!'
-        else:
-            message = config["gno_confirmation_message"]
-            subject = 'Arb1 Shuttle - Gnosis deposit found!'
+        for gno_notification in gno_notifications:
+            if shuttle_db.blob_to_wei(gno_notification['amount_wei']) < shuttle_db.to_wei(MIN_SHUTTLE_AMOUNT):
+                kind, next_status = notification_digest.LOTTERY, shuttle_db.LOTTERY
+            else:
+                kind, next_status = notification_digest.DISCOVERED, shuttle_db.QUEUED
+
+            if gno_notification['from_user']:
+                notification_digest.enqueue(db, gno_notification['from_user'], kind, {
+                    "GNO_TX_HASH": gno_notification['gno_tx_hash'],
+                    "AMOUNT": gno_notification['readable_amount'],
+                    "SHUTTLE_MIN": MIN_SHUTTLE_AMOUNT,
+                    "TOKEN": "DONUT",
+                })
+
+            shuttle_db.set_status(db, [gno_notification['gno_tx_hash']], next_status)
+
+    return len(gno_notifications)
+
+
+def reconcile_submitted(w3_arb):
+    # distribute transactions that were sent but whose receipt was never recorded (ie. the shuttle was restarted
+    # while waiting on it).  their shuttles (and lottery payout) are not queued again until the outcome is known
+    with sqlite3.connect(config["db_location"]) as db:
+        cur = db.cursor()
+        cur.execute("select arb_tx_hash, gno_tx_hash from shuttle where status = ?;", [shuttle_db.SUBMITTED])
+        submitted = {}
+        for arb_tx_hash, gno_tx_hash in cur.fetchall():
+            submitted.setdefault(arb_tx_hash, []).append(gno_tx_hash)
+
+        cur.execute("select arb_tx_hash, id from lottery_draw where status = ?;", [shuttle_db.SUBMITTED])
+        submitted_draws = dict(cur.fetchall())
 
-        # create message
-        message = (message
-                   .replace("#NAME#", gno_notification['from_user'])
-                   .replace("#GNO_TX_HASH#", gno_notification['gno_tx_hash'])
-                   .replace("#AMOUNT#", str(gno_notification['readable_amount']))
-                   .replace("#TOKEN#", "DONUT"))
+    for arb_tx_hash in submitted_draws:
+        submitted.setdefault(arb_tx_hash, [])
 
-        # send message
+    for arb_tx_hash, gno_tx_hashes in submitted.items():
+        draw_id = submitted_draws.get(arb_tx_hash)
+        log_fields = {"stage": "dispatch", "arb_tx_hash": arb_tx_hash}
         try:
-            reddit.redditor(gno_notification['from_user']).message(subject=subject, message=message)
-        except Exception as e:
-            logger.error(f"  could not send notification to [{gno_notification['from_user']}]")
+            receipt = w3_arb.eth.get_transaction_receipt(arb_tx_hash)
+        except Exception:
+            logger.warning("  no receipt yet for [arb_tx_hash]: %s", arb_tx_hash, extra=log_fields)
+            continue
+
+        with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
+            if receipt.status:
+                logger.info("  [arb_tx_hash]: %s succeeded", arb_tx_hash, extra=log_fields)
+                status, columns = shuttle_db.DISTRIBUTED, {"processed_at": datetime.now()}
+            else:
+                logger.error("  [arb_tx_hash]: %s failed, re-queueing its shuttles", arb_tx_hash, extra=log_fields)
+                status, columns = shuttle_db.QUEUED, {"submitted_at": None, "arb_tx_hash": None}
+
+            shuttle_db.set_status(db, gno_tx_hashes, status, **columns)
+            if draw_id:
+                lottery_draw.set_status(db, draw_id, status, **columns)
 
-    logger.info("begin processing shuttles...")
-    logger.info("connect to INUFRA...")
+
+def dispatch(force=False):
+    global dispatch_queue_signature, dispatch_evaluated_at
+
+    # the batch is only re-evaluated when the queue of waiting shuttles has changed, once when the oldest shuttle
+    # passes MAX_HOURS_FOR_OLDEST_TX or every DISPATCH_MAX_IDLE_SECONDS (ie. in case the shuttle wallet was
+    # topped up, or a batch past its deadline could not be sent).  everything else would produce the same decision
+    # and only cost rpc calls
+    with sqlite3.connect(config["db_location"]) as db:
+        cur = db.cursor()
+        cur.execute("select (select count(*) from shuttle where status = ?) + "
+                    "(select count(*) from lottery_draw where status = ?);",
+                    [shuttle_db.SUBMITTED, shuttle_db.SUBMITTED])
+        in_flight = cur.fetchone()[0]
+
+        cur.execute('''
+                select count(*), max(id), min(gno_timestamp)
+                from shuttle
+                where status = ?;
+            ''', [shuttle_db.QUEUED])
+        count, max_id, oldest = cur.fetchone()
+
+        # a drawn lottery payout is waiting to go out like a shuttle, from the time it was drawn
+        cur.execute("select id, drawn_at from lottery_draw where status = ?;", [shuttle_db.QUEUED])
+        queued_draw = cur.fetchone()
+
+    if queued_draw:
+        count += 1
+        max_id = (max_id, queued_draw[0])
+        oldest = min(oldest or queued_draw[1], queued_draw[1], key=datetime.fromisoformat)
+
+    if in_flight:
+        logger.info("checking %d submitted shuttles...", in_flight, extra={"stage": "dispatch"})
+        reconcile_submitted(provider_pool.get_web3("arb1", config))
+
+    if not count:
+        dispatch_queue_signature = (0, None)
+        return None
+
+    now = datetime.now()
+    deadline = datetime.fromisoformat(oldest) + timedelta(hours=MAX_HOURS_FOR_OLDEST_TX)
+    deadline_passed = deadline <= now and (dispatch_evaluated_at is None or dispatch_evaluated_at < deadline)
+    idle_expired = dispatch_evaluated_at is None or \
+        (now - dispatch_evaluated_at).total_seconds() >= DISPATCH_MAX_IDLE_SECONDS
+
+    if not force and (count, max_id) == dispatch_queue_signature and not deadline_passed and not idle_expired:
+        return None
+
+    dispatch_queue_signature = (count, max_id)
+    dispatch_evaluated_at = now
+
+    log_fields = {"stage": "dispatch"}
+    logger.info("begin processing shuttles...", extra=log_fields)
+    logger.info("connect to arb1 rpc providers...", extra=log_fields)
 
     # switch w3 provider over to Arb1
-    w3_arb = Web3(Web3.HTTPProvider(os.getenv('INFURA_IO_API')))
+    w3_arb = provider_pool.get_web3("arb1", config)
 
     if not w3_arb.is_connected():
-        logger.error("failed to connect to INFURA")
+        logger.error("failed to connect to any arb1 rpc provider", extra=log_fields)
         return
     else:
-        logger.info("  success.")
+        logger.info("  success.", extra=log_fields)
 
     # get shuttle records from db
-    logger.info("get shuttles from db...")
-
-    # select the first shuttle transaction per user
-    shuttle_sql = '''
-            select * 
-            from
-              (select *, row_number() over (partition by from_address order by created_at asc) rank
-              from shuttle
-              where readable_amount >= ? and processed_at is null)
-            where rank = 1 and from_address not in (select from_address from shuttle where processed_at is not null);
+    logger.info("get shuttles from db...", extra=log_fields)
+
+    # queued shuttles of at least the minimum amount, with the number of payouts the same address already got
+    # (including archived shuttles).  a payout is one distribute entry, the deposits coalesced into it share its
+    # arb_tx_hash
+    shuttle_sql = f'''
+            select s.*,
+                   (select count(distinct coalesce(p.arb_tx_hash, p.gno_tx_hash)) from shuttle_all p
+                    where p.from_address = s.from_address
+                      and p.status in ('{"', '".join(shuttle_db.SHUTTLED)}')) as payout_count
+            from main.shuttle s
+            where s.status = ?
+              and s.amount_wei >= ?
+            order by s.created_at;
             '''
 
-    with sqlite3.connect(config["db_location"]) as db:
+    # max_shuttles_per_user caps the payouts an address gets over its lifetime (null for no cap).  without
+    # coalescing a payout is a single deposit, with it up to max_deposits_per_entry deposits (null for all of them)
+    # are summed into one distribute entry
+    dispatch_config = config.get("dispatch", {})
+    coalesce = dispatch_config.get("coalesce", False)
+    max_per_user = dispatch_config.get("max_shuttles_per_user", MAX_SHUTTLES_ALLOWED_PER_USER)
+    max_per_entry = dispatch_config.get("max_deposits_per_entry") if coalesce else 1
+
+    with shuttle_db.connect(config) as db:
         db.row_factory = lambda c, r: dict(zip([col[0] for col in c.description], r))
         cur = db.cursor()
-        cur.execute(shuttle_sql, [MIN_SHUTTLE_AMOUNT])
-        shuttles = cur.fetchall()
+        cur.execute(shuttle_sql, [shuttle_db.QUEUED, shuttle_db.wei_to_blob(shuttle_db.to_wei(MIN_SHUTTLE_AMOUNT))])
+
+        # oldest first, as many per address as fit in one entry, for addresses still under their lifetime cap
+        per_address = {}
+        for shuttle in cur.fetchall():
+            deposits = per_address.setdefault(shuttle['from_address'].lower(), [])
+            if max_per_user is not None and shuttle['payout_count'] >= max_per_user:
+                continue
+            if max_per_entry is None or len(deposits) < max_per_entry:
+                deposits.append(shuttle)
 
-    logger.info(f"  {len(shuttles)} shuttles found...")
+    shuttles = [deposits for deposits in per_address.values() if deposits]
+    logger.info("  %d shuttles found for %d addresses...", sum(len(d) for d in shuttles), len(shuttles),
+                extra=log_fields)
 
     with open(os.path.normpath("abi/distribute.json"), 'r') as f:
         distribute_abi = json.load(f)
@@ -249,61 +406,140 @@ def do_shuttle():
     distribute_tx_list = []
     current_batch_amt = 0
 
-    for shuttle in shuttles:
-        logger.info(f"processing address [addr={shuttle['from_address']}]")
+    for deposits in shuttles:
+        logger.info("processing address [addr=%s] [shuttles=%d]", deposits[0]['from_address'], len(deposits),
+                    extra=log_fields)
 
-        if int(shuttle["readable_amount"] < MIN_SHUTTLE_AMOUNT):
-            logger.info(
-                f" shuttle amount too small: "
-                f"shuttle amount [{shuttle['readable_amount']}] - minimum required [{MIN_SHUTTLE_AMOUNT}]")
-            continue
+        amount_wei = sum(shuttle_db.blob_to_wei(d["amount_wei"]) for d in deposits)
 
-        if donut_balance < int(shuttle["blockchain_amount"]):
-            logger.info(" shuttle does not have enough donuts for this tx.")
+        if donut_balance < amount_wei:
+            logger.info(" shuttle does not have enough donuts for this tx.", extra=log_fields)
             continue
 
-        donut_balance -= int(shuttle["blockchain_amount"])
-        current_batch_amt += int(shuttle["blockchain_amount"])
+        donut_balance -= amount_wei
+        current_batch_amt += amount_wei
 
+        # one entry per address, linked to every deposit it pays out
         distribute_tx_list.append({
-            "address": Web3.to_checksum_address(shuttle['from_address']),
-            "amt": int(shuttle["blockchain_amount"]),
-            "gno_tx_hash": shuttle["gno_tx_hash"],
-            "gno_timestamp": shuttle["gno_timestamp"]
+            "address": Web3.to_checksum_address(deposits[0]['from_address']),
+            "amt": amount_wei,
+            "gno_tx_hashes": [d["gno_tx_hash"] for d in deposits],
+            "gno_timestamp": min(d["gno_timestamp"] for d in deposits)
         })
 
-    logger.info(f"{len(distribute_tx_list)} of {len(shuttles)} shuttles can be processed at this time")
+    shuttle_count = sum(len(d["gno_tx_hashes"]) for d in distribute_tx_list)
+    logger.info("%d of %d addresses (%d shuttles) can be processed at this time", len(distribute_tx_list),
+                len(shuttles), shuttle_count, extra=log_fields)
 
-    if len(distribute_tx_list):
+    # a drawn lottery rides along with the batch instead of paying for a transaction of its own.  it waits for
+    # shuttles like a shuttle does, from the time it was drawn, and goes out by itself once that is more than
+    # MAX_HOURS_FOR_OLDEST_TX ago
+    with sqlite3.connect(config["db_location"]) as db:
+        lottery_payout = lottery_draw.open_draw(db)
+
+    if lottery_payout and lottery_payout["status"] != shuttle_db.QUEUED:
+        lottery_payout = None
+
+    if len(distribute_tx_list) or lottery_payout:
         do_blockchain_tx = False
 
-        logger.info("check to see if we should perform the blockchain transaction...")
-        if len(distribute_tx_list) >= SHUTTLES_NEEDED_FOR_TX:
-            logger.info("  enough shuttles in this transaction, proceed...")
+        logger.info("check to see if we should perform the blockchain transaction...", extra=log_fields)
+        if shuttle_count >= SHUTTLES_NEEDED_FOR_TX:
+            logger.info("  enough shuttles in this transaction, proceed...", extra=log_fields)
             do_blockchain_tx = True
         else:
-            min_date = datetime.fromisoformat(min([s['gno_timestamp'] for s in distribute_tx_list]))
+            waiting_since = [s['gno_timestamp'] for s in distribute_tx_list]
+            if lottery_payout:
+                waiting_since.append(lottery_payout['drawn_at'])
+
+            min_date = min(datetime.fromisoformat(d) for d in waiting_since)
             if datetime.now() - timedelta(hours=MAX_HOURS_FOR_OLDEST_TX) >= min_date:
-                logger.info(f"  oldest shuttle is more than {str(MAX_HOURS_FOR_OLDEST_TX)} hours, proceed...")
+                logger.info("  oldest shuttle is more than %d hours, proceed...", MAX_HOURS_FOR_OLDEST_TX,
+                            extra=log_fields)
                 do_blockchain_tx = True
 
         if not do_blockchain_tx:
-            logger.info("  criteria not met, will not perform the transaction...")
+            logger.info("  criteria not met, will not perform the transaction...", extra=log_fields)
         else:
-            logger.info("checking gas balance...")
+            logger.info("checking gas balance...", extra=log_fields)
             gas_balance = w3_arb.from_wei(w3_arb.eth.get_balance(shuttle_address), "ether")
 
             if gas_balance < 0.0005:
-                logger.error(f" shuttle is out of gas. balance: [{gas_balance}]")
+                logger.error(" shuttle is out of gas. balance: [%s]", gas_balance, extra=log_fields)
                 exit(4)
 
-            logger.info("building blockchain transaction...")
+            if lottery_payout:
+                lottery_amount_wei = shuttle_db.blob_to_wei(lottery_payout["amount_wei"])
+                if donut_balance >= lottery_amount_wei:
+                    logger.info("adding lottery payout [winner=%s]", lottery_payout['winner_user'], extra=log_fields)
+                    donut_balance -= lottery_amount_wei
+                    distribute_tx_list.append({
+                        "address": Web3.to_checksum_address(lottery_payout["winner_address"]),
+                        "amt": lottery_amount_wei,
+                        "lottery_draw_id": lottery_payout["id"],
+                    })
+                else:
+                    logger.info(" shuttle does not have enough donuts for the lottery payout.", extra=log_fields)
+                    lottery_payout = None
+
+            if not distribute_tx_list:
+                logger.info("  nothing to send", extra=log_fields)
+                return
+
+            def set_batch_status(status, **columns):
+                with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
+                    shuttle_db.set_status(db, gno_tx_hashes, status, **columns)
+                    if lottery_payout:
+                        lottery_draw.set_status(db, lottery_payout["id"], status, **columns)
+
+            # simulate the exact batch before signing.  entries that make it revert on their own are found by
+            # bisection and quarantined, the rest of the batch goes out in this cycle.  a batch that fails as a
+            # whole, or a simulation that fails on the rpc side, is tried again next cycle
+            logger.info("simulating blockchain transaction...", extra=log_fields)
+            try:
+                with cycle_metrics.stage("dispatch"):
+                    gas, reason = batch_simulation.estimate(distribute_contract, distribute_tx_list, donut_address,
+                                                            shuttle_address)
+
+                    if reason:
+                        logger.error("  batch reverts: %s", reason, extra=log_fields)
+                        offenders = batch_simulation.find_offenders(
+                            lambda entries: batch_simulation.estimate(distribute_contract, entries, donut_address,
+                                                                      shuttle_address)[1],
+                            distribute_tx_list, reason)
+
+                        if offenders:
+                            for entry, entry_reason in offenders:
+                                logger.error("  quarantining [addr=%s]: %s", entry['address'], entry_reason,
+                                             extra=log_fields)
+
+                            with sqlite3.connect(config["db_location"]) as db:
+                                batch_simulation.quarantine(db, offenders, datetime.now())
+
+                            quarantined = [entry for entry, _ in offenders]
+                            distribute_tx_list = [d for d in distribute_tx_list if d not in quarantined]
+                            if lottery_payout and not any(d.get("lottery_draw_id") for d in distribute_tx_list):
+                                lottery_payout = None
+
+                            gas, reason = batch_simulation.estimate(distribute_contract, distribute_tx_list,
+                                                                    donut_address, shuttle_address)
+            except ValueError as e:
+                logger.error("  could not simulate the batch, trying again next cycle: %s", e, extra=log_fields)
+                return
+
+            if reason:
+                # no single entry is to blame, the batch fails as a whole.  it is tried again next cycle
+                logger.error("  batch still reverts, not sending: %s", reason, extra=log_fields)
+                return
+
+            logger.info("building blockchain transaction...", extra=log_fields)
             transaction = distribute_contract.functions.distribute(
                 [d['address'] for d in distribute_tx_list],
                 [d['amt'] for d in distribute_tx_list],
                 donut_address
             ).build_transaction({
                 'from': shuttle_address,
+                'gas': gas,
                 'nonce': w3_arb.eth.get_transaction_count(shuttle_address)
             })
 
@@ -311,90 +547,180 @@ def do_shuttle():
             signed = w3_arb.eth.account.sign_transaction(transaction, os.getenv('SHUTTLE_PRIVATE_KEY'))
 
             # send the transaction
-            logger.info("sending blockchain transaction...")
-            tx_hash = w3_arb.eth.send_raw_transaction(signed.rawTransaction)
-            receipt = w3_arb.eth.wait_for_transaction_receipt(tx_hash)
+            logger.info("sending blockchain transaction...", extra=log_fields)
+            gno_tx_hashes = [h for d in distribute_tx_list for h in d.get("gno_tx_hashes", [])]
+            with cycle_metrics.stage("dispatch"):
+                tx_hash = w3_arb.eth.send_raw_transaction(signed.rawTransaction)
+            human_readable_tx_hash = w3_arb.to_hex(tx_hash)
+            log_fields = {**log_fields, "arb_tx_hash": human_readable_tx_hash}
+
+            # recorded before waiting on the receipt, so a restart can never send these shuttles a second time
+            try:
+                set_batch_status(shuttle_db.SUBMITTED, submitted_at=datetime.now(), arb_tx_hash=human_readable_tx_hash)
+            except Exception as e:
+                logger.critical("%s", e, extra=log_fields)
+                exit(4)
+
+            with cycle_metrics.stage("dispatch"):
+                receipt = w3_arb.eth.wait_for_transaction_receipt(tx_hash)
 
+            logger.info("update db...", extra=log_fields)
             if receipt.status:
-                human_readable_tx_hash = w3_arb.to_hex(tx_hash)
-                logger.info(f" success! tx_hash: [{human_readable_tx_hash}]")
+                logger.info(" success! tx_hash: [%s]", human_readable_tx_hash, extra=log_fields)
+                set_batch_status(shuttle_db.DISTRIBUTED, processed_at=datetime.now())
             else:
-                logger.error("  transaction failed!")
-                logger.error(f"  receipt {receipt}")
+                logger.error("  transaction failed!", extra=log_fields)
+                logger.error("  receipt %s", str(receipt), extra=log_fields)
+                set_batch_status(shuttle_db.QUEUED, submitted_at=None, arb_tx_hash=None)
                 return
 
-            logger.info("update db...")
-            try:
-                for distribute_tx in distribute_tx_list:
-                    update_sql = '''
-                            update shuttle set processed_at = ?, arb_tx_hash = ? where gno_tx_hash = ?;
-                        '''
-                    with sqlite3.connect(config["db_location"]) as db:
-                        cur = db.cursor()
-                        cur.execute(update_sql, [datetime.now(), human_readable_tx_hash, distribute_tx["gno_tx_hash"]])
-            except Exception as e:
-                logger.critical(e)
-                exit(4)
+            return True
+
 
-    # find transactions that need to be notified (if any)
-    logger.info("finding transactions that need notifications ...")
+def notify_completed():
+    # find transactions that need to be notified (if any).  they stay DISTRIBUTED until send_digests has told the
+    # user, the outbox keeps them from being queued twice
+    logger.info("finding transactions that need notifications ...", extra={"stage": "notifications"})
 
     notification_sql = '''
-                        select * 
-                        from shuttle 
-                        where processed_at is not null 
-                          and notified_at is null 
-                          and from_user is not null;
+                        select s.*
+                        from shuttle s
+                        where s.status = ?
+                          and s.from_user is not null
+                          and not exists (select 1 from notification_outbox o
+                                          where o.gno_tx_hash = s.gno_tx_hash and o.kind = ?);
                     '''
 
-    with sqlite3.connect(config["db_location"]) as db:
+    with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
         db.row_factory = lambda c, r: dict(zip([col[0] for col in c.description], r))
         cur = db.cursor()
-        cur.execute(notification_sql)
+        cur.execute(notification_sql, [shuttle_db.DISTRIBUTED, notification_digest.COMPLETED])
         notifications = cur.fetchall()
 
-    if not notifications:
-        logger.info("  none needed")
+        if not notifications:
+            logger.info("  none needed", extra={"stage": "notifications"})
+
+        for n in notifications:
+            logger.info("queueing notification ::: [user]: %s [amount]: %s", n['from_user'], n['readable_amount'],
+                        extra={"stage": "notifications", "gno_tx_hash": n['gno_tx_hash']})
+            notification_digest.enqueue(db, n['from_user'], notification_digest.COMPLETED, {
+                "ARB_TX_HASH": n['arb_tx_hash'],
+                "GNO_TX_HASH": n['gno_tx_hash'],
+                "AMOUNT": n['readable_amount'],
+                "SHUTTLE_MIN": MIN_SHUTTLE_AMOUNT,
+                "TOKEN": "DONUT",
+            }, gno_tx_hash=n['gno_tx_hash'])
 
-    for n in notifications:
-        logger.info(f"notifying ::: [user]: {n['from_user']} [amount]: {n['readable_amount']}")
+    notify_lottery_winner()
+    send_digests()
 
-        # create message
-        message = (config["shuttle_message"]
-                   .replace("#NAME#", n['from_user'])
-                   .replace("#ARB_TX_HASH#", n['arb_tx_hash'])
-                   .replace("#GNO_TX_HASH#", n['gno_tx_hash'])
-                   .replace("#AMOUNT#", str(n['readable_amount']))
-                   .replace("#SHUTTLE_MIN#", str(MIN_SHUTTLE_AMOUNT))
-                   .replace("#TOKEN#", "DONUT"))
+    logger.info("complete.", extra={"stage": "notifications"})
 
-        # send message
+
+def notify_lottery_winner():
+    # the lottery payout goes out with a regular batch, its winner is told once the batch has succeeded
+    with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
+        db.row_factory = shuttle_db.dict_factory
+        cur = db.cursor()
+        cur.execute("""
+            select * from lottery_draw d
+            where d.status = ?
+              and not exists (select 1 from notification_outbox o where o.lottery_draw_id = d.id);
+        """, [shuttle_db.DISTRIBUTED])
+
+        for d in cur.fetchall():
+            if not d['winner_user']:
+                # nobody to tell
+                lottery_draw.set_status(db, d['id'], shuttle_db.NOTIFIED, notified_at=datetime.now())
+            else:
+                lottery_amount = Web3.from_wei(shuttle_db.blob_to_wei(d['amount_wei']), "ether")
+                logger.info("queueing lottery winner notification ::: [user]: %s [amount]: %s", d['winner_user'],
+                            lottery_amount, extra={"stage": "notifications"})
+                notification_digest.enqueue(db, d['winner_user'], notification_digest.LOTTERY_WINNER, {
+                    "ARB_TX_HASH": d['arb_tx_hash'],
+                    "AMOUNT": lottery_amount,
+                    "TOKEN": "DONUT",
+                }, lottery_draw_id=d['id'])
+
+
+def send_digests():
+    # one reddit message per user instead of one per event: everything queued for a user within the digest window
+    # goes out together, so the api calls per cycle scale with users rather than deposits.  the shuttles a message
+    # completes are marked notified once it has been sent, a failed message is tried again next cycle
+    with sqlite3.connect(config["db_location"]) as db:
+        pending = notification_digest.due(db, templates.window_seconds)
+
+    for user, events in pending.items():
+        subject, message = templates.render(user, [(kind, fields) for _, kind, fields in events])
+        log_fields = {"stage": "notifications", "user": user}
+        logger.info("notifying ::: [user]: %s [events]: %d", user, len(events), extra=log_fields)
+
+        event_ids = [event_id for event_id, _, _ in events]
         try:
-            reddit.redditor(n['from_user']).message(subject="Arb1 Shuttle Successful!", message=message)
-            logger.info("  successfully notified on reddit...")
+            with cycle_metrics.stage("notifications"):
+                cycle_metrics.count_request("reddit")
+                reddit.redditor(user).message(subject=subject, message=message)
         except Exception as e:
-            logger.error(f"  could not send notification to [{n['from_user']}]")
+            cycle_metrics.count_error("reddit")
+            logger.error("  could not send notification to [%s]: %s", user, e, extra=log_fields)
 
-        logger.info("updating sql notified_at")
+            with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
+                if notification_digest.mark_failed(db, event_ids, templates.max_attempts):
+                    logger.error("  giving up on [%s] after %d attempts", user, templates.max_attempts,
+                                 extra=log_fields)
+        else:
+            logger.info("  successfully notified on reddit...", extra=log_fields)
 
-        notification_update_sql = '''
-                update shuttle 
-                set notified_at = ?
-                where gno_tx_hash = ?
-            '''
+            with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
+                notification_digest.mark_sent(db, event_ids)
 
-        with sqlite3.connect(config["db_location"]) as db:
-            cur = db.cursor()
-            cur.execute(notification_update_sql, [datetime.now(), n['gno_tx_hash']])
+        time.sleep(1)
 
-        logger.info("  successfully updated db... ")
 
-        time.sleep(1)
+def run_lottery():
+    # draws a winner once the interval has passed.  the payout is made by the next dispatch
+    lottery_config = config.get("lottery", {})
+    if not lottery_config.get("enabled", True):
+        return
 
-    logger.info("complete.")
+    with cycle_metrics.stage("db_update"), sqlite3.connect(config["db_location"]) as db:
+        if not lottery_draw.is_due(db, lottery_config.get("interval_days", lottery_draw.DEFAULT_INTERVAL_DAYS)):
+            return
 
+        logger.info("drawing the lottery...", extra={"stage": "lottery"})
+        winner = lottery_draw.draw(db, lottery_config.get("min_entries", lottery_draw.DEFAULT_MIN_ENTRIES))
+
+    if winner:
+        logger.info("  winner is: [%s] (%d entries), payout queued", winner['winner_user'], winner['entries'],
+                    extra={"stage": "lottery"})
+    else:
+        logger.info("  not enough entries, the pot carries over", extra={"stage": "lottery"})
+
+    return winner
+
+
+def archive():
+    logger.info("archiving completed shuttles...", extra={"stage": "archive"})
+    with cycle_metrics.stage("db_update"), shuttle_db.connect(config) as db:
+        archived = shuttle_archive.archive_completed(db, config.get("archive", {}).get(
+            "retain_days", shuttle_archive.DEFAULT_RETAIN_DAYS))
+    logger.info("  %d shuttles moved to the archive.", archived, extra={"stage": "archive"})
+
+
+def do_shuttle(source):
+    # a single pass over every stage, in order
+    refresh_users()
+    ingest(source)
+    match_users()
+    notify_discovered()
+    run_lottery()
+    dispatch(force=True)
+    notify_completed()
+
+
+def main(source_name=None, log_name="shuttle"):
+    global config, logger, reddit, templates
 
-if __name__ == '__main__':
     # load environment variables
     load_dotenv()
 
@@ -402,19 +728,12 @@ if __name__ == '__main__':
     with open(os.path.normpath("config.json"), 'r') as f:
         config = json.load(f)
 
-    # set up logging
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log_name = os.path.basename(__file__)[:-3]
-    logger = logging.getLogger(log_name)
-    logger.setLevel(logging.INFO)
+    http_session.configure(config)
 
+    # set up logging.  records go through a queue and are written by a background thread, as json lines
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    log_path = os.path.join(base_dir, f"logs/{log_name}.log")
-    file_handler = RotatingFileHandler(os.path.normpath(log_path), maxBytes=2500000, backupCount=100)
-    file_handler.setFormatter(formatter)
-    console_handler = logging.StreamHandler()
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    log_path = os.path.join(base_dir, f"logs/{log_name}.jsonl")
+    logger = structured_log.setup(log_name, os.path.normpath(log_path), backup_count=100)
 
     # set up praw
     reddit = praw.Reddit(client_id=os.getenv('REDDIT_CLIENT_ID'),
@@ -428,33 +747,111 @@ if __name__ == '__main__':
     sqlite3.register_converter("Decimal", lambda s: Decimal(s))
 
     with sqlite3.connect(config["db_location"]) as db:
-        sql_create = """        
-                CREATE TABLE IF NOT EXISTS
-                shuttle (
-                    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
-                    from_user NVARCHAR2 COLLATE NOCASE,
-                    from_address NVARCHAR2 NOT NULL COLLATE NOCASE,
-                    blockchain_amount text NOT NULL,
-                    readable_amount DECIMAL(8, 7) NOT NULL,
-                    block_number INTEGER NOT NULL,
-                    gno_tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
-                    arb_tx_hash NVARCHAR2 COLLATE NOCASE,
-                    gno_timestamp DATETIME NOT NULL,
-                    processed_at DATETIME,
-                    notified_at DATETIME,
-                    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
-                );
-            """
-        cur = db.cursor()
-        cur.executescript(sql_create)
-
-    logger.info("begin...")
-
-    while True:
+        shuttle_db.create_schema(db, MIN_SHUTTLE_AMOUNT, config.get("lottery", {}).get("backfill_cutoff"))
+        lottery_draw.create_schema(db)
+        batch_simulation.create_schema(db)
+        notification_digest.create_schema(db)
+
+    # message templates are compiled once
+    templates = notification_digest.Templates(config)
+
+    # where deposits are read from: gnosisscan, blockscout, rpc_logs or race (two sources at once)
+    source = transfer_sources.build_source(source_name or config["transfer_source"]["mode"], config, logger)
+
+    # each stage runs on its own cadence.  ingest polls often while deposits are arriving and backs off when idle,
+    # new deposits pull user matching and dispatch forward, and notifications are drained continuously
+    schedule_config = config.get("schedule", {})
+    ingest_interval = AdaptiveInterval(schedule_config.get("ingest_min", 30), schedule_config.get("ingest_max", 300))
+    scheduler = Scheduler(logger)
+
+    def run_users():
+        if refresh_users():
+            scheduler.trigger("match_users")
+
+    def run_ingest():
+        found = ingest(source)
+        if found:
+            scheduler.trigger("match_users", "notifications")
+        return ingest_interval.next(found > 0)
+
+    def run_match_users():
+        if match_users():
+            scheduler.trigger("notifications")
+
+    def run_notifications():
+        # confirmed deposits move on to the dispatch queue once the user has been told about them
+        if notify_discovered():
+            scheduler.trigger("dispatch")
+        notify_completed()
+
+    def run_dispatch():
+        if dispatch():
+            scheduler.trigger("notifications")
+
+    def run_lottery_stage():
+        if run_lottery():
+            scheduler.trigger("dispatch")
+
+    scheduler.add("users", run_users, schedule_config.get("users_refresh", 900))
+    scheduler.add("ingest", run_ingest, ingest_interval.min_interval)
+    scheduler.add("match_users", run_match_users, schedule_config.get("match_users", 900))
+    scheduler.add("notifications", run_notifications, schedule_config.get("notifications", 60))
+    scheduler.add("dispatch", run_dispatch, schedule_config.get("dispatch_check", 60))
+    scheduler.add("lottery", run_lottery_stage, schedule_config.get("lottery_check", 3600))
+    scheduler.add("archive", archive, schedule_config.get("archive", 86400))
+
+    # follows the gnosis head and promotes deposits as soon as they have enough confirmations
+    watcher = ConfirmationWatcher(provider_pool.get_web3("gnosis", config), config["db_location"],
+                                  REQUIRED_CONFIRMATIONS, logger,
+                                  on_promoted=lambda: scheduler.trigger("match_users", "notifications"),
+                                  **config.get("confirmation_watcher", {}))
+    watcher.start()
+
+    logger.info("begin [source=%s]...", source.name, extra={"stage": "cycle"})
+
+    metrics_config = config.get("metrics", {})
+
+    # `kill -USR1 <pid>` or `echo 5 > logs/profile.trigger` profiles the next scheduler run(s)
+    profiling_config = config.get("profiling", {})
+    profiler = CycleProfiler(log_name,
+                             os.path.join(base_dir, profiling_config.get("output_dir", "logs/profiles")),
+                             trigger_file=os.path.join(base_dir, profiling_config.get("trigger_file",
+                                                                                      "logs/profile.trigger")),
+                             cycles=profiling_config.get("cycles", 3),
+                             logger=logger)
+
+    def tick(tasks):
+        cycle_metrics.start_cycle()
+        outcome = "error"
         try:
-            do_shuttle()
+            logger.info("running [%s]...", ", ".join(t.name for t in tasks), extra={"stage": "cycle"})
+            if profiler.run(scheduler.run_tasks, tasks):
+                outcome = "success"
         except Exception as e:
-            logger.error(e)
+            logger.error("%s", e, extra={"stage": "cycle"})
         finally:
-            logger.info("sleep 240 ....")
-            time.sleep(240)
+            try:
+                with sqlite3.connect(config["db_location"]) as db:
+                    shuttle_latency.update_aggregates(db)
+                    shuttle_latency.publish_gauges(db)
+            except Exception as e:
+                logger.error("unable to update shuttle latencies: %s", e, extra={"stage": "cycle"})
+
+            try:
+                cycle_metrics.finish_cycle(outcome,
+                                           prometheus_path=metrics_config.get("prometheus_textfile"),
+                                           json_path=metrics_config.get("cycle_log"))
+            except Exception as e:
+                logger.error("unable to export cycle metrics: %s", e, extra={"stage": "cycle"})
+
+            metrics = cycle_metrics.current()
+            logger.info("cycle %s in %.3fs", outcome, metrics.duration,
+                        extra={"stage": "cycle", "tasks": [t.name for t in tasks], "outcome": outcome,
+                               "duration": round(metrics.duration, 6),
+                               "stages": {s: round(d, 6) for s, d in metrics.stages.items()}})
+
+    scheduler.run_forever(tick)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import json
+import os
+import sqlite3
+
+from instrumentation import shuttle_latency
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="shuttle latency percentiles per day")
+    parser.add_argument("--days", type=int, default=30, help="number of days to report on (default: 30)")
+    parser.add_argument("--metric", choices=list(shuttle_latency.LATENCIES.keys()), help="only report this latency")
+    parser.add_argument("--json", action="store_true", help="output json lines instead of a table")
+    args = parser.parse_args()
+
+    # load config
+    with open(os.path.normpath("config.json"), 'r') as f:
+        config = json.load(f)
+
+    with sqlite3.connect(config["db_location"]) as db:
+        shuttle_latency.create_schema(db)
+
+        # bring the aggregates up to date so the report includes anything the shuttle has not folded in yet
+        shuttle_latency.update_aggregates(db)
+        report = shuttle_latency.daily_report(db, shuttle_latency.default_since_day(args.days), args.metric)
+
+    if args.json:
+        for row in report:
+            print(json.dumps(row))
+        exit(0)
+
+    if not report:
+        print("no shuttle latencies recorded for this period")
+        exit(0)
+
+    def fmt(seconds):
+        if seconds is None:
+            return "-"
+        if seconds < 120:
+            return f"{seconds:.0f}s"
+        if seconds < 7200:
+            return f"{seconds / 60:.1f}m"
+        return f"{seconds / 3600:.1f}h"
+
+    print(f"{'day':<12}{'metric':<20}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for row in report:
+        print(f"{row['day']:<12}{row['metric']:<20}{row['count']:>7}"
+              f"{fmt(row['p50']):>9}{fmt(row['p95']):>9}{fmt(row['p99']):>9}")
@@ -1,92 +1,221 @@
+import argparse
 import json
 import os
-import sqlite3
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dotenv import load_dotenv
-from web3 import Web3
 
-TX_HASH = '0xedf1fc2e7eb9aafe5c6ada43ec91a143923d9a191a607cb7e27bb1e61d8d65d4'
-SHUTTLE_START_BLOCK = 33043953
+from engine import shuttle_db
 
-if __name__ == '__main__':
-    # load .env file
-    load_dotenv()
+SHUTTLE_START_BLOCK = 33043953
+REQUIRED_CONFIRMATIONS = 100
+TRANSFER_SELECTOR = "0xa9059cbb"
+LOG_CHUNK_SIZE = 10000
+
+# EthTraderCommunity
+IGNORED_ADDRESSES = ["0xf7927bf0230c7b0e82376ac944aeedc3ea8dfa25"]
+
+
+def read_hashes(args):
+    hashes = list(args.hash or [])
+
+    if args.hash_file:
+        with open(args.hash_file, 'r') as f:
+            hashes += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    return hashes
+
+
+def hashes_in_block_range(w3, config, from_block, to_block, workers):
+    # every DONUT transfer into the multisig in the range, read from the Transfer logs in chunks
+    from engine.transfer_sources import TRANSFER_TOPIC
+
+    token = w3.to_checksum_address(config["contracts"]["gnosis"]["donut"])
+    to_topic = "0x" + config["multisig"]["gnosis"].lower()[2:].rjust(64, "0")
+
+    def get_chunk(start):
+        return w3.eth.get_logs({
+            "fromBlock": start,
+            "toBlock": min(start + LOG_CHUNK_SIZE - 1, to_block),
+            "address": token,
+            "topics": [TRANSFER_TOPIC, None, to_topic],
+        })
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(get_chunk, range(from_block, to_block + 1, LOG_CHUNK_SIZE))
+        return [log["transactionHash"].hex() for logs in chunks for log in logs]
+
+
+def batch(pool, calls, workers, batch_size):
+    # splits the calls over several json-rpc batches that are sent at the same time
+    chunks = [calls[i:i + batch_size] for i in range(0, len(calls), batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda c: pool.batch_request(c, batch_size), chunks)
+        return [r for chunk in results for r in chunk]
+
+
+def validate(config, txs, receipts, blocks, head):
+    # returns (deposits, skipped) where skipped maps a reason to the tx hashes skipped for it
+    donut = config["contracts"]["gnosis"]["donut"].lower()
+    multisig = config["multisig"]["gnosis"].lower()
+
+    deposits = []
+    skipped = defaultdict(list)
+
+    for tx_hash, tx in txs.items():
+        receipt = receipts.get(tx_hash)
+
+        if tx is None:
+            skipped["transaction not found"].append(tx_hash)
+            continue
+
+        if tx.get("blockNumber") is None or receipt is None:
+            skipped["transaction not mined yet"].append(tx_hash)
+            continue
+
+        block_number = int(tx["blockNumber"], 16)
+        calldata = tx["input"]
+
+        if int(receipt["status"], 16) != 1:
+            skipped["transaction is in a failed status"].append(tx_hash)
+        elif block_number < SHUTTLE_START_BLOCK:
+            skipped["transaction submitted prior to shuttle starting"].append(tx_hash)
+        elif head - block_number < REQUIRED_CONFIRMATIONS:
+            skipped[f"fewer than {REQUIRED_CONFIRMATIONS} confirmations"].append(tx_hash)
+        elif (tx["to"] or "").lower() != donut:
+            skipped["not a DONUT transaction"].append(tx_hash)
+        elif calldata[:10] != TRANSFER_SELECTOR or len(calldata) < 138:
+            skipped["not a transfer transaction"].append(tx_hash)
+        elif "0x" + calldata[34:74].lower() != multisig:
+            skipped["transfer not sent to the multisig"].append(tx_hash)
+        elif tx["from"].lower() in IGNORED_ADDRESSES:
+            skipped["sender is ignored"].append(tx_hash)
+        elif blocks.get(block_number) is None:
+            skipped["block not found"].append(tx_hash)
+        else:
+            deposits.append({
+                "from_address": tx["from"],
+                "blockchain_amount": int(calldata[74:138], 16),
+                "block_number": block_number,
+                "gno_tx_hash": tx_hash,
+                "gno_timestamp": datetime.fromtimestamp(int(blocks[block_number]["timestamp"], 16)),
+            })
+
+    return deposits, skipped
+
+
+def print_report(found, deposits, inserted, skipped, as_json):
+    if as_json:
+        print(json.dumps({
+            "found": found,
+            "valid": len(deposits),
+            "inserted": inserted,
+            "skipped": skipped,
+        }, indent=2))
+        return
+
+    print(f"{found} transactions checked, {len(deposits)} valid, {inserted} inserted")
+    for reason, hashes in sorted(skipped.items(), key=lambda s: -len(s[1])):
+        print(f"  skipped {len(hashes)}: {reason}")
+        for tx_hash in hashes:
+            print(f"    {tx_hash}")
+
+
+def add_arguments(parser):
+    parser.add_argument("--hash", action="append", help="gnosis transaction hash (can be repeated)")
+    parser.add_argument("--hash-file", help="file with one gnosis transaction hash per line")
+    parser.add_argument("--from-block", type=int, help="backfill every transfer to the multisig from this block")
+    parser.add_argument("--to-block", type=int, help="last block of the range (default: latest)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent rpc batches (default: 4)")
+    parser.add_argument("--batch-size", type=int, help="calls per json-rpc batch (default: the provider pool's)")
+    parser.add_argument("--dry-run", action="store_true", help="validate only, do not write to the db")
+    parser.add_argument("--json", action="store_true", help="output the report as json")
+
+
+def main(args):
+    if not (args.hash or args.hash_file or args.from_block is not None):
+        raise SystemExit("one of --hash, --hash-file or --from-block is required")
 
     # load config
     with open(os.path.normpath("config.json"), 'r') as f:
         config = json.load(f)
 
-    with sqlite3.connect(config["db_location"]) as db:
-        db.row_factory = lambda c, r: dict(zip([col[0] for col in c.description], r))
-        tx_exists_query = '''
-            select * from shuttle 
-            where gno_tx_hash = ?
-        '''
+    with shuttle_db.connect(config) as db:
         cur = db.cursor()
-        cur.execute(tx_exists_query, [TX_HASH])
-        tx_exists = cur.fetchall()
-
-    if tx_exists:
-        print('transaction has already been processed')
-        print(tx_exists)
-        exit(4)
-
-    w3 = Web3(Web3.HTTPProvider(os.getenv('ANKR_API_PROVIDER')))
-
-    if not w3.is_connected():
-        print('w3 not connected .. abort')
-        exit(4)
-
-    tx = w3.eth.get_transaction(TX_HASH)
-    receipt = w3.eth.get_transaction_receipt(TX_HASH)
-
-    if not receipt.status:
-        print('transaction is in a failed status')
-        exit(4)
-
-    block = int(tx['blockNumber'])
+        cur.execute("select lower(gno_tx_hash) from shuttle_all;")
+        saved = {r[0] for r in cur.fetchall()}
 
-    if block < SHUTTLE_START_BLOCK:
-        print('transaction submitted prior to shuttle starting')
-        exit(4)
+    # keep the order they were given in, but only check each transaction once
+    hashes = list(dict.fromkeys(h.lower() for h in read_hashes(args)))
+    skipped = defaultdict(list)
+    skipped["transaction has already been processed"] = [h for h in hashes if h in saved]
+    hashes = [h for h in hashes if h not in saved]
 
-    tx_block = w3.eth.get_block(block)
+    # every hash given has been processed already, no need for web3 or the rpc providers
+    if not hashes and args.from_block is None:
+        print_report(len(skipped["transaction has already been processed"]), [], 0,
+                     {reason: h for reason, h in skipped.items() if h}, args.json)
+        return
 
-    # get the number of confirmations
-    confirmations = int(w3.eth.block_number) - int(tx['blockNumber'])
+    from dotenv import load_dotenv
+    from rpc import http_session, provider_pool
 
-    if confirmations < 100:
-        print('< 100 confirmations')
-        exit(4)
-
-    tx_hash = tx_block['hash']
-    from_address = tx['from']
-
-    to_address = tx['to']
-    if to_address.lower() != config["multisig"]["gnosis"].lower():
-        print('transaction not sent to Multisig...')
-        exit(4)
+    # load .env file
+    load_dotenv()
 
-    timestamp = datetime.fromtimestamp(tx_block['timestamp'])
+    http_session.configure(config)
 
-    input = tx.input.hex()
+    w3 = provider_pool.get_web3("gnosis", config)
 
-    if not input[:10] == '0xa9059cbb':
-        print('not a transfer transaction')
+    if not w3.is_connected():
+        print('w3 not connected .. abort')
         exit(4)
 
-    blockchain_amount = int(input[74:], 16)
-    friendly_amount = w3.from_wei(blockchain_amount, "ether")
+    head = w3.eth.block_number
+
+    if args.from_block is not None:
+        in_range = hashes_in_block_range(w3, config, max(args.from_block, SHUTTLE_START_BLOCK),
+                                         args.to_block or head, args.workers)
+        in_range = [h.lower() for h in in_range]
+        skipped["transaction has already been processed"] += [h for h in in_range if h in saved]
+        hashes = list(dict.fromkeys(hashes + [h for h in in_range if h not in saved]))
+
+    checked = len(hashes) + len(skipped["transaction has already been processed"])
+    batch_size = args.batch_size or provider_pool.DEFAULT_BATCH_SIZE
+
+    # transactions and receipts in one round of batches, then the blocks they were mined in
+    pool = w3.provider
+    responses = batch(pool, [("eth_getTransactionByHash", [h]) for h in hashes] +
+                      [("eth_getTransactionReceipt", [h]) for h in hashes], args.workers, batch_size)
+    txs = {h: r.get("result") for h, r in zip(hashes, responses[:len(hashes)])}
+    receipts = {h: r.get("result") for h, r in zip(hashes, responses[len(hashes):])}
+
+    block_numbers = sorted({int(tx["blockNumber"], 16) for tx in txs.values() if tx and tx.get("blockNumber")})
+    responses = batch(pool, [("eth_getBlockByNumber", [hex(b), False]) for b in block_numbers], args.workers,
+                      batch_size)
+    blocks = {b: r.get("result") for b, r in zip(block_numbers, responses)}
+
+    deposits, invalid = validate(config, txs, receipts, blocks, head)
+    for reason, tx_hashes in invalid.items():
+        skipped[reason] += tx_hashes
+
+    inserted = 0
+    if deposits and not args.dry_run:
+        # every deposit goes in one transaction, either the whole backfill lands or none of it does
+        created_at = datetime.now()
+        with shuttle_db.connect(config) as db:
+            for d in deposits:
+                if shuttle_db.insert_deposit(db, d["from_address"], d["blockchain_amount"],
+                                             str(w3.from_wei(d["blockchain_amount"], "ether")), d["block_number"],
+                                             d["gno_tx_hash"], d["gno_timestamp"], created_at):
+                    inserted += 1
+                else:
+                    skipped["transaction has already been processed"].append(d["gno_tx_hash"])
+
+    print_report(checked, deposits, inserted, {reason: h for reason, h in skipped.items() if h}, args.json)
 
-    sql_insert = """
-        INSERT INTO shuttle (from_address, blockchain_amount, readable_amount, block_number,
-            gno_tx_hash, gno_timestamp, created_at)
-        SELECT ?, ?, ?, ?, ?, ?, ?
-        WHERE NOT EXISTS (select 1 from shuttle where gno_tx_hash = ?);
-    """
-
-    with sqlite3.connect(config["db_location"]) as db:
-        cur = db.cursor()
-        cur.execute(sql_insert, [from_address, blockchain_amount, friendly_amount, block,
-                                 tx_hash, timestamp, datetime.now(), tx_hash])
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="backfill shuttle deposits the indexer missed")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+
+from engine import exposure_snapshot, shuttle_db
+from rpc import json_stream
+
+USERS_URL = "https://ethtrader.github.io/donut.distribution/users.json"
+
+
+def read_users(users_file):
+    # [(username, address)] from users.json (downloaded unless a local copy is given), one entry per address
+    if users_file:
+        with open(users_file, 'rb') as f:
+            entries = list(json_stream.pick(json_stream.iter_array(iter(lambda: f.read(65536), b"")),
+                                            ("username", "address")))
+    else:
+        from rpc import http_session
+
+        _, chunks = http_session.get_stream(USERS_URL, "github")
+        entries = list(json_stream.pick(json_stream.iter_array(chunks), ("username", "address")))
+
+    users = {}
+    for username, address in entries:
+        if address:
+            users.setdefault(address.lower(), (username, address))
+    return list(users.values())
+
+
+def parse_blocks(values):
+    # --block chain=N, one per chain
+    blocks = {}
+    for value in values or []:
+        chain, _, block = value.partition("=")
+        if not block.isdigit():
+            raise ValueError(f"--block expects chain=N, got [{value}]")
+        blocks[chain] = int(block)
+    return blocks
+
+
+def add_arguments(parser):
+    parser.add_argument("--chain", action="append", dest="chains",
+                        help="chain to snapshot, repeat for several (default: mainnet and gnosis).  needs lp / staking "
+                             "contracts and rpc providers in config.json")
+    parser.add_argument("--block", action="append", dest="blocks", metavar="CHAIN=N",
+                        help="block to pin a chain's snapshot to (default: head - confirmations of that chain)")
+    parser.add_argument("--confirmations", type=int, default=100, help="used without --block (default: 100)")
+    parser.add_argument("--users-file", help="local copy of users.json")
+    parser.add_argument("--batch-size", type=int, help="calls per json-rpc batch (default: the provider pool's)")
+    parser.add_argument("--include-empty", action="store_true", help="also write users without any exposure")
+    parser.add_argument("--out", help="csv file (default: out/exposure_<chain>_<block>[_<chain>_<block>].csv)")
+
+
+def main(args):
+    from dotenv import load_dotenv
+    from rpc import http_session, provider_pool
+
+    # load .env file
+    load_dotenv()
+
+    # load config
+    with open(os.path.normpath("config.json"), 'r') as f:
+        config = json.load(f)
+
+    http_session.configure(config)
+
+    chains = args.chains or ["mainnet", "gnosis"]
+    blocks = parse_blocks(args.blocks)
+    users = read_users(args.users_file)
+
+    # every chain is pinned to its own block, the snapshots are merged into one row per user
+    snapshots = {}
+    for chain in chains:
+        w3 = provider_pool.get_web3(chain, config)
+        blocks.setdefault(chain, w3.eth.block_number - args.confirmations)
+        print(f"{len(users)} users, snapshot of [{chain}] at block {blocks[chain]}...")
+
+        snapshots[chain] = exposure_snapshot.snapshot(w3.provider, config["contracts"][chain], users, blocks[chain],
+                                                      args.batch_size or provider_pool.DEFAULT_BATCH_SIZE)
+
+    if len(chains) == 1:
+        columns, rows = exposure_snapshot.CSV_COLUMNS, snapshots[chains[0]]
+    else:
+        columns, rows = exposure_snapshot.merge(snapshots)
+
+    out = args.out or os.path.join("out", "exposure_" + "_".join(f"{c}_{blocks[c]}" for c in chains) + ".csv")
+    exposure_snapshot.write_csv(out, rows, args.include_empty, columns)
+
+    total = sum(r["total_donut_wei"] for r in rows)
+    print(f"  {out}: {sum(1 for r in rows if r['total_donut_wei'])} users with exposure, "
+          f"{shuttle_db.from_wei(total)} donut in total")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="per user donut exposure (wallet, lp, staked lp) at a pinned block")
+    add_arguments(parser)
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+import pytest
+
+from engine import exposure_snapshot, shuttle_db
+
+DONUT = "0x" + "d" * 40
+LP = "0x" + "1" * 40
+STAKING = "0x" + "5" * 40
+CONTRACTS = {"donut": DONUT, "lp": LP, "staking": STAKING}
+ALICE, BOB = "0x" + "a" * 40, "0x" + "b" * 40
+
+
+def _result(*words):
+    return "0x" + "".join(hex(w)[2:].rjust(64, "0") for w in words)
+
+
+class FakePool:
+    # answers eth_call batches from {(to, selector + args): words}, no data for anything else
+    def __init__(self, answers):
+        self.answers = answers
+
+    def batch_request(self, calls, batch_size=None):
+        responses = []
+        for method, (call, block) in calls:
+            words = self.answers.get((call["to"], call["data"]))
+            responses.append({"jsonrpc": "2.0", "id": len(responses),
+                              "result": _result(*words) if words is not None else "0x"})
+        return responses
+
+
+def _balance(token, address, amount):
+    return (token, exposure_snapshot.BALANCE_OF + address[2:].rjust(64, "0")), [amount]
+
+
+def chain(wallet, lp, staked):
+    # donut is token1 of the pair: 1000 donut in reserve for 100 lp
+    answers = {
+        (LP, exposure_snapshot.TOKEN0): [1],
+        (LP, exposure_snapshot.GET_RESERVES): [5, shuttle_db.to_wei(1000), 0],
+        (LP, exposure_snapshot.TOTAL_SUPPLY): [shuttle_db.to_wei(100)],
+    }
+    for token, balances in ((DONUT, wallet), (LP, lp), (STAKING, staked)):
+        answers.update(_balance(token, address, shuttle_db.to_wei(amount)) for address, amount in balances.items())
+    return FakePool(answers)
+
+
+def test_merge_sums_each_users_exposure_over_chains():
+    users = [("alice", ALICE), ("bob", BOB)]
+    mainnet = exposure_snapshot.snapshot(chain({ALICE: 1, BOB: 0}, {ALICE: 2, BOB: 0}, {ALICE: 0, BOB: 1}),
+                                         CONTRACTS, users, 100, 10)
+    gnosis = exposure_snapshot.snapshot(chain({ALICE: 3, BOB: 4}, {ALICE: 0, BOB: 0}, {ALICE: 0, BOB: 0}),
+                                        CONTRACTS, users, 200, 10)
+
+    columns, rows = exposure_snapshot.merge({"mainnet": mainnet, "gnosis": gnosis})
+    rows = {r["user"]: r for r in rows}
+
+    assert "mainnet_staked_lp_donut_wei" in columns and "gnosis_wallet_wei" in columns
+    assert rows["alice"]["mainnet_lp_donut_wei"] == shuttle_db.to_wei(20)
+    assert rows["alice"]["total_donut_wei"] == shuttle_db.to_wei(1 + 20 + 3)
+    assert rows["bob"]["total_donut_wei"] == shuttle_db.to_wei(10 + 4)
+    assert rows["bob"]["total_donut"] == "14"
+
+
+def test_empty_call_result_is_an_error():
+    pool = chain({}, {}, {})
+    with pytest.raises(Exception, match="returned no data"):
+        exposure_snapshot.snapshot(pool, CONTRACTS, [("alice", ALICE)], 100, 10)
@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+# claims every proof from engine/merkle_claim.py against contracts/MerkleClaim.sol on an in-process evm, so the leaf
+# encoding and pair ordering are checked against openzeppelin's MerkleProof rather than against the python tree
+# itself.  needs web3 with eth-tester (py-evm), py-solc-x with a solc 0.8 installed and openzeppelin contracts 4.x
+# (OPENZEPPELIN_PATH, or node_modules/@openzeppelin/contracts)
+pytest.importorskip("eth_tester")
+solcx = pytest.importorskip("solcx")
+web3 = pytest.importorskip("web3")
+
+from engine import merkle_claim  # noqa: E402
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPENZEPPELIN = os.getenv("OPENZEPPELIN_PATH") or os.path.join(REPO, "node_modules", "@openzeppelin", "contracts")
+
+# stands in for the token, records what the claim contract mints
+MINT_RECORDER = """
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+contract MintRecorder {
+    mapping(address => uint256) public minted;
+
+    function mint(address to, uint256 amount) external {
+        minted[to] += amount;
+    }
+}
+"""
+
+
+def compile_contracts():
+    if not os.path.isdir(OPENZEPPELIN):
+        pytest.skip("openzeppelin contracts not found")
+    if not solcx.get_installed_solc_versions():
+        pytest.skip("no solc installed")
+
+    with open(os.path.join(REPO, "contracts", "MerkleClaim.sol")) as f:
+        claim_source = f.read()
+
+    output = solcx.compile_standard({
+        "language": "Solidity",
+        "sources": {"MerkleClaim.sol": {"content": claim_source}, "MintRecorder.sol": {"content": MINT_RECORDER}},
+        "settings": {
+            "remappings": [f"@openzeppelin/contracts/={OPENZEPPELIN}/"],
+            "outputSelection": {"*": {"*": ["abi", "evm.bytecode.object"]}},
+        },
+    }, allow_paths=[REPO, OPENZEPPELIN])
+
+    def contract(source, name):
+        compiled = output["contracts"][source][name]
+        return compiled["abi"], compiled["evm"]["bytecode"]["object"]
+
+    return contract("MerkleClaim.sol", "MerkleClaim"), contract("MintRecorder.sol", "MintRecorder")
+
+
+def deploy(w3, abi, bytecode, *args):
+    tx_hash = w3.eth.contract(abi=abi, bytecode=bytecode).constructor(*args).transact()
+    address = w3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+    return w3.eth.contract(address=address, abi=abi)
+
+
+@pytest.fixture(scope="module")
+def compiled():
+    return compile_contracts()
+
+
+@pytest.fixture
+def chain(compiled):
+    (claim_abi, claim_bin), (token_abi, token_bin) = compiled
+
+    w3 = web3.Web3(web3.EthereumTesterProvider())
+    w3.eth.default_account = w3.eth.accounts[0]
+    token = deploy(w3, token_abi, token_bin)
+    claim = deploy(w3, claim_abi, claim_bin, token.address)
+    return w3, token, claim
+
+
+# an odd number of leaves, so the tree is not a perfect one
+ENTRIES = [(web3.Web3.to_checksum_address(f"0x{i + 1:040x}"), (i + 1) * 10 ** 18 + i) for i in range(7)]
+
+
+def test_every_proof_claims_on_chain(chain):
+    w3, token, claim = chain
+    root, claims = merkle_claim.build(ENTRIES, workers=1)
+    claim.functions.setMerkleRoot(root).transact()
+
+    for (account, amount), c in zip(ENTRIES, claims):
+        assert (c["account"], int(c["amount"])) == (account, amount)
+
+        claim.functions.claim(c["index"], account, amount, c["proof"]).transact()
+        assert claim.functions.isClaimed(c["index"]).call()
+        assert token.functions.minted(account).call() == amount
+
+
+def test_wrong_amount_is_rejected(chain):
+    w3, token, claim = chain
+    root, claims = merkle_claim.build(ENTRIES, workers=1)
+    claim.functions.setMerkleRoot(root).transact()
+
+    account, amount = ENTRIES[0]
+    with pytest.raises(Exception, match="Invalid proof"):
+        claim.functions.claim(claims[0]["index"], account, amount + 1, claims[0]["proof"]).transact()
@@ -0,0 +1,49 @@
+from web3 import Web3
+
+from engine import merkle_claim
+
+# a StandardMerkleTree.of(VALUES, ["uint256", "address", "uint256"]) known answer.  the root, leaves and proofs are
+# pinned so the leaf encoding, the leaf ordering and the tree layout are checked without solc or an evm
+VALUES = [
+    ("0x1111111111111111111111111111111111111111", 5 * 10 ** 18),
+    ("0x2222222222222222222222222222222222222222", 25 * 10 ** 17),
+    ("0x3333333333333333333333333333333333333333", 1),
+]
+ROOT = "0xdc1987d5d38a6fa45eed93a07d4048a8d604524bcbc1e743fbb5046f6d2d95a1"
+LEAVES = [
+    "0x006339a0971f8d293763c27967110607da32bf3548b17cce12da9fee72331612",
+    "0x191d0f7d65eab0fa6c201d27df14a838bda49373c2ccb0fa0263334fcebd4d0e",
+    "0x864aeed7b0b2280614a993529f60f945f555003ed8815ba2510661db9138c4e0",
+]
+PROOFS = [
+    [LEAVES[1], LEAVES[2]],
+    [LEAVES[0], LEAVES[2]],
+    ["0xd16896c5291f22b49599c38d37d92f80f4819709ebdd22205a937f9c9ac5d13a"],
+]
+
+
+def test_leaf_is_the_double_hash_of_the_abi_encoded_values():
+    for index, (account, amount) in enumerate(VALUES):
+        # abi.encode(uint256, address, uint256), every value padded to a 32 byte word
+        encoded = index.to_bytes(32, "big") + bytes.fromhex(account[2:]).rjust(32, b"\x00") + amount.to_bytes(32, "big")
+        assert Web3.keccak(Web3.keccak(encoded)) == merkle_claim.leaf(index, account, amount)
+        assert Web3.to_hex(merkle_claim.leaf(index, account, amount)) == LEAVES[index]
+
+
+def test_root_and_proofs_match_the_standard_merkle_tree():
+    root, claims = merkle_claim.build(VALUES, workers=1)
+
+    assert Web3.to_hex(root) == ROOT
+    assert [c["proof"] for c in claims] == PROOFS
+    for c in claims:
+        assert merkle_claim.verify(root, merkle_claim.leaf(c["index"], c["account"], int(c["amount"])),
+                                   [bytes.fromhex(p[2:]) for p in c["proof"]])
+
+
+def test_proof_file_finds_a_claim_by_address(tmp_path):
+    root, claims = merkle_claim.build(VALUES, workers=1)
+    path = str(tmp_path / "proofs.jsonl")
+    merkle_claim.write_proofs(path, root, claims, sum(amount for _, amount in VALUES))
+
+    assert merkle_claim.read_proof(path, VALUES[1][0].upper().replace("0X", "0x")) == claims[1]
+    assert merkle_claim.read_proof(path, "0x" + "4" * 40) is None
@@ -0,0 +1,77 @@
+import sqlite3
+
+from engine import shuttle_db
+
+# the shuttle table as it was before the status column (and the other migrated columns) existed
+BASELINE_SCHEMA = """
+    CREATE TABLE shuttle (
+        id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        from_user NVARCHAR2 COLLATE NOCASE,
+        from_address NVARCHAR2 NOT NULL COLLATE NOCASE,
+        blockchain_amount text NOT NULL,
+        readable_amount DECIMAL(8, 7) NOT NULL,
+        block_number INTEGER NOT NULL,
+        gno_tx_hash NVARCHAR2 NOT NULL COLLATE NOCASE,
+        arb_tx_hash NVARCHAR2 COLLATE NOCASE,
+        gno_timestamp DATETIME NOT NULL,
+        processed_at DATETIME,
+        notified_at DATETIME,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def baseline_db(rows):
+    db = sqlite3.connect(":memory:")
+    db.executescript(BASELINE_SCHEMA)
+    db.executemany("""
+        insert into shuttle (from_address, blockchain_amount, readable_amount, block_number, gno_tx_hash,
+            gno_timestamp, processed_at, notified_at, created_at)
+        values (?, ?, ?, 1, ?, '2024-01-01 00:00:00', ?, ?, ?);
+    """, [[f"0x{h}", str(shuttle_db.to_wei(amount)), amount, h, processed_at, notified_at, created_at]
+          for h, amount, processed_at, notified_at, created_at in rows])
+    return db
+
+
+def statuses(db):
+    return dict(db.execute("select gno_tx_hash, status from shuttle;").fetchall())
+
+
+ROWS = [
+    ("notified", 50, "2024-01-02", "2024-01-02", "2024-01-01 00:00:00"),
+    ("distributed", 50, "2024-01-02", None, "2024-01-01 00:00:00"),
+    ("queued", 50, None, None, "2024-03-01 00:00:00"),
+    ("old_small", 2, None, None, "2024-01-01 00:00:00"),
+    ("new_small", 2, None, None, "2024-03-01 00:00:00"),
+]
+
+
+def test_backfill_marks_sub_minimum_deposits_paid():
+    # the old lottery.py drew over every small deposit without recording it, so none are drawn again
+    db = baseline_db(ROWS)
+    shuttle_db.create_schema(db, 10)
+
+    assert statuses(db) == {
+        "notified": shuttle_db.NOTIFIED,
+        "distributed": shuttle_db.DISTRIBUTED,
+        "queued": shuttle_db.QUEUED,
+        "old_small": shuttle_db.LOTTERY_PAID,
+        "new_small": shuttle_db.LOTTERY_PAID,
+    }
+
+
+def test_backfill_keeps_deposits_after_the_cutoff_in_the_lottery():
+    db = baseline_db(ROWS)
+    shuttle_db.create_schema(db, 10, lottery_cutoff="2024-02-01 00:00:00")
+
+    assert statuses(db)["old_small"] == shuttle_db.LOTTERY_PAID
+    assert statuses(db)["new_small"] == shuttle_db.LOTTERY
+    assert statuses(db)["queued"] == shuttle_db.QUEUED
+
+
+def test_backfill_fills_amount_wei():
+    db = baseline_db(ROWS)
+    shuttle_db.create_schema(db, 10)
+
+    amounts = dict(db.execute("select gno_tx_hash, amount_wei from shuttle;").fetchall())
+    assert shuttle_db.blob_to_wei(amounts["old_small"]) == shuttle_db.to_wei(2)
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from engine import snapshot_file
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATION_CSV = os.path.join(REPO, "out", "final_gnosis_migration.csv")
+
+
+def test_csv_round_trip_is_byte_exact(tmp_path):
+    web3 = pytest.importorskip("web3")
+
+    snapshot_path, csv_path = tmp_path / "migration.snap", tmp_path / "migration.csv"
+    snapshot_file.from_csv(MIGRATION_CSV, snapshot_path)
+    snapshot_file.to_csv(snapshot_path, csv_path, web3.Web3.to_checksum_address)
+
+    with open(MIGRATION_CSV, 'rb') as original, open(csv_path, 'rb') as exported:
+        assert exported.read() == original.read()
+
+
+def test_close_with_records_still_held(tmp_path):
+    snapshot_path = tmp_path / "migration.snap"
+    snapshot_file.write(snapshot_path, [("a", "0x" + "11" * 20, 5), ("b", "0x" + "22" * 20, 0)])
+
+    with snapshot_file.Snapshot(snapshot_path) as snapshot:
+        address = snapshot.address(0)
+        batches = snapshot.batches(1, min_amount=0)
+        batch = next(batches)
+
+    # the file is closed, what was read from it is still usable
+    assert address == bytes.fromhex("11" * 20)
+    assert batch == [(address, 5)]
+
+
+def test_snapshot_records_the_csv_it_came_from(tmp_path):
+    csv_path, snapshot_path = tmp_path / "migration.csv", tmp_path / "migration.snap"
+    csv_path.write_text("user,address,contrib,contrib_gwei\na,0x" + "11" * 20 + ",5,5000000000000000000\n")
+    snapshot_file.from_csv(csv_path, snapshot_path)
+    assert snapshot_file.matches(snapshot_path, csv_path)
+
+    # the csv was regenerated, the snapshot is stale
+    csv_path.write_text("user,address,contrib,contrib_gwei\na,0x" + "11" * 20 + ",6,6000000000000000000\n")
+    assert not snapshot_file.matches(snapshot_path, csv_path)